@@ -1,120 +1,173 @@
-import bcrypt
-from database import connect_db
-
-def hash_password(password: str) -> str:
-    """Hashes a password using bcrypt."""
-    salt = bcrypt.gensalt()
-    hashed_password = bcrypt.hashpw(password.encode(), salt)
-    return hashed_password.decode()
-
-def verify_password(password: str, hashed_password: str) -> bool:
-    """Verifies if the entered password matches the hashed password."""
-    return bcrypt.checkpw(password.encode(), hashed_password.encode())
-
-def register_user(username: str, master_password: str):
-    """Registers a new user with a hashed master password."""
-    conn = connect_db()
-    cursor = conn.cursor()
-    
-    try:
-        # Check if username already exists
-        cursor.execute("SELECT id FROM users WHERE username = %s", (username,))
-        if cursor.fetchone():
-            return "❌ Username already exists. Try a different one."
-        
-        # Hash the master password before storing
-        hashed_password = hash_password(master_password)
-
-        # Insert new user into the database
-        cursor.execute("INSERT INTO users (username, master_password_hash) VALUES (%s, %s)", 
-                    (username, hashed_password))
-        conn.commit()
-
-        return f"✅ User '{username}' registered successfully!"
-
-    except Exception as e:
-        return f"⚠️ Error: {str(e)}"
-    
-    finally:
-        cursor.close()
-        conn.close()
-
-def login_user(username: str, master_password: str):
-    """Logs in a user by verifying the master password."""
-    conn = connect_db()
-    cursor = conn.cursor()
-    
-    try:
-        # Fetch user details from the database
-        cursor.execute("SELECT id, master_password_hash FROM users WHERE username = %s", (username,))
-        user = cursor.fetchone()
-
-        if user:
-            user_id, stored_hashed_password = user
-            if verify_password(master_password, stored_hashed_password):
-                return user_id, f"✅ Login successful! Welcome, {username}."
-            else:
-                return None, "❌ Incorrect username or password."
-        else:
-            return None, "❌ Incorrect username or password."
-
-    except Exception as e:
-        return None, f"⚠️ Error: {str(e)}"
-    
-    finally:
-        cursor.close()
-        conn.close()
-
-def delete_user_account(username: str):
-    """Deletes a user account and all stored passwords."""
-    conn = connect_db()
-    cursor = conn.cursor()
-    
-    try:
-        # Delete passwords first (to maintain database integrity)
-        cursor.execute("DELETE FROM passwords WHERE user_id = (SELECT id FROM users WHERE username = %s)", (username,))
-        
-        # Now delete the user
-        cursor.execute("DELETE FROM users WHERE username = %s", (username,))
-        
-        conn.commit()
-        
-        return f"🗑️ Account '{username}' and all stored passwords deleted successfully!"
-
-    except Exception as e:
-        return f"⚠️ Error: {str(e)}"
-    
-    finally:
-        cursor.close()
-        conn.close()
-
-def change_master_password(username: str, old_password: str, new_password: str):
-    """Allows a user to change their master password after verification."""
-    conn = connect_db()
-    cursor = conn.cursor()
-    
-    try:
-        # Fetch current hashed password
-        cursor.execute("SELECT master_password_hash FROM users WHERE username = %s", (username,))
-        user = cursor.fetchone()
-        
-        if user:
-            stored_hashed_password = user[0]
-            if verify_password(old_password, stored_hashed_password):
-                # Hash the new password
-                new_hashed_password = hash_password(new_password)
-                cursor.execute("UPDATE users SET master_password_hash = %s WHERE username = %s", 
-                               (new_hashed_password, username))
-                conn.commit()
-                return "🔑 Password changed successfully!"
-            else:
-                return "❌ Incorrect old password."
-
-        return "❌ Username not found."
-
-    except Exception as e:
-        return f"⚠️ Error: {str(e)}"
-    
-    finally:
-        cursor.close()
-        conn.close()
+import sys
+import time
+import bcrypt
+import config
+from metrics import timed
+from database import add_user, get_user_by_username, update_master_password, delete_user
+from keys import VaultLockedError, unlock_vault, rewrap_vault_key, lock_vault, upgrade_in_background
+from replica import get_replica, server_reachable, sync_in_background
+
+MIN_BCRYPT_ROUNDS = 10
+MAX_BCRYPT_ROUNDS = 20
+
+@timed("auth.hash_password")
+def hash_password(password: str, rounds: int = None) -> str:
+    """Hashes a password using bcrypt at the configured work factor."""
+    salt = bcrypt.gensalt(rounds=rounds or config.BCRYPT_ROUNDS)
+    hashed_password = bcrypt.hashpw(password.encode(), salt)
+    return hashed_password.decode()
+
+def get_hash_rounds(hashed_password: str) -> int:
+    """Returns the work factor encoded in a bcrypt hash ("$2b$<rounds>$...")."""
+    return int(hashed_password.split("$")[2])
+
+def needs_rehash(hashed_password: str) -> bool:
+    """Checks whether a stored hash was made with a different work factor than the current policy."""
+    try:
+        return get_hash_rounds(hashed_password) != config.BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+def measure_verify_time(rounds: int, samples: int = 3) -> float:
+    """Returns the best-of-n time in milliseconds to verify a hash with the given work factor."""
+    hashed_password = bcrypt.hashpw(b"calibration", bcrypt.gensalt(rounds=rounds))
+    best = float("inf")
+    for _ in range(samples):
+        start = time.perf_counter()
+        bcrypt.checkpw(b"calibration", hashed_password)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+def calibrate_bcrypt_rounds(target_ms: float = None, min_rounds: int = MIN_BCRYPT_ROUNDS,
+                            max_rounds: int = MAX_BCRYPT_ROUNDS) -> int:
+    """Picks the highest work factor whose verification on this host stays within target_ms."""
+    target_ms = target_ms or config.BCRYPT_TARGET_MS
+
+    # Each extra round doubles the cost, so measure once cheaply and extrapolate
+    base_ms = measure_verify_time(min_rounds)
+    rounds = min_rounds
+    while rounds < max_rounds and base_ms * 2 ** (rounds + 1 - min_rounds) <= target_ms:
+        rounds += 1
+
+    # Confirm the estimate with a real measurement and step down if it overshoots
+    while rounds > min_rounds and measure_verify_time(rounds, samples=1) > target_ms:
+        rounds -= 1
+    return rounds
+
+@timed("auth.verify_password")
+def verify_password(password: str, hashed_password: str) -> bool:
+    """Verifies if the entered password matches the hashed password."""
+    return bcrypt.checkpw(password.encode(), hashed_password.encode())
+
+def register_user(username: str, master_password: str):
+    """Registers a new user with a hashed master password."""
+    try:
+        # Check if username already exists
+        if get_user_by_username(username):
+            return "❌ Username already exists. Try a different one."
+
+        # Hash the master password before storing
+        hashed_password = hash_password(master_password)
+
+        # Insert new user into the database
+        if not add_user(username, hashed_password):
+            return "⚠️ Error: Could not register user."
+
+        return f"✅ User '{username}' registered successfully!"
+
+    except Exception as e:
+        return f"⚠️ Error: {str(e)}"
+
+def login_user(username: str, master_password: str, background: bool = True):
+    """Logs in a user by verifying the master password.
+
+    background=False skips the post-login row upgrade and replica sync (for benchmarks).
+    """
+    try:
+        # Fetch user details from the database
+        user = get_user_by_username(username)
+
+        if user:
+            user_id, stored_hashed_password = user
+            if verify_password(master_password, stored_hashed_password):
+                # Transparently upgrade hashes made under an older cost policy
+                if needs_rehash(stored_hashed_password):
+                    update_master_password(username, hash_password(master_password))
+                # Derive the vault key once per login; later operations use the cached key
+                try:
+                    unlock_vault(user_id, master_password)
+                except VaultLockedError as e:
+                    return None, f"❌ {e}"
+                if background:
+                    # Convert any entries still in the legacy ciphertext format
+                    upgrade_in_background(user_id)
+                    # Bring the local replica up to date, if one is configured
+                    sync_in_background(user_id)
+                return user_id, f"✅ Login successful! Welcome, {username}."
+            else:
+                return None, "❌ Incorrect username or password."
+        elif get_replica() is not None and not server_reachable():
+            return _login_offline(username, master_password, background)
+        else:
+            return None, "❌ Incorrect username or password."
+
+    except Exception as e:
+        return None, f"⚠️ Error: {str(e)}"
+
+def _login_offline(username: str, master_password: str, background: bool = True):
+    """Unlocks a vault from the local replica while the server cannot be reached."""
+    user_id = get_replica().login(username, master_password)
+    if user_id is None:
+        return None, "❌ Incorrect username or password."
+    if background:
+        # Retries the sync until the server is back, pushing the writes queued meanwhile
+        sync_in_background(user_id)
+    return user_id, f"📴 Offline login successful! Welcome, {username}. Changes will sync on reconnect."
+
+def delete_user_account(username: str):
+    """Deletes a user account and all stored passwords."""
+    try:
+        user = get_user_by_username(username)
+        if not delete_user(username):
+            return "⚠️ Error: Could not delete account."
+        if user:
+            lock_vault(user[0])
+
+        return f"🗑️ Account '{username}' and all stored passwords deleted successfully!"
+
+    except Exception as e:
+        return f"⚠️ Error: {str(e)}"
+
+def change_master_password(username: str, old_password: str, new_password: str):
+    """Allows a user to change their master password after verification."""
+    try:
+        # Fetch current hashed password
+        user = get_user_by_username(username)
+
+        if user:
+            user_id, stored_hashed_password = user
+            if verify_password(old_password, stored_hashed_password):
+                # Hash the new password and re-wrap the vault key under it
+                new_hashed_password = hash_password(new_password)
+                key_record = rewrap_vault_key(user_id, old_password, new_password)
+                if not update_master_password(username, new_hashed_password, key_record):
+                    return "⚠️ Error: Could not update password."
+                return "🔑 Password changed successfully!"
+            else:
+                return "❌ Incorrect old password."
+
+        return "❌ Username not found."
+
+    except Exception as e:
+        return f"⚠️ Error: {str(e)}"
+
+# Calibrate the bcrypt work factor for this host: python auth.py calibrate [target_ms]
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "calibrate":
+        target_ms = float(sys.argv[2]) if len(sys.argv) > 2 else config.BCRYPT_TARGET_MS
+        rounds = calibrate_bcrypt_rounds(target_ms)
+        path = config.save_setting("BCRYPT_ROUNDS", rounds)
+        print(f"✅ bcrypt cost {rounds} verifies in ~{measure_verify_time(rounds):.0f} ms "
+              f"(target {target_ms:.0f} ms). Saved to {path}.")
+    else:
+        print("Usage: python auth.py calibrate [target_ms]")
@@ -0,0 +1,401 @@
+"""Encrypted snapshot backups of the users and passwords tables, with parallel restore.
+
+    python backup.py snapshot full.pmsb
+    python backup.py snapshot monday.pmsb --since full.pmsb     # incremental
+    python backup.py verify full.pmsb monday.pmsb
+    python backup.py restore full.pmsb monday.pmsb
+
+Both tables are read in one consistent read transaction and streamed into chunks of
+SNAPSHOT_CHUNK_ROWS rows. Each chunk is zlib-compressed and AES-GCM encrypted under a
+passphrase-derived key (PBKDF2-HMAC-SHA256) on a thread pool while the next rows are
+read. The file ends with an encrypted content index of every chunk:
+
+    "PMSB" | version (1 byte) | salt (16 bytes) | iterations (4 bytes)
+    then chunks of: length (4 bytes) | nonce (12 bytes) | ciphertext + tag
+    then the index: nonce (12 bytes) | ciphertext + tag
+    then the footer: index offset (8 bytes) | index length (4 bytes) | "PMSE"
+
+Chunks authenticate the header and their number, and the index authenticates the
+header and lists every chunk's offset, so a tampered, reordered or truncated file is
+rejected. Nothing about the schema or the data is readable without the passphrase.
+
+An incremental snapshot holds every user but only passwords updated since its base
+snapshot was taken, plus the ids of all live rows so deletions are restored too. Restore
+makes both tables match the last snapshot of a chain: rows missing from it are deleted,
+then chunks are decrypted and written in parallel. Rows are written one transaction per
+chunk and lane, and a user's passwords always share a lane that one thread writes at a
+time. Memory stays bounded by a few chunks per worker, and an interrupted restore can be
+rerun.
+"""
+import argparse
+import base64
+import json
+import os
+import struct
+import sys
+import threading
+import uuid
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+from getpass import getpass
+from itertools import islice
+import config
+import database
+from database import (SCHEMA_VERSION, SNAPSHOT_TABLES, current_timestamp, delete_rows, get_backend, iter_ids,
+                      restore_rows, snapshot_connection, stream_table, table_columns)
+from encryption import NONCE_SIZE
+from keys import SALT_SIZE, derive_key
+
+SNAPSHOT_MAGIC = b"PMSB"
+SNAPSHOT_END = b"PMSE"
+SNAPSHOT_VERSION = 1
+_HEADER = struct.Struct(">4sB16sI")  # magic, version, salt, iterations
+_CHUNK_LENGTH = struct.Struct(">I")
+_CHUNK_AAD = struct.Struct(">Q")  # chunk number
+_FOOTER = struct.Struct(">QI4s")  # index offset, index length, end magic
+_INDEX_AAD = b"index"
+
+# Id lists are small per row, so they are chunked more coarsely than table rows
+ID_CHUNK_ROWS = 50000
+
+class SnapshotError(Exception):
+    """Raised for snapshot files that cannot be read (wrong passphrase, corrupt or out-of-order chain)."""
+
+def _encode(value):
+    # JSON has no bytes or timestamps; ciphertexts and fingerprints are bytes
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"$b": base64.b64encode(value).decode()}
+    if isinstance(value, (datetime, date)):
+        return str(value)
+    raise TypeError(f"Cannot store {type(value).__name__} in a snapshot.")
+
+def _decode(record: dict):
+    return base64.b64decode(record["$b"]) if "$b" in record else record
+
+def _batches(rows, size: int):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+class _ChunkWriter:
+    """Seals chunks on a thread pool and appends them to the file in order, a few in flight at a time."""
+
+    def __init__(self, f, pool, aesgcm, header: bytes, level: int, depth: int):
+        self.f, self.pool, self.aesgcm, self.header, self.level, self.depth = f, pool, aesgcm, header, level, depth
+        self.entries = []
+        self._pending = deque()  # (entry, future)
+
+    def add(self, table: str, kind: str, rows: list, first_id: int, last_id: int):
+        number = len(self.entries) + len(self._pending)
+        entry = {"number": number, "table": table, "kind": kind, "rows": len(rows),
+                 "first_id": first_id, "last_id": last_id}
+        self._pending.append((entry, self.pool.submit(self._seal, number, rows)))
+        while len(self._pending) > self.depth:
+            self._write_next()
+
+    def _seal(self, number: int, rows: list) -> bytes:
+        payload = zlib.compress(json.dumps(rows, default=_encode, separators=(",", ":")).encode(), self.level)
+        nonce = os.urandom(NONCE_SIZE)
+        return nonce + self.aesgcm.encrypt(nonce, payload, self.header + _CHUNK_AAD.pack(number))
+
+    def _write_next(self):
+        entry, future = self._pending.popleft()
+        sealed = future.result()
+        entry["offset"], entry["length"] = self.f.tell(), len(sealed)
+        self.f.write(_CHUNK_LENGTH.pack(len(sealed)) + sealed)
+        self.entries.append(entry)
+
+    def finish(self) -> list:
+        while self._pending:
+            self._write_next()
+        return self.entries
+
+def take_snapshot(path: str, passphrase: str, since_path: str = None, chunk_rows: int = None,
+                  workers: int = None, verbose: bool = True) -> dict:
+    """Writes a snapshot of the users and passwords tables to path; returns its index.
+
+    With since_path (a snapshot taken with the same passphrase), only passwords updated
+    since that one was taken are stored. The file is written beside path and moved into
+    place once complete, readable by its owner only. Database errors are raised.
+    """
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    chunk_rows = chunk_rows or config.SNAPSHOT_CHUNK_ROWS
+    workers = workers or config.SNAPSHOT_WORKERS
+    base = None
+    if since_path:
+        with Snapshot(since_path, passphrase) as previous:
+            base = previous.index
+
+    salt = os.urandom(SALT_SIZE)
+    header = _HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, salt, config.KDF_ITERATIONS)
+    aesgcm = AESGCM(derive_key(passphrase, salt, config.KDF_ITERATIONS))
+
+    partial_path = path + ".partial"
+    try:
+        with os.fdopen(os.open(partial_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f, \
+                ThreadPoolExecutor(max_workers=workers) as pool, snapshot_connection() as conn:
+            f.write(header)
+            index = {
+                "snapshot_id": uuid.uuid4().hex,
+                "base_id": base["snapshot_id"] if base else None,
+                "taken_at": current_timestamp(conn),
+                "since": base["taken_at"] if base else None,
+                "created": datetime.now(timezone.utc).isoformat(),
+                "schema_version": SCHEMA_VERSION,
+                "backend": get_backend().name,
+                "columns": {},
+                "rows": {},
+            }
+            writer = _ChunkWriter(f, pool, aesgcm, header, config.SNAPSHOT_COMPRESSION_LEVEL, 2 * workers)
+            for table in SNAPSHOT_TABLES:
+                columns = index["columns"][table] = table_columns(conn, table)
+                id_position = columns.index("id")
+                since = index["since"] if "updated_at" in columns else None
+                count = 0
+                for rows in _batches(stream_table(conn, table, columns, since), chunk_rows):
+                    writer.add(table, "rows", rows, rows[0][id_position], rows[-1][id_position])
+                    count += len(rows)
+                index["rows"][table] = count
+                for ids in _batches((row[0] for row in stream_table(conn, table, ["id"])), ID_CHUNK_ROWS):
+                    writer.add(table, "ids", ids, ids[0], ids[-1])
+                if verbose:
+                    print(f"  {table}: {count} rows")
+            index["chunks"] = writer.finish()
+
+            nonce = os.urandom(NONCE_SIZE)
+            sealed_index = nonce + aesgcm.encrypt(nonce, zlib.compress(json.dumps(index).encode()),
+                                                  header + _INDEX_AAD)
+            index_offset = f.tell()
+            f.write(sealed_index + _FOOTER.pack(index_offset, len(sealed_index), SNAPSHOT_END))
+        os.replace(partial_path, path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return index
+
+class Snapshot:
+    """An open snapshot file whose index has been authenticated; chunks are read on demand."""
+
+    def __init__(self, path: str, passphrase: str):
+        from cryptography.exceptions import InvalidTag
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        self.path = path
+        self._fd = os.open(path, os.O_RDONLY)
+        try:
+            size = os.fstat(self._fd).st_size
+            self.header = os.pread(self._fd, _HEADER.size, 0)
+            if len(self.header) < _HEADER.size or size < _HEADER.size + _FOOTER.size:
+                raise SnapshotError(f"{path} is truncated.")
+            magic, version, salt, iterations = _HEADER.unpack(self.header)
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                raise SnapshotError(f"{path} is not a snapshot, or is from a newer version.")
+            index_offset, index_length, end = _FOOTER.unpack(os.pread(self._fd, _FOOTER.size, size - _FOOTER.size))
+            if end != SNAPSHOT_END or index_offset + index_length + _FOOTER.size != size:
+                raise SnapshotError(f"{path} is truncated.")
+
+            self._aesgcm = AESGCM(derive_key(passphrase, salt, iterations))
+            sealed = os.pread(self._fd, index_length, index_offset)
+            try:
+                plaintext = self._aesgcm.decrypt(sealed[:NONCE_SIZE], sealed[NONCE_SIZE:], self.header + _INDEX_AAD)
+            except InvalidTag:
+                raise SnapshotError(f"Wrong passphrase, or {path} has been modified.")
+            self.index = json.loads(zlib.decompress(plaintext))
+        except BaseException:
+            os.close(self._fd)
+            raise
+
+    def chunks(self, table: str, kind: str = "rows") -> list:
+        return [entry for entry in self.index["chunks"] if entry["table"] == table and entry["kind"] == kind]
+
+    def read_chunk(self, entry: dict) -> list:
+        """Decrypts and decodes one chunk; safe to call from several threads at once."""
+        from cryptography.exceptions import InvalidTag
+
+        data = os.pread(self._fd, _CHUNK_LENGTH.size + entry["length"], entry["offset"])
+        if len(data) < _CHUNK_LENGTH.size or _CHUNK_LENGTH.unpack_from(data)[0] != entry["length"]:
+            raise SnapshotError(f"Chunk {entry['number']} of {self.path} is missing or truncated.")
+        sealed = memoryview(data)[_CHUNK_LENGTH.size:]
+        try:
+            payload = self._aesgcm.decrypt(bytes(sealed[:NONCE_SIZE]), bytes(sealed[NONCE_SIZE:]),
+                                           self.header + _CHUNK_AAD.pack(entry["number"]))
+        except InvalidTag:
+            raise SnapshotError(f"Chunk {entry['number']} of {self.path} failed authentication.")
+        rows = json.loads(zlib.decompress(payload), object_hook=_decode)
+        if len(rows) != entry["rows"]:
+            raise SnapshotError(f"Chunk {entry['number']} of {self.path} does not match the index.")
+        return rows
+
+    def close(self):
+        os.close(self._fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def open_chain(paths: list, passphrase: str) -> list:
+    """Opens a full snapshot and the incrementals taken on top of it, checking they follow on."""
+    snapshots = []
+    try:
+        for path in paths:
+            snapshot = Snapshot(path, passphrase)
+            snapshots.append(snapshot)
+            base_id = snapshot.index["base_id"]
+            if len(snapshots) == 1 and base_id:
+                raise SnapshotError(f"{path} is incremental; restore its full snapshot first.")
+            if len(snapshots) > 1 and base_id != snapshots[-2].index["snapshot_id"]:
+                raise SnapshotError(f"{path} was not taken on top of {snapshots[-2].path}.")
+            if snapshot.index["schema_version"] > SCHEMA_VERSION:
+                raise SnapshotError(f"{path} is from a newer schema (version {snapshot.index['schema_version']}).")
+    except BaseException:
+        for snapshot in snapshots:
+            snapshot.close()
+        raise
+    return snapshots
+
+def verify_chain(paths: list, passphrase: str, workers: int = None) -> dict:
+    """Decrypts every chunk of a chain without writing anything; returns {table: rows}."""
+    workers = workers or config.SNAPSHOT_WORKERS
+    totals = dict.fromkeys(SNAPSHOT_TABLES, 0)
+    snapshots = open_chain(paths, passphrase)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for snapshot in snapshots:
+                entries = snapshot.index["chunks"]
+                for entry, rows in zip(entries, pool.map(lambda entry: len(snapshot.read_chunk(entry)), entries)):
+                    if entry["kind"] == "rows":
+                        totals[entry["table"]] += rows
+    finally:
+        for snapshot in snapshots:
+            snapshot.close()
+    return totals
+
+def _delete_missing(snapshot: Snapshot, table: str) -> int:
+    """Deletes rows whose ids the snapshot does not list, merging both sorted id streams."""
+    kept = (row_id for entry in snapshot.chunks(table, "ids") for row_id in snapshot.read_chunk(entry))
+    next_kept = next(kept, None)
+    stale = []
+    for row_id in iter_ids(table):
+        while next_kept is not None and next_kept < row_id:
+            next_kept = next(kept, None)
+        if next_kept != row_id:
+            stale.append(row_id)
+    return delete_rows(table, stale) if stale else 0
+
+def _restore_chunk(snapshot: Snapshot, table: str, columns: list, entry: dict, lanes: list) -> int:
+    """Writes one chunk, one transaction per lane, holding each lane's lock while writing to it.
+
+    Rows that could take over each other's unique key must not be written concurrently:
+    a user's passwords (by user_id) share a lane, and usernames can move between any two
+    ids, so all users go through the first lane.
+    """
+    rows = snapshot.read_chunk(entry)
+    by_lane = {}
+    if table == "passwords":
+        position = columns.index("user_id")
+        for row in rows:
+            by_lane.setdefault(row[position] % len(lanes), []).append(row)
+    elif rows:
+        by_lane[0] = rows
+    written = 0
+    for lane, lane_rows in sorted(by_lane.items()):
+        with lanes[lane]:
+            written += restore_rows(table, columns, lane_rows)
+    return written
+
+def restore_chain(paths: list, passphrase: str, workers: int = None, verbose: bool = True) -> dict:
+    """Makes the users and passwords tables match the last snapshot of a chain; returns {table: rows written}.
+
+    Database errors and unreadable chunks are raised; chunks written before the error are
+    kept, and running the restore again finishes it.
+    """
+    workers = workers or config.SNAPSHOT_WORKERS
+    written = dict.fromkeys(SNAPSHOT_TABLES, 0)
+    snapshots = open_chain(paths, passphrase)
+    try:
+        lanes = [threading.Lock() for _ in range(workers)]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for snapshot in snapshots:
+                # Deleting first means a website deleted and stored again cannot collide with its old row
+                deleted = sum(_delete_missing(snapshot, table) for table in reversed(SNAPSHOT_TABLES))
+                for table in SNAPSHOT_TABLES:
+                    columns = snapshot.index["columns"][table]
+                    restore_chunk = lambda entry: _restore_chunk(snapshot, table, columns, entry, lanes)
+                    written[table] += sum(pool.map(restore_chunk, snapshot.chunks(table)))
+                if verbose:
+                    print(f"  {snapshot.path}: " + ", ".join(f"{snapshot.index['rows'][t]} {t}" for t in SNAPSHOT_TABLES)
+                          + f" written, {deleted} rows deleted")
+    finally:
+        for snapshot in snapshots:
+            snapshot.close()
+    return written
+
+def _passphrase(confirm: bool = False) -> str:
+    passphrase = os.getenv("PM_BACKUP_PASSPHRASE")
+    if passphrase:
+        return passphrase
+    passphrase = getpass("Backup passphrase: ")
+    if confirm and getpass("Repeat the backup passphrase: ") != passphrase:
+        print("❌ Passphrases do not match.")
+        return None
+    return passphrase
+
+def print_index(path: str, passphrase: str):
+    with Snapshot(path, passphrase) as snapshot:
+        index = snapshot.index
+        kind = f"incremental since {index['since']}" if index["base_id"] else "full"
+        print(f"Snapshot {index['snapshot_id']} ({kind}), taken {index['taken_at']} from {index['backend']} "
+              f"at schema version {index['schema_version']}")
+        for table in SNAPSHOT_TABLES:
+            chunks = snapshot.chunks(table)
+            stored = sum(entry["length"] for entry in chunks)
+            print(f"  {table}: {index['rows'][table]} rows in {len(chunks)} chunks ({stored / 2 ** 20:.1f} MiB), "
+                  f"{sum(entry['rows'] for entry in snapshot.chunks(table, 'ids'))} live ids")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Encrypted snapshot backups of the password database.")
+    parser.add_argument("command", choices=("snapshot", "verify", "restore", "index"))
+    parser.add_argument("paths", nargs="+", help="Snapshot file to write, or the chain to read (full first)")
+    parser.add_argument("--since", help="Take an incremental snapshot on top of this one")
+    parser.add_argument("--chunk-rows", type=int, help=f"Rows per chunk (default {config.SNAPSHOT_CHUNK_ROWS})")
+    parser.add_argument("--workers", type=int, help=f"Chunks processed at once (default {config.SNAPSHOT_WORKERS})")
+    parser.add_argument("--yes", action="store_true", help="Restore without asking for confirmation")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "snapshot":
+            if len(args.paths) != 1:
+                parser.error("snapshot writes exactly one file")
+            passphrase = _passphrase(confirm=not args.since)
+            if not passphrase:
+                sys.exit(1)
+            index = take_snapshot(args.paths[0], passphrase, args.since, args.chunk_rows, args.workers)
+            kind = "incremental snapshot" if args.since else "snapshot"
+            print(f"✅ Wrote {kind} of {index['rows']['users']} users and {index['rows']['passwords']} "
+                  f"passwords to {args.paths[0]}.")
+        elif args.command == "index":
+            for path in args.paths:
+                print_index(path, _passphrase())
+        elif args.command == "verify":
+            totals = verify_chain(args.paths, _passphrase(), args.workers)
+            print(f"✅ Every chunk is intact ({totals['users']} user and {totals['passwords']} password rows).")
+        else:
+            if not args.yes and input("⚠️ This replaces every user and stored password in the database. "
+                                      "Continue? (y/n): ").strip().lower() != "y":
+                sys.exit(1)
+            written = restore_chain(args.paths, _passphrase(), args.workers)
+            print(f"✅ Restored {written['users']} user and {written['passwords']} password rows.")
+    except (OSError, SnapshotError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    except database.DB_ERRORS as err:
+        print(f"❌ Database error: {err}")
+        sys.exit(1)
@@ -0,0 +1,144 @@
+"""Runs newline-delimited JSON commands against one unlocked vault.
+
+    PM_MASTER_PASSWORD=... python main.py batch --user alice < commands.ndjson
+
+Each input line is one command and produces one output line, in input order:
+
+    {"op": "put", "website": "example.com", "password": "..."}  -> {"ok": true}
+    {"op": "get", "website": "example.com"}                      -> {"ok": true, "password": "..."}
+    {"op": "delete", "website": "example.com"}                   -> {"ok": true}
+    {"op": "list"}                                               -> {"ok": true, "websites": [...]}
+    {"op": "search", "query": "exa", "limit": 10}                -> {"ok": true, "websites": [...]}
+    {"op": "commit"}                                             -> {"ok": true}
+
+Failures are {"ok": false, "error": "..."}, and an "id" field in a command is echoed back.
+Puts and deletes are queued and written together in one transaction when BATCH_SIZE of
+them have built up, before the next read, on "commit", and at the end of the input, so
+their results arrive in bursts.
+"""
+import json
+from config import BATCH_SIZE
+import database
+from database import UnitOfWork, get_websites
+from encryption import encrypt_many, fingerprint_many
+from keys import get_user_key
+from search import search
+from session_cache import lookup_password
+
+class BatchRunner:
+    """Executes batch commands for one logged-in user, writing results to `out`."""
+
+    def __init__(self, user_id: int, out, batch_size: int = BATCH_SIZE):
+        self.user_id = user_id
+        self.out = out
+        self.batch_size = max(1, batch_size)
+        self._pending = []  # (command, action, website, password) writes not yet committed
+        self.succeeded = 0
+        self.failed = 0
+
+    def run(self, lines) -> bool:
+        """Runs every command in lines; returns True if all of them succeeded."""
+        for line in lines:
+            if line.strip():
+                self.handle(line)
+        self.flush()
+        return self.failed == 0
+
+    def handle(self, line: str):
+        try:
+            command = json.loads(line)
+        except ValueError:
+            command = None
+        op = command.get("op") if isinstance(command, dict) else None
+
+        if op in ("put", "delete"):
+            website = _text(command, "website")
+            password = _text(command, "password") if op == "put" else None
+            if website is not None and (op == "delete" or password is not None):
+                self._pending.append((command, op, website, password))
+                if len(self._pending) >= self.batch_size:
+                    self.flush()
+                return
+
+        # Everything else is answered now; queued writes go first, so reads see them and
+        # responses stay in input order
+        self.flush()
+        if not isinstance(command, dict):
+            self._respond({}, {"ok": False, "error": "Command must be a JSON object."})
+        elif op in ("put", "delete"):
+            self._respond(command, {"ok": False, "error": "Missing or invalid field: website or password"})
+        elif op == "get":
+            website = _text(command, "website")
+            secret = lookup_password(self.user_id, website) if website else None
+            if secret is None:
+                self._respond(command, {"ok": False, "error": "No password found for this website."})
+            elif secret.startswith("⚠️"):
+                self._respond(command, {"ok": False, "error": secret})
+            else:
+                self._respond(command, {"ok": True, "password": secret})
+        elif op == "list":
+            self._respond(command, {"ok": True, "websites": get_websites(self.user_id)})
+        elif op == "search":
+            query, limit = _text(command, "query"), command.get("limit", 50)
+            if query is None or not isinstance(limit, int):
+                self._respond(command, {"ok": False, "error": "Missing or invalid field: query or limit"})
+            else:
+                self._respond(command, {"ok": True, "websites": search(self.user_id, query, limit)})
+        elif op == "commit":
+            self._respond(command, {"ok": True})
+        else:
+            self._respond(command, {"ok": False, "error": f"Unknown op: {op!r}"})
+        self.out.flush()
+
+    def flush(self):
+        """Encrypts and writes the queued puts and deletes in one transaction."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+
+        puts = [entry for entry in pending if entry[1] == "put"]
+        key = get_user_key(self.user_id)
+        ciphertexts = iter(encrypt_many((entry[3] for entry in puts), key=key))
+        fingerprints = iter(fingerprint_many((entry[3] for entry in puts), key))
+        work, errors = UnitOfWork(), {}
+        for entry in pending:
+            if entry[1] == "delete":
+                work.delete_password(self.user_id, entry[2])
+                continue
+            encrypted_password, fingerprint = next(ciphertexts), next(fingerprints)
+            if isinstance(encrypted_password, str):  # An error message rather than a record
+                errors[id(entry)] = encrypted_password
+            else:
+                work.add_password(self.user_id, entry[2], encrypted_password, fingerprint)
+
+        try:
+            results = iter(work.commit())
+        except database.DB_ERRORS as err:
+            print(f"❌ Error applying writes: {err}")
+            results = iter([None] * len(pending))
+        for entry in pending:
+            command = entry[0]
+            if id(entry) in errors:
+                self._respond(command, {"ok": False, "error": errors[id(entry)]})
+                continue
+            applied = next(results)
+            if applied is None:
+                self._respond(command, {"ok": False, "error": "Database error; the batch was not written."})
+            elif not applied:
+                self._respond(command, {"ok": False, "error": "No password found for this website."})
+            else:
+                self._respond(command, {"ok": True})
+        self.out.flush()
+
+    def _respond(self, command: dict, response: dict):
+        if "id" in command:
+            response["id"] = command["id"]
+        if response["ok"]:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+        self.out.write(json.dumps(response) + "\n")
+
+def _text(command: dict, name: str):
+    value = command.get(name)
+    return value if isinstance(value, str) and value else None
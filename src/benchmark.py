@@ -0,0 +1,306 @@
+"""Benchmarks for the crypto, auth and storage hot paths.
+
+Runs entirely offline against a throwaway SQLite vault, so it needs no database server:
+
+    python benchmark.py --out results.json
+    python benchmark.py --quick --baseline results.json --fail-on-regression
+    python benchmark.py --only startup --importtime
+
+Results are written as JSON. When a baseline is given, each median is compared with the
+baseline's and anything slower than the threshold is reported as a regression. The startup
+group also reports any entry point that loads a package it should defer (DEFERRED_IMPORTS);
+--fail-on-regression fails on those too.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+DEFAULT_SIZES = (10, 100, 1000, 10000, 100000)
+QUICK_SIZES = (10, 100, 1000)
+
+# Entry points whose cold start is timed, as the statement a fresh interpreter runs
+STARTUP_TARGETS = {
+    "cli": "import main",
+    "server": "import server",
+    "gui": "import gui",
+}
+
+# Heavy packages each entry point must leave unloaded until a command needs them
+DEFERRED_IMPORTS = {
+    "cli": ("bcrypt", "cryptography", "mysql", "PyQt6"),
+    "server": ("cryptography", "mysql", "PyQt6"),
+    "gui": ("cryptography", "mysql"),
+}
+
+def configure_environment(args):
+    """Points the app at a temporary SQLite vault; must run before project modules are imported."""
+    workdir = tempfile.mkdtemp(prefix="pm-bench-")
+    os.environ["DB_BACKEND"] = "sqlite"
+    os.environ["SQLITE_PATH"] = os.path.join(workdir, "bench.db")
+    os.environ.setdefault("AES_KEY", os.urandom(16).hex())
+    if args.bcrypt_rounds:
+        os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    if args.kdf_iterations:
+        os.environ["KDF_ITERATIONS"] = str(args.kdf_iterations)
+    # Keep the process pool out of single-op numbers unless asked for
+    os.environ.setdefault("CRYPTO_PARALLEL_THRESHOLD", "0")
+    # The temporary vault has no replica to sync
+    os.environ.pop("REPLICA_PATH", None)
+    return workdir
+
+def measure(fn, repeat: int, items: int = 1) -> dict:
+    """Times fn() `repeat` times and summarizes per-item latency and throughput."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    median = statistics.median(samples)
+    return {
+        "items": items,
+        "repeat": repeat,
+        "median_s": median,
+        "min_s": min(samples),
+        "mean_s": statistics.fmean(samples),
+        "per_item_us": median / items * 1e6,
+        "items_per_s": items / median if median else float("inf"),
+    }
+
+class Suite:
+    def __init__(self, sizes, repeat):
+        self.sizes = sizes
+        self.repeat = repeat
+        self.results = {}
+        self.record_sizes = {}
+
+    def run(self, name: str, fn, repeat: int = None, items: int = 1):
+        result = measure(fn, repeat or self.repeat, items)
+        self.results[name] = result
+        print(f"{name:<40} {result['per_item_us']:>12.2f} us/item {result['items_per_s']:>14.0f} items/s")
+
+def bench_crypto(suite, key):
+    from encryption import (encrypt_password, decrypt_password, encrypt_many, decrypt_many,
+                            _encrypt_cbc_chunk, _decrypt_cbc_chunk)
+
+    ciphertext = encrypt_password("correct horse battery staple", key)
+    suite.run("crypto.encrypt_password", lambda: encrypt_password("correct horse battery staple", key), 2000)
+    suite.run("crypto.decrypt_password", lambda: decrypt_password(ciphertext, key), 2000)
+
+    for size in suite.sizes:
+        passwords = [f"password-{i}" for i in range(size)]
+        ciphertexts = encrypt_many(passwords, key=key)
+        repeat = max(3, min(suite.repeat, 100000 // size))
+        suite.run(f"crypto.encrypt_many[{size}]", lambda: encrypt_many(passwords, key=key), repeat, size)
+        suite.run(f"crypto.decrypt_many[{size}]", lambda: decrypt_many(ciphertexts, key=key), repeat, size)
+        # The base64 AES-CBC format that versioned AES-GCM records replaced, for comparison
+        legacy = _encrypt_cbc_chunk(passwords, key)
+        suite.run(f"crypto.legacy_cbc.encrypt[{size}]", lambda: _encrypt_cbc_chunk(passwords, key), repeat, size)
+        suite.run(f"crypto.legacy_cbc.decrypt[{size}]", lambda: _decrypt_cbc_chunk(legacy, key), repeat, size)
+
+    for length in (8, 16, 32, 64, 128):
+        password = "x" * length
+        legacy_bytes, record_bytes = len(_encrypt_cbc_chunk([password], key)[0]), len(encrypt_password(password, key))
+        suite.record_sizes[length] = {"legacy_cbc": legacy_bytes, "aes_gcm_v1": record_bytes}
+        print(f"{f'record size [{length} char password]':<40} {legacy_bytes:>6} B legacy CBC  {record_bytes:>6} B AES-GCM v1")
+
+def bench_auth(suite):
+    import config
+    from auth import hash_password, verify_password
+    from keys import derive_key
+
+    hashed_password = hash_password("master")
+    suite.run(f"auth.hash_password[cost={config.BCRYPT_ROUNDS}]", lambda: hash_password("master"), 3)
+    suite.run(f"auth.verify_password[cost={config.BCRYPT_ROUNDS}]", lambda: verify_password("master", hashed_password), 3)
+    suite.run(f"keys.derive_key[{config.KDF_ITERATIONS}]",
+              lambda: derive_key("master", b"0123456789abcdef", config.KDF_ITERATIONS), 3)
+
+def populate(user_id: int, key: bytes, size: int):
+    """Replaces a user's vault with `size` fully upgraded entries in one transaction."""
+    from database import get_connection, execute, get_backend
+    from encryption import encrypt_many, fingerprint_many
+
+    passwords = [f"password-{i}" for i in range(size)]
+    rows = zip(encrypt_many(passwords, key=key), fingerprint_many(passwords, key))
+    with get_connection() as conn:
+        execute(conn, "DELETE FROM passwords WHERE user_id = %s", (user_id,)).close()
+        cursor = conn.cursor()
+        cursor.executemany(get_backend().sql(
+            "INSERT INTO passwords (user_id, website, encrypted_password, fingerprint) VALUES (%s, %s, %s, %s)"),
+            [(user_id, f"site-{i:07d}.example", c, f) for i, (c, f) in enumerate(rows)])
+        cursor.close()
+        conn.commit()
+
+def bench_storage(suite, user_id, key):
+    from collections import deque
+    from database import add_password, get_password, delete_password, get_passwords, get_passwords_page, iter_passwords
+    from encryption import encrypt_password
+
+    ciphertext = encrypt_password("secret", key)
+    counter = iter(range(10 ** 9))
+
+    def add_then_delete():
+        website = f"single-{next(counter)}"
+        add_password(user_id, website, ciphertext)
+        delete_password(user_id, website)
+
+    for size in suite.sizes:
+        populate(user_id, key, size)
+        repeat = max(3, min(suite.repeat, 100000 // size))
+        target = f"site-{size // 2:07d}.example"
+        suite.run(f"db.get_password[{size}]", lambda: get_password(user_id, target), 200)
+        suite.run(f"db.add+delete_password[{size}]", add_then_delete, 100)
+        suite.run(f"db.get_passwords[{size}]", lambda: get_passwords(user_id), repeat, size)
+        suite.run(f"db.iter_passwords[{size}]", lambda: deque(iter_passwords(user_id), maxlen=0), repeat, size)
+        suite.run(f"db.get_passwords_page[{size}]",
+                  lambda: get_passwords_page(user_id, size // 2, 200), 50, min(size, 200))
+
+def bench_end_to_end(suite, username, master_password, user_id, key):
+    from auth import login_user
+    from database import get_passwords
+    from encryption import decrypt_many
+    from keys import get_user_key
+
+    # Background upgrade and sync threads would run inside the timed window
+    def login_list_decrypt():
+        login_user(username, master_password, background=False)
+        rows = get_passwords(user_id)
+        decrypt_many((row[1] for row in rows), key=get_user_key(user_id))
+
+    for size in suite.sizes:
+        populate(user_id, key, size)
+        suite.run(f"e2e.login_list_decrypt[{size}]", login_list_decrypt, 3, size)
+
+def bench_startup(suite):
+    """Times each entry point's imports in a fresh interpreter, as a user launching it would see."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name, statement in STARTUP_TARGETS.items():
+        command = [sys.executable, "-c", statement]
+        suite.run(f"startup.{name}", lambda: subprocess.run(command, cwd=here, check=True), 10)
+
+def check_deferred_imports() -> list:
+    """Returns (entry point, package) for every deferred package an entry point loads on import."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    loaded = []
+    for name, statement in STARTUP_TARGETS.items():
+        packages = DEFERRED_IMPORTS.get(name, ())
+        check = f"{statement}; import sys; print(' '.join(p for p in {packages!r} if p in sys.modules))"
+        result = subprocess.run([sys.executable, "-c", check], cwd=here, capture_output=True, text=True, check=True)
+        loaded += [(name, package) for package in result.stdout.split()]
+    return loaded
+
+def import_profile(statement: str, top: int = 15) -> list:
+    """Returns the (cumulative_us, module) pairs that dominate a cold import, slowest first."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                            cwd=here, capture_output=True, text=True, check=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            modules.append((int(parts[1]), parts[2].rstrip()))
+    return sorted(modules, reverse=True)[:top]
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Returns (name, baseline, current, ratio) for benchmarks slower than the threshold."""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+        ratio = result["median_s"] / previous["median_s"] if previous["median_s"] else 1.0
+        marker = "REGRESSION" if ratio > 1 + threshold else ("faster" if ratio < 1 - threshold else "")
+        print(f"{name:<40} {previous['per_item_us']:>12.2f} -> {result['per_item_us']:>12.2f} us/item  x{ratio:.2f} {marker}")
+        if ratio > 1 + threshold:
+            regressions.append((name, previous["median_s"], result["median_s"], ratio))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the password manager's hot paths.")
+    parser.add_argument("--sizes", help="Comma-separated vault sizes (default 10..100000)")
+    parser.add_argument("--quick", action="store_true", help="Only run vault sizes up to 1000")
+    parser.add_argument("--repeat", type=int, default=20, help="Repetitions per benchmark")
+    parser.add_argument("--only", help="Comma-separated groups: crypto,auth,storage,e2e,startup")
+    parser.add_argument("--importtime", action="store_true", help="Show the slowest imports of each entry point")
+    parser.add_argument("--bcrypt-rounds", type=int, help="Override BCRYPT_ROUNDS")
+    parser.add_argument("--kdf-iterations", type=int, help="Override KDF_ITERATIONS")
+    parser.add_argument("--out", help="Write JSON results to this file")
+    parser.add_argument("--baseline", help="Compare against a previous JSON results file")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed slowdown before flagging (0.10 = 10%%)")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit non-zero on regressions")
+    args = parser.parse_args()
+
+    configure_environment(args)
+    import config
+    from auth import register_user, login_user
+    from database import create_tables, get_user_by_username
+    from keys import get_user_key
+
+    sizes = [int(s) for s in args.sizes.split(",")] if args.sizes else list(QUICK_SIZES if args.quick else DEFAULT_SIZES)
+    groups = set(args.only.split(",")) if args.only else {"crypto", "auth", "storage", "e2e", "startup"}
+    suite = Suite(sizes, args.repeat)
+
+    create_tables()
+    register_user("bench", "bench-master-password")
+    user_id, _ = login_user("bench", "bench-master-password", background=False)
+    key = get_user_key(user_id)
+
+    if "crypto" in groups:
+        bench_crypto(suite, key)
+    if "auth" in groups:
+        bench_auth(suite)
+    if "storage" in groups:
+        bench_storage(suite, user_id, key)
+    if "e2e" in groups:
+        bench_end_to_end(suite, "bench", "bench-master-password", user_id, key)
+    eager_imports = []
+    if "startup" in groups:
+        bench_startup(suite)
+    if "startup" in groups or args.importtime:
+        eager_imports = check_deferred_imports()
+        for name, package in eager_imports:
+            print(f"❌ {name} ({STARTUP_TARGETS[name]}) loads {package} on import")
+    if args.importtime:
+        for name, statement in STARTUP_TARGETS.items():
+            print(f"\nSlowest imports for {name} ({statement}):")
+            for cumulative_us, module in import_profile(statement):
+                print(f"{cumulative_us / 1000:>10.1f} ms  {module}")
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "backend": config.DB_BACKEND,
+            "bcrypt_rounds": config.BCRYPT_ROUNDS,
+            "kdf_iterations": config.KDF_ITERATIONS,
+            "sizes": sizes,
+        },
+        "results": suite.results,
+        "record_sizes": suite.record_sizes,
+        "eager_imports": [f"{name}:{package}" for name, package in eager_imports],
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Results written to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(suite.results, json.load(f), args.threshold)
+        if regressions:
+            print(f"❌ {len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}")
+            if args.fail_on_regression:
+                sys.exit(1)
+    if eager_imports and args.fail_on_regression:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""Offline check of passwords against a local corpus of breached-password hashes.
+
+The corpus is the "ordered by hash" SHA-1 download of Pwned Passwords: one
+"<40 hex digits>:<count>" line per hash, sorted. It is memory-mapped and binary
+searched, so lookups touch a few dozen pages however large the file is and nothing
+goes over the network. Point BREACH_CORPUS_PATH at it, then optionally build a Bloom
+filter so most unbreached passwords are ruled out without touching the corpus:
+
+    python breach.py build-bloom [--fp-rate 0.001]   # one-off; slow on a full corpus
+    python breach.py check                           # prompts for a password
+    python main.py audit --user alice                # checks every stored password
+"""
+import argparse
+import hashlib
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from itertools import islice
+import config
+from database import iter_passwords
+from encryption import decrypt_many
+from keys import get_user_key
+
+HASH_HEX_LENGTH = 40
+
+BLOOM_MAGIC = b"PMBF"
+BLOOM_VERSION = 1
+_BLOOM_HEADER = struct.Struct(">4sBQB")  # magic, version, bit count, hash count
+
+class BloomFilter:
+    """Read-only, memory-mapped Bloom filter over SHA-1 digests."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.bits, self.hashes = _BLOOM_HEADER.unpack_from(self._map)
+        if magic != BLOOM_MAGIC or version != BLOOM_VERSION:
+            raise ValueError(f"{path} is not a breach Bloom filter.")
+
+    def might_contain(self, digest: bytes) -> bool:
+        """False means the digest is definitely not in the corpus."""
+        data, offset = self._map, _BLOOM_HEADER.size
+        for index in _bit_indexes(digest, self.bits, self.hashes):
+            if not data[offset + (index >> 3)] & (1 << (index & 7)):
+                return False
+        return True
+
+    def close(self):
+        self._map.close()
+
+def _bit_indexes(digest: bytes, bits: int, hashes: int):
+    # SHA-1 output is already uniform, so two slices of it drive double hashing
+    h1 = int.from_bytes(digest[:8], "big")
+    h2 = int.from_bytes(digest[8:16], "big") | 1
+    return [(h1 + i * h2) % bits for i in range(hashes)]
+
+def build_bloom(corpus_path: str, bloom_path: str, fp_rate: float = 0.001, verbose: bool = True) -> tuple:
+    """Writes a Bloom filter of every hash in the corpus; returns (hashes, bits, hash functions).
+
+    The filter is built in a memory-mapped file, so memory use stays flat.
+    """
+    with open(corpus_path, "rb") as f:
+        count = max(1, sum(block.count(b"\n") for block in iter(lambda: f.read(1 << 24), b"")))
+    bits = max(64, math.ceil(-count * math.log(fp_rate) / math.log(2) ** 2))
+    hashes = max(1, round(bits / count * math.log(2)))
+
+    partial_path = bloom_path + ".partial"
+    with open(partial_path, "wb+") as out:
+        out.write(_BLOOM_HEADER.pack(BLOOM_MAGIC, BLOOM_VERSION, bits, hashes))
+        out.truncate(_BLOOM_HEADER.size + (bits + 7) // 8)
+        with mmap.mmap(out.fileno(), 0) as data, open(corpus_path, "rb") as corpus:
+            offset, started = _BLOOM_HEADER.size, time.perf_counter()
+            for line_number, line in enumerate(corpus, 1):
+                if len(line) < HASH_HEX_LENGTH:
+                    continue
+                for index in _bit_indexes(bytes.fromhex(line[:HASH_HEX_LENGTH].decode()), bits, hashes):
+                    data[offset + (index >> 3)] |= 1 << (index & 7)
+                if verbose and line_number % 1000000 == 0:
+                    rate = line_number / (time.perf_counter() - started)
+                    print(f"  ... {line_number} of {count} hashes ({rate:.0f}/s)")
+    os.replace(partial_path, bloom_path)
+    return count, bits, hashes
+
+class BreachChecker:
+    """Counts how often passwords appear in a sorted SHA-1 corpus, with an optional Bloom prefilter."""
+
+    def __init__(self, corpus_path: str, bloom_path: str = None):
+        with open(corpus_path, "rb") as f:
+            self._corpus = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.bloom = BloomFilter(bloom_path) if bloom_path else None
+
+    def count(self, password: str) -> int:
+        """Returns how many times password appears in the corpus (0 if never)."""
+        return self.count_digests([hashlib.sha1(password.encode()).digest()])[0]
+
+    def count_digests(self, digests: list) -> list:
+        """Looks up many SHA-1 digests in one forward sweep of the corpus; returns counts in order."""
+        order = sorted(range(len(digests)), key=digests.__getitem__)
+        counts = [0] * len(digests)
+        low = 0
+        for i in order:
+            if self.bloom is not None and not self.bloom.might_contain(digests[i]):
+                continue
+            # Sorted targets only ever move forward, so each search starts where the last ended
+            counts[i], low = self._search(digests[i].hex().upper().encode(), low)
+        return counts
+
+    def _search(self, target: bytes, low: int) -> tuple:
+        """Binary search over line starts in [low, end); returns (count, line start at or after target)."""
+        data = self._corpus
+        high = len(data)
+        while low < high:
+            middle = (low + high) // 2
+            start = data.rfind(b"\n", low, middle) + 1 or low
+            key = data[start:start + HASH_HEX_LENGTH].upper()
+            if key < target:
+                end = data.find(b"\n", start)
+                low = high if end < 0 else end + 1
+            elif key > target:
+                high = start
+            else:
+                end = data.find(b"\n", start)
+                line = data[start:end if end >= 0 else len(data)]
+                return int(line[HASH_HEX_LENGTH + 1:].strip() or 1), start
+        return 0, low
+
+    def close(self):
+        self._corpus.close()
+        if self.bloom is not None:
+            self.bloom.close()
+
+_checker = None
+_checker_lock = threading.Lock()
+
+def get_checker():
+    """Returns the shared checker for BREACH_CORPUS_PATH, or None if no corpus is configured."""
+    global _checker
+    if _checker is None and config.BREACH_CORPUS_PATH:
+        with _checker_lock:
+            if _checker is None:
+                bloom_path = config.BREACH_BLOOM_PATH
+                _checker = BreachChecker(config.BREACH_CORPUS_PATH,
+                                         bloom_path if bloom_path and os.path.exists(bloom_path) else None)
+    return _checker
+
+def check_password(password: str):
+    """Returns how many breaches a password appears in, or None if there is no corpus to check."""
+    try:
+        checker = get_checker()
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Breach corpus unavailable: {e}")
+        return None
+    return checker.count(password) if checker else None
+
+def audit_vault(user_id: int, chunk_size: int = 1000) -> list:
+    """Checks every stored password of a logged-in user; returns [(website, count)] of breached ones.
+
+    Passwords are streamed and decrypted a chunk at a time and only their hashes are kept,
+    then all of them are looked up in one sweep of the corpus. Returns None if there is no
+    corpus.
+    """
+    checker = get_checker()
+    if checker is None:
+        return None
+    key = get_user_key(user_id)
+    websites, digests = [], []
+    rows = iter_passwords(user_id)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        for (_, website, _), password in zip(chunk, decrypt_many((row[2] for row in chunk), key=key)):
+            if not password.startswith("⚠️"):
+                websites.append(website)
+                digests.append(hashlib.sha1(password.encode()).digest())
+
+    breached = [(website, count) for website, count in zip(websites, checker.count_digests(digests)) if count]
+    return sorted(breached, key=lambda entry: (-entry[1], entry[0]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check passwords against a local breach corpus.")
+    parser.add_argument("command", choices=("check", "build-bloom"))
+    parser.add_argument("--corpus", default=config.BREACH_CORPUS_PATH, help="Sorted SHA-1 corpus (default $BREACH_CORPUS_PATH)")
+    parser.add_argument("--bloom", default=config.BREACH_BLOOM_PATH, help="Bloom filter file (default $BREACH_BLOOM_PATH)")
+    parser.add_argument("--fp-rate", type=float, default=0.001, help="Bloom filter false-positive rate")
+    args = parser.parse_args()
+    if not args.corpus:
+        print("❌ Set BREACH_CORPUS_PATH or pass --corpus.")
+        sys.exit(2)
+
+    if args.command == "build-bloom":
+        if not args.bloom:
+            print("❌ Set BREACH_BLOOM_PATH or pass --bloom.")
+            sys.exit(2)
+        count, bits, hashes = build_bloom(args.corpus, args.bloom, args.fp_rate)
+        print(f"✅ Bloom filter of {count} hashes written to {args.bloom} "
+              f"({bits / 8 / 2 ** 20:.1f} MiB, {hashes} hash functions).")
+    else:
+        from getpass import getpass
+        checker = BreachChecker(args.corpus, args.bloom if args.bloom and os.path.exists(args.bloom) else None)
+        breaches = checker.count(getpass("Password to check: "))
+        if breaches:
+            print(f"⚠️ This password has appeared {breaches} times in data breaches.")
+        else:
+            print("✅ This password was not found in the breach corpus.")
+        sys.exit(1 if breaches else 0)
@@ -1,22 +1,134 @@
-import os
-from dotenv import load_dotenv
-
-# Load environment variables from a .env file
-load_dotenv()
-
-# Database Configuration
-DB_CONFIG = {
-    "host": os.getenv("DB_HOST", "localhost"),
-    "user": os.getenv("DB_USER", "root"),
-    "password": os.getenv("DB_PASSWORD", "your_mysql_password"),
-    "database": os.getenv("DB_NAME", "password_manager")
-}
-
-# AES Encryption Key (Should be securely stored and not hardcoded)
-AES_KEY = os.getenv("AES_KEY")
-
-# Validate AES_KEY
-if not AES_KEY or len(AES_KEY) != 32:
-    raise ValueError("Invalid or missing AES_KEY in environment variables. Please set a secure 32-byte key in the .env file.")
-
-AES_KEY = AES_KEY.encode()
+import os
+
+def _env_file_exists() -> bool:
+    """Checks the folders load_dotenv() searches (this file's and the working directory's, upwards)."""
+    for start in (os.path.dirname(os.path.abspath(__file__)), os.getcwd()):
+        path = start
+        while True:
+            if os.path.isfile(os.path.join(path, ".env")):
+                return True
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+    return False
+
+# Load environment variables from a .env file (python-dotenv is slow to import, so only if there is one)
+if _env_file_exists():
+    from dotenv import load_dotenv
+    load_dotenv()
+
+def save_setting(name: str, value) -> str:
+    """Persists a setting to the .env file (creating it if needed) and returns its path."""
+    from dotenv import find_dotenv, set_key
+    path = find_dotenv(usecwd=True) or os.path.join(os.getcwd(), ".env")
+    if not os.path.exists(path):
+        open(path, "a").close()
+    set_key(path, name, str(value))
+    os.environ[name] = str(value)
+    return path
+
+# Storage Backend ("mysql" or "sqlite")
+DB_BACKEND = os.getenv("DB_BACKEND", "mysql").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "password_manager.db")
+
+# Database Configuration
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "user": os.getenv("DB_USER", "root"),
+    "password": os.getenv("DB_PASSWORD", "your_mysql_password"),
+    "database": os.getenv("DB_NAME", "password_manager")
+}
+
+# Connection Pool Configuration
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # Seconds to wait for a free connection
+DB_POOL_PING_INTERVAL = float(os.getenv("DB_POOL_PING_INTERVAL", "30"))  # Idle seconds before a health check
+DB_STREAM_CHUNK_SIZE = int(os.getenv("DB_STREAM_CHUNK_SIZE", "500"))  # Rows fetched per round trip when streaming a vault
+
+# Batch Crypto Configuration
+CRYPTO_PARALLEL_THRESHOLD = int(os.getenv("CRYPTO_PARALLEL_THRESHOLD", "5000"))  # Batch size that fans out to processes (0 disables)
+CRYPTO_WORKERS = int(os.getenv("CRYPTO_WORKERS", "0")) or os.cpu_count() or 1
+
+# bcrypt Work Factor (calibrate with `python auth.py calibrate`)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+BCRYPT_TARGET_MS = float(os.getenv("BCRYPT_TARGET_MS", "250"))  # Target time for one verification
+
+# Decrypted-Secret Session Cache
+SECRET_CACHE_SIZE = int(os.getenv("SECRET_CACHE_SIZE", "256"))  # Max cached entries (0 disables)
+SECRET_CACHE_TTL = float(os.getenv("SECRET_CACHE_TTL", "300"))  # Idle seconds before an entry is wiped
+
+# Per-User Vault Keys (benchmark with `python keys.py benchmark`)
+KDF_ITERATIONS = int(os.getenv("KDF_ITERATIONS", "600000"))  # PBKDF2-HMAC-SHA256 iterations
+KDF_TARGET_MS = float(os.getenv("KDF_TARGET_MS", "300"))  # Target time for one derivation
+KEY_CACHE_SIZE = int(os.getenv("KEY_CACHE_SIZE", "32"))  # Unlocked vault keys held in memory
+VAULT_UPGRADE_CHUNK_SIZE = int(os.getenv("VAULT_UPGRADE_CHUNK_SIZE", "200"))  # Rows re-encrypted or fingerprinted per transaction after login
+
+# Instrumentation
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() in ("1", "true", "yes")
+METRICS_FILE = os.getenv("METRICS_FILE")  # Written on CLI exit; *.prom for Prometheus text, otherwise JSON
+PROFILE_MODE = os.getenv("PROFILE_MODE")  # "cprofile" or "tracemalloc"
+PROFILE_OUTPUT = os.getenv("PROFILE_OUTPUT")
+
+# Local API Server (python server.py)
+API_HOST = os.getenv("API_HOST", "127.0.0.1")  # Must be a loopback address
+API_PORT = int(os.getenv("API_PORT", "8765"))
+API_SOCKET = os.getenv("API_SOCKET")  # Unix socket path; used instead of host/port when set
+API_SESSION_TTL = float(os.getenv("API_SESSION_TTL", "900"))  # Idle seconds before a session token expires
+API_DB_WORKERS = int(os.getenv("API_DB_WORKERS", "0")) or DB_POOL_SIZE  # Concurrent database calls
+API_CRYPTO_WORKERS = int(os.getenv("API_CRYPTO_WORKERS", "0")) or os.cpu_count() or 1  # Concurrent bcrypt/AES calls
+
+# Batch CLI (python main.py batch)
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "500"))  # Most writes grouped into one transaction
+
+# Import / Export (python main.py import|export)
+TRANSFER_CHUNK_SIZE = int(os.getenv("TRANSFER_CHUNK_SIZE", "2000"))  # Entries encrypted and written per transaction
+
+# Offline Breach Check (python breach.py)
+BREACH_CORPUS_PATH = os.getenv("BREACH_CORPUS_PATH")  # Pwned Passwords SHA-1 file, ordered by hash; unset disables checks
+BREACH_BLOOM_PATH = os.getenv("BREACH_BLOOM_PATH")  # Optional prefilter from `python breach.py build-bloom`
+
+# Snapshot Backups (python backup.py)
+SNAPSHOT_CHUNK_ROWS = int(os.getenv("SNAPSHOT_CHUNK_ROWS", "5000"))  # Rows compressed and encrypted per chunk
+SNAPSHOT_COMPRESSION_LEVEL = int(os.getenv("SNAPSHOT_COMPRESSION_LEVEL", "6"))  # zlib level, 1 (fast) to 9 (small)
+SNAPSHOT_WORKERS = int(os.getenv("SNAPSHOT_WORKERS", "0")) or min(DB_POOL_SIZE, os.cpu_count() or 1)  # Chunks sealed or restored at once
+
+# Local Replica (see replica.py)
+REPLICA_PATH = os.getenv("REPLICA_PATH")  # Encrypted SQLite copy of logged-in users' vaults; unset disables
+REPLICA_CONFLICT_POLICIES = ("copy", "server", "client")  # How offline writes that conflict can be resolved
+REPLICA_CONFLICT_POLICY = os.getenv("REPLICA_CONFLICT_POLICY", "copy")  # One of REPLICA_CONFLICT_POLICIES
+REPLICA_SYNC_INTERVAL = float(os.getenv("REPLICA_SYNC_INTERVAL", "60"))  # Seconds between syncs while logged in; 0 syncs at login only
+
+# Key Rotation (python rotation.py run)
+ROTATION_CHUNK_SIZE = int(os.getenv("ROTATION_CHUNK_SIZE", "1000"))  # Rows re-encrypted per transaction
+
+# AES Encryption Key (Should be securely stored and not hardcoded)
+# AES_KEY and AES_KEYRING are read and validated on first access; see __getattr__ below
+AES_KEY_ID = int(os.getenv("AES_KEY_ID", "1"))  # Version tag stored with rows encrypted under AES_KEY
+AES_RETIRED_KEYS = os.getenv("AES_RETIRED_KEYS", "")  # "id:key,id:key" old keys still readable until rotated
+
+if AES_KEY_ID < 1:
+    raise ValueError("AES_KEY_ID must be a positive integer.")
+
+def _load_keys() -> tuple:
+    """Validates AES_KEY and AES_RETIRED_KEYS and returns (AES_KEY, AES_KEYRING)."""
+    aes_key = os.getenv("AES_KEY")
+    if not aes_key or len(aes_key) != 32:
+        raise ValueError("Invalid or missing AES_KEY in environment variables. Please set a secure 32-byte key in the .env file.")
+
+    # Every global key by ID: the current AES_KEY plus any retired ones
+    keyring = {AES_KEY_ID: aes_key.encode()}
+    for entry in filter(None, (e.strip() for e in AES_RETIRED_KEYS.split(","))):
+        key_id, _, key = entry.partition(":")
+        if not key_id.strip().isdigit() or len(key.strip()) != 32:
+            raise ValueError("Invalid AES_RETIRED_KEYS entry. Use id:key with a 32-byte key.")
+        keyring.setdefault(int(key_id), key.strip().encode())
+    return aes_key.encode(), keyring
+
+def __getattr__(name):
+    # Loading the keys lazily lets tools that never touch a vault (help text, metrics
+    # conversion, startup timing) run without them
+    if name in ("AES_KEY", "AES_KEYRING"):
+        globals()["AES_KEY"], globals()["AES_KEYRING"] = _load_keys()
+        return globals()[name]
+    raise AttributeError(f"module 'config' has no attribute {name!r}")
@@ -1,150 +1,1018 @@
-import mysql.connector
-from config import DB_CONFIG
-
-def connect_db():
-    """Establishes a connection to the MySQL database."""
-    try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        return conn
-    except mysql.connector.Error as err:
-        print(f"\u274c Database connection error: {err}")
-        return None
-
-def create_tables():
-    """Creates required tables if they do not exist."""
-    conn = connect_db()
-    if not conn:
-        return
-
-    cursor = conn.cursor()
-
-    # Create users table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            username VARCHAR(255) UNIQUE NOT NULL,
-            master_password_hash VARCHAR(255) NOT NULL
-        )
-    """
-    )
-
-    # Create passwords table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS passwords (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            user_id INT,
-            website VARCHAR(255) NOT NULL,
-            encrypted_password TEXT NOT NULL,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-    """
-    )
-
-    conn.commit()
-    cursor.close()
-    conn.close()
-    print("\u2705 Database tables created successfully!")
-
-def add_user(username: str, hashed_password: str):
-    """Inserts a new user into the database."""
-    conn = connect_db()
-    if not conn:
-        return False
-
-    cursor = conn.cursor()
-    try:
-        cursor.execute("INSERT INTO users (username, master_password_hash) VALUES (%s, %s)", 
-                       (username, hashed_password))
-        conn.commit()
-        return True
-    except mysql.connector.Error as err:
-        print(f"\u274c Error adding user: {err}")
-        return False
-    finally:
-        cursor.close()
-        conn.close()
-
-def get_user_by_username(username: str):
-    """Retrieves a user by username."""
-    conn = connect_db()
-    if not conn:
-        return None
-
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, master_password_hash FROM users WHERE username = %s", (username,))
-    user = cursor.fetchone()
-    
-    cursor.close()
-    conn.close()
-    return user
-
-def add_password(user_id: int, website: str, encrypted_password: str):
-    """Stores an encrypted password in the database."""
-    conn = connect_db()
-    if not conn:
-        return False
-
-    cursor = conn.cursor()
-    try:
-        cursor.execute("INSERT INTO passwords (user_id, website, encrypted_password) VALUES (%s, %s, %s)", 
-                       (user_id, website, encrypted_password))
-        conn.commit()
-        return True
-    except mysql.connector.Error as err:
-        print(f"\u274c Error adding password: {err}")
-        return False
-    finally:
-        cursor.close()
-        conn.close()
-
-def get_passwords(user_id: int):
-    """Retrieves stored passwords for a given user."""
-    conn = connect_db()
-    if not conn:
-        return []
-
-    cursor = conn.cursor()
-    cursor.execute("SELECT website, encrypted_password FROM passwords WHERE user_id = %s", (user_id,))
-    passwords = cursor.fetchall()
-    
-    cursor.close()
-    conn.close()
-    return passwords
-
-def delete_password(user_id: int, website: str) -> bool:
-    """Deletes a stored password for a specific website."""
-    conn = connect_db()
-    if not conn:
-        return False
-    
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM passwords WHERE user_id = %s AND website = %s", (user_id, website))
-    conn.commit()
-    rows_deleted = cursor.rowcount
-    
-    cursor.close()
-    conn.close()
-    return rows_deleted > 0  # Returns True if deletion was successful
-
-def delete_user(username: str):
-    """Deletes a user and their stored passwords."""
-    conn = connect_db()
-    if not conn:
-        return False
-    
-    cursor = conn.cursor()
-    try:
-        cursor.execute("DELETE FROM users WHERE username = %s", (username,))
-        conn.commit()
-        print(f"\U0001F5D1 User '{username}' and all stored passwords deleted successfully!")
-        return True
-    except mysql.connector.Error as err:
-        print(f"\u274c Error deleting user: {err}")
-        return False
-    finally:
-        cursor.close()
-        conn.close()
-
-# Initialize database tables if they don't exist
-if __name__ == "__main__":
-    create_tables()
+import threading
+from contextlib import contextmanager
+from config import DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_POOL_PING_INTERVAL, DB_STREAM_CHUNK_SIZE, AES_KEY_ID
+from metrics import timed, register_collector
+from pool import ConnectionPool, PoolTimeoutError
+from storage import create_backend
+
+_backend = create_backend()
+
+# Errors that database helpers report instead of raising. The driver's error class joins
+# them when the first connection loads the driver; read this as database.DB_ERRORS so the
+# current value is seen
+DB_ERRORS = (PoolTimeoutError,)
+
+_pool = None
+_pool_lock = threading.Lock()
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+# Callbacks run as fn(user_id, website, action) after a password is written ("put") or
+# deleted ("delete"); website is None when all of the user's passwords were affected
+_change_listeners = []
+# A commit touching more of one user's passwords than this sends one website=None notice
+BULK_CHANGE_THRESHOLD = 256
+
+def get_backend():
+    """Returns the storage backend selected by DB_BACKEND."""
+    return _backend
+
+def _connect():
+    global DB_ERRORS
+    DB_ERRORS = (_backend.Error, PoolTimeoutError)
+    return _backend.connect()
+
+def get_pool() -> ConnectionPool:
+    """Returns the process-wide connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    timed("db.connect")(_connect),
+                    size=min(DB_POOL_SIZE, _backend.max_connections or DB_POOL_SIZE),
+                    timeout=DB_POOL_TIMEOUT,
+                    ping=_backend.ping,
+                    ping_interval=DB_POOL_PING_INTERVAL,
+                )
+    return _pool
+
+def _pool_gauges() -> dict:
+    """Reports pool statistics to the metrics exporter, if the pool has been created."""
+    if _pool is None:
+        return {}
+    return {f"db_pool_{name}": value for name, value in _pool.stats().items()}
+
+register_collector(_pool_gauges)
+
+def get_connection():
+    """Checks a pooled connection out for the duration of a `with` block."""
+    if not _schema_ready:
+        _ensure_schema()
+    return get_pool().connection()
+
+def pool_stats() -> dict:
+    """Returns checkout counts and wait times of the shared pool."""
+    return get_pool().stats()
+
+def add_change_listener(listener):
+    """Registers a callback notified after stored passwords change (e.g. to invalidate caches)."""
+    _change_listeners.append(listener)
+
+def notify_change(user_id: int, website: str = None, action: str = "put"):
+    """Tells every change listener that a user's password for a website was modified."""
+    for listener in _change_listeners:
+        listener(user_id, website, action)
+
+def execute(conn, query: str, params=()):
+    """Runs a `%s`-style query on the active backend and returns the cursor."""
+    cursor = conn.cursor()
+    cursor.execute(_backend.sql(query), params)
+    return cursor
+
+def _unless_exists(kind: str, table: str, name: str, statement: str) -> tuple:
+    """Marks a migration statement to skip when the column, index or trigger it creates is already there."""
+    return kind, table, name, statement
+
+# Schema migrations, applied in order. Each entry is (version, description, statements)
+# where statements maps a backend name to its SQL; version 1 is the original schema.
+# MySQL commits DDL statement by statement, so a migration that failed partway is simply
+# run again: every statement is either idempotent or guarded with _unless_exists.
+MIGRATIONS = [
+    (1, "create users and passwords tables", None),
+    (2, "unique index on passwords (user_id, website)", {
+        "mysql": [
+            # Keep only the newest entry per website so the unique index can be built
+            """DELETE p1 FROM passwords p1 JOIN passwords p2
+               ON p1.user_id = p2.user_id AND p1.website = p2.website AND p1.id < p2.id""",
+            _unless_exists("index", "passwords", "idx_passwords_user_website",
+                           "CREATE UNIQUE INDEX idx_passwords_user_website ON passwords (user_id, website)"),
+        ],
+        "sqlite": [
+            "DELETE FROM passwords WHERE id NOT IN (SELECT MAX(id) FROM passwords GROUP BY user_id, website)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_passwords_user_website ON passwords (user_id, website)",
+        ],
+    }),
+    (3, "created_at / updated_at on passwords", {
+        "mysql": [
+            _unless_exists("column", "passwords", "created_at",
+                           "ALTER TABLE passwords ADD COLUMN created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP"),
+            _unless_exists("column", "passwords", "updated_at",
+                           """ALTER TABLE passwords ADD COLUMN updated_at TIMESTAMP NOT NULL
+                              DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"""),
+        ],
+        "sqlite": [
+            # SQLite cannot add columns with a CURRENT_TIMESTAMP default, so triggers fill them in
+            _unless_exists("column", "passwords", "created_at", "ALTER TABLE passwords ADD COLUMN created_at TIMESTAMP"),
+            _unless_exists("column", "passwords", "updated_at", "ALTER TABLE passwords ADD COLUMN updated_at TIMESTAMP"),
+            "UPDATE passwords SET created_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP WHERE created_at IS NULL",
+            """CREATE TRIGGER IF NOT EXISTS passwords_created_at AFTER INSERT ON passwords
+               BEGIN
+                   UPDATE passwords SET created_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                   WHERE id = NEW.id;
+               END""",
+            """CREATE TRIGGER IF NOT EXISTS passwords_updated_at AFTER UPDATE OF encrypted_password ON passwords
+               BEGIN
+                   UPDATE passwords SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+               END""",
+        ],
+    }),
+    (4, "per-user wrapped vault keys", {
+        "mysql": [
+            _unless_exists("column", "users", column, f"ALTER TABLE users ADD COLUMN {column} {definition} NULL")
+            for column, definition in (("kdf_salt", "VARCHAR(64)"), ("kdf_iterations", "INT"),
+                                       ("wrapped_key", "VARCHAR(128)"))
+        ],
+        "sqlite": [
+            _unless_exists("column", "users", column, f"ALTER TABLE users ADD COLUMN {column} {definition}")
+            for column, definition in (("kdf_salt", "VARCHAR(64)"), ("kdf_iterations", "INT"),
+                                       ("wrapped_key", "VARCHAR(128)"))
+        ],
+    }),
+    (5, "key_id on passwords and key rotation checkpoints", {
+        backend: [
+            # 0 means the user's own vault key; other IDs name a key in config.AES_KEYRING
+            _unless_exists("column", "passwords", "key_id",
+                           "ALTER TABLE passwords ADD COLUMN key_id INT NOT NULL DEFAULT 0"),
+            f"""UPDATE passwords SET key_id = {AES_KEY_ID}
+               WHERE user_id IN (SELECT id FROM users WHERE wrapped_key IS NULL)""",
+            _unless_exists("index", "passwords", "idx_passwords_key_id",
+                           "CREATE INDEX idx_passwords_key_id ON passwords (key_id, id)"),
+            """CREATE TABLE IF NOT EXISTS key_rotations (
+                   target_key_id INT PRIMARY KEY,
+                   last_id INT NOT NULL,
+                   rotated INT NOT NULL,
+                   failed INT NOT NULL
+               )""",
+        ] for backend in ("mysql", "sqlite")
+    }),
+    (6, "binary encrypted_password for versioned AES-GCM records", {
+        "mysql": ["ALTER TABLE passwords MODIFY encrypted_password BLOB NOT NULL"],
+        # SQLite keeps bytes as BLOB values whatever the declared column type, so nothing changes
+        "sqlite": [],
+    }),
+    (7, "keyed password fingerprints for reuse detection", {
+        "mysql": [
+            _unless_exists("column", "passwords", "fingerprint",
+                           "ALTER TABLE passwords ADD COLUMN fingerprint VARBINARY(32) NULL"),
+            _unless_exists("index", "passwords", "idx_passwords_user_fingerprint",
+                           "CREATE INDEX idx_passwords_user_fingerprint ON passwords (user_id, fingerprint)"),
+        ],
+        "sqlite": [
+            _unless_exists("column", "passwords", "fingerprint", "ALTER TABLE passwords ADD COLUMN fingerprint BLOB"),
+            "CREATE INDEX IF NOT EXISTS idx_passwords_user_fingerprint ON passwords (user_id, fingerprint)",
+        ],
+    }),
+    (8, "index on passwords (user_id, id) for streaming a vault in id order", {
+        # InnoDB's foreign key index on user_id already ends in the primary key
+        "mysql": [],
+        "sqlite": ["CREATE INDEX IF NOT EXISTS idx_passwords_user_id ON passwords (user_id, id)"],
+    }),
+    (9, "password change log for replica sync", {
+        # Triggers log every write, including ones that bypass this module (imports, restores)
+        "mysql": [
+            """CREATE TABLE IF NOT EXISTS password_changes (
+                   seq BIGINT AUTO_INCREMENT PRIMARY KEY,
+                   user_id INT NOT NULL,
+                   website VARCHAR(255) NOT NULL,
+                   INDEX idx_password_changes_user (user_id, seq)
+               )""",
+            _unless_exists("trigger", "passwords", "passwords_log_insert",
+                           """CREATE TRIGGER passwords_log_insert AFTER INSERT ON passwords FOR EACH ROW
+                              INSERT INTO password_changes (user_id, website) VALUES (NEW.user_id, NEW.website)"""),
+            _unless_exists("trigger", "passwords", "passwords_log_update",
+                           """CREATE TRIGGER passwords_log_update AFTER UPDATE ON passwords FOR EACH ROW
+                              INSERT INTO password_changes (user_id, website)
+                              SELECT NEW.user_id, NEW.website FROM DUAL
+                              WHERE NOT (NEW.encrypted_password <=> OLD.encrypted_password)"""),
+            _unless_exists("trigger", "passwords", "passwords_log_delete",
+                           """CREATE TRIGGER passwords_log_delete AFTER DELETE ON passwords FOR EACH ROW
+                              INSERT INTO password_changes (user_id, website) VALUES (OLD.user_id, OLD.website)"""),
+        ],
+        "sqlite": [
+            """CREATE TABLE IF NOT EXISTS password_changes (
+                   seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                   user_id INT NOT NULL,
+                   website VARCHAR(255) NOT NULL
+               )""",
+            "CREATE INDEX IF NOT EXISTS idx_password_changes_user ON password_changes (user_id, seq)",
+            """CREATE TRIGGER IF NOT EXISTS passwords_log_insert AFTER INSERT ON passwords
+               BEGIN
+                   INSERT INTO password_changes (user_id, website) VALUES (NEW.user_id, NEW.website);
+               END""",
+            """CREATE TRIGGER IF NOT EXISTS passwords_log_update AFTER UPDATE OF encrypted_password ON passwords
+               BEGIN
+                   INSERT INTO password_changes (user_id, website) VALUES (NEW.user_id, NEW.website);
+               END""",
+            """CREATE TRIGGER IF NOT EXISTS passwords_log_delete AFTER DELETE ON passwords
+               BEGIN
+                   INSERT INTO password_changes (user_id, website) VALUES (OLD.user_id, OLD.website);
+               END""",
+        ],
+    }),
+]
+
+# Matches rows still in the base64 AES-CBC format; versioned records start with a 0x01 byte
+LEGACY_FORMAT_SQL = "SUBSTR(encrypted_password, 1, 1) <> X'01'"
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn) -> int:
+    """Returns the highest migration applied to the database (0 for a fresh one)."""
+    execute(conn, """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """).close()
+    cursor = execute(conn, "SELECT MAX(version) FROM schema_migrations")
+    version = cursor.fetchone()[0]
+    cursor.close()
+    return version or 0
+
+def migrate(verbose: bool = True) -> list:
+    """Brings the schema up to date in place and returns the versions applied."""
+    applied = []
+    with get_pool().connection() as conn:
+        current = get_schema_version(conn)
+        conn.commit()
+
+        for version, description, statements in MIGRATIONS:
+            if version <= current:
+                continue
+
+            if statements is None:
+                statements = _backend.schema()
+            else:
+                statements = statements[_backend.name]
+
+            for statement in statements:
+                if isinstance(statement, tuple):
+                    *guard, statement = statement
+                    if _backend.schema_object_exists(conn, *guard):
+                        continue
+                execute(conn, statement).close()
+            execute(conn, "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                    (version, description)).close()
+            conn.commit()
+
+            applied.append(version)
+            if verbose:
+                print(f"\u2705 Applied migration {version}: {description}")
+
+    return applied
+
+def _ensure_schema():
+    """Upgrades existing deployments in place before the first query of the process."""
+    global _schema_ready
+    with _schema_lock:
+        if not _schema_ready:
+            migrate(verbose=False)
+            _schema_ready = True
+
+def create_tables():
+    """Creates required tables if they do not exist and applies pending migrations."""
+    try:
+        migrate()
+    except DB_ERRORS as err:
+        print(f"\u274c Database connection error: {err}")
+        return
+
+    print("\u2705 Database tables created successfully!")
+
+@timed("db.add_user")
+def add_user(username: str, hashed_password: str):
+    """Inserts a new user into the database."""
+    try:
+        with UnitOfWork() as work:
+            work.add_user(username, hashed_password)
+        return True
+    except DB_ERRORS as err:
+        print(f"\u274c Error adding user: {err}")
+        return False
+
+@timed("db.get_user_by_username")
+def get_user_by_username(username: str):
+    """Retrieves a user by username."""
+    try:
+        with get_connection() as conn:
+            cursor = execute(conn, "SELECT id, master_password_hash FROM users WHERE username = %s", (username,))
+            user = cursor.fetchone()
+            cursor.close()
+        return user
+    except DB_ERRORS as err:
+        print(f"\u274c Database connection error: {err}")
+        return None
+
+@timed("db.update_master_password")
+def update_master_password(username: str, hashed_password: str, key_record: tuple = None) -> bool:
+    """Replaces the stored master password hash of a user.
+
+    key_record, a (kdf_salt, kdf_iterations, wrapped_key) tuple, is saved in the same
+    statement so the vault key is never left wrapped under the old password.
+    """
+    try:
+        with get_connection() as conn:
+            if key_record is None:
+                cursor = execute(conn, "UPDATE users SET master_password_hash = %s WHERE username = %s",
+                                 (hashed_password, username))
+            else:
+                cursor = execute(conn, """
+                    UPDATE users SET master_password_hash = %s, kdf_salt = %s, kdf_iterations = %s, wrapped_key = %s
+                    WHERE username = %s
+                """, (hashed_password, *key_record, username))
+            conn.commit()
+            rows_updated = cursor.rowcount
+            cursor.close()
+    except DB_ERRORS as err:
+        print(f"\u274c Error updating user: {err}")
+        return False
+
+    return rows_updated > 0
+
+@timed("db.get_user_key_record")
+def get_user_key_record(user_id: int):
+    """Returns a user's (kdf_salt, kdf_iterations, wrapped_key), with None values if no key exists yet."""
+    try:
+        with get_connection() as conn:
+            cursor = execute(conn, "SELECT kdf_salt, kdf_iterations, wrapped_key FROM users WHERE id = %s",
+                             (user_id,))
+            record = cursor.fetchone()
+            cursor.close()
+        return record
+    except DB_ERRORS as err:
+        print(f"\u274c Database connection error: {err}")
+        return None
+
+@timed("db.store_user_key_record")
+def store_user_key_record(user_id: int, key_record: tuple, previous_wrapped_key: str = None,
+                          reencrypt=None) -> bool:
+    """Saves a user's (kdf_salt, kdf_iterations, wrapped_key).
+
+    The update only applies if the stored wrapped key still equals previous_wrapped_key,
+    so concurrent logins cannot both install a key. If reencrypt is given, it is called
+    with the list of the user's (key_id, ciphertext) rows and must return replacement
+    (ciphertext, fingerprint) pairs under the new vault key; they are written in the
+    same transaction. Returns False if
+    another writer got there first.
+    """
+    with get_connection() as conn:
+        if previous_wrapped_key is None:
+            condition, params = "wrapped_key IS NULL", ()
+        else:
+            condition, params = "wrapped_key = %s", (previous_wrapped_key,)
+        cursor = execute(conn, f"""
+            UPDATE users SET kdf_salt = %s, kdf_iterations = %s, wrapped_key = %s
+            WHERE id = %s AND {condition}
+        """, (*key_record, user_id, *params))
+        updated = cursor.rowcount
+        cursor.close()
+        if updated != 1:
+            conn.rollback()
+            return False
+
+        if reencrypt is not None:
+            cursor = execute(conn, "SELECT id, key_id, encrypted_password FROM passwords WHERE user_id = %s",
+                             (user_id,))
+            rows = cursor.fetchall()
+            cursor.close()
+            if rows:
+                replacements = reencrypt([row[1:] for row in rows])
+                cursor = conn.cursor()
+                cursor.executemany(_backend.sql("""
+                    UPDATE passwords SET encrypted_password = %s, fingerprint = %s, key_id = 0 WHERE id = %s
+                """), [(new, fingerprint, row[0]) for (new, fingerprint), row in zip(replacements, rows)])
+                cursor.close()
+        conn.commit()
+
+    if reencrypt is not None:
+        notify_change(user_id)
+    return True
+
+def _upsert_password_sql() -> str:
+    """Upsert for (user_id, website, encrypted_password, AES_KEY_ID, user_id, fingerprint, user_id) parameters."""
+    # Fingerprints are only kept for rows under the user's vault key, which they are derived from.
+    # A VALUES list (rather than INSERT ... SELECT FROM users) lets the foreign key reject unknown users.
+    return _backend.upsert(
+        "passwords", ("user_id", "website", "encrypted_password", "key_id", "fingerprint"), ("user_id", "website"),
+        source="""VALUES (%s, %s, %s,
+                          (SELECT CASE WHEN wrapped_key IS NULL THEN %s ELSE 0 END FROM users WHERE id = %s),
+                          (SELECT CASE WHEN wrapped_key IS NULL THEN NULL ELSE %s END FROM users WHERE id = %s))""")
+
+@timed("db.add_password")
+def add_password(user_id: int, website: str, encrypted_password: bytes, fingerprint: bytes = None):
+    """Stores an encrypted password and its reuse fingerprint, replacing any existing one for the same website.
+
+    The row is tagged with key ID 0 (the user's vault key), or with AES_KEY_ID for users
+    still on the global key.
+    """
+    try:
+        with UnitOfWork() as work:
+            work.add_password(user_id, website, encrypted_password, fingerprint)
+        return True
+    except DB_ERRORS as err:
+        print(f"\u274c Error adding password: {err}")
+        return False
+
+@timed("db.get_password")
+def get_password(user_id: int, website: str):
+    """Retrieves the encrypted password stored for one website, or None."""
+    try:
+        with get_connection() as conn:
+            cursor = execute(conn, "SELECT encrypted_password FROM passwords WHERE user_id = %s AND website = %s",
+                             (user_id, website))
+            result = cursor.fetchone()
+            cursor.close()
+    except DB_ERRORS as err:
+        print(f"\u274c Database connection error: {err}")
+        return None
+
+    return result[0] if result else None
+
+@timed("db.get_passwords")
+def get_passwords(user_id: int):
+    """Retrieves stored passwords for a given user.
+
+    Loads the whole vault into a list; prefer iter_passwords when the rows can be handled
+    as they arrive.
+    """
+    try:
+        return [(website, encrypted_password) for _, website, encrypted_password in iter_passwords(user_id)]
+    except DB_ERRORS as err:
+        print(f"\u274c Database connection error: {err}")
+        return []
+
+# Columns iter_passwords can walk a vault in, with their position in its rows
+_STREAM_ORDERS = {"id": 0, "website": 1}
+
+def iter_passwords(user_id: int, order_by: str = "id", after=None, website_prefix: str = None,
+                   limit: int = None, page_size: int = None, chunk_size: int = DB_STREAM_CHUNK_SIZE):
+    """Yields a user's (id, website, encrypted_password) rows without loading them all at once.
+
+    Rows come in order_by order ("id" or "website"), starting after the given value of that
+    column, optionally only for websites starting with website_prefix and at most limit of
+    them. They are read from a streaming cursor chunk_size at a time, so memory stays flat
+    and the first row arrives before the last is read.
+
+    The connection is held until the rows run out or the generator is closed. Consumers
+    that pause between rows (a UI, a slow writer) should pass page_size: the walk is then
+    split into keyset pages of that many rows, each read in full by its own short query,
+    so the connection is only held while a page is read. Database errors are raised.
+    """
+    if order_by not in _STREAM_ORDERS:
+        raise ValueError(f"Cannot stream passwords ordered by {order_by!r}.")
+    position = _STREAM_ORDERS[order_by]
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = page_size if remaining is None else min(page_size or remaining, remaining)
+        rows = _stream_passwords(user_id, order_by, after, website_prefix, size, chunk_size)
+        if page_size is not None:
+            rows = list(rows)  # Read the whole page so the connection is released before the first row is yielded
+        count = 0
+        for row in rows:
+            yield row
+            count += 1
+            after = row[position]
+        if remaining is not None:
+            remaining -= count
+        if page_size is None or count < page_size:
+            return
+
+def _stream_passwords(user_id: int, order_by: str, after, website_prefix: str, limit: int, chunk_size: int):
+    conditions, params = ["user_id = %s"], [user_id]
+    if after is not None:
+        conditions.append(f"{order_by} > %s")
+        params.append(after)
+    if website_prefix:
+        conditions.append("website >= %s AND website < %s")
+        params += [website_prefix, website_prefix + "\uffff"]
+    query = f"""
+        SELECT id, website, encrypted_password FROM passwords
+        WHERE {" AND ".join(conditions)} ORDER BY {order_by}
+    """
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit)
+    return _stream_rows(query, params, chunk_size)
+
+def _stream_rows(query: str, params, chunk_size: int):
+    """Yields the rows of a query, fetched chunk_size at a time from a streaming cursor."""
+    if not _schema_ready:
+        _ensure_schema()
+    pool = get_pool()
+    conn = pool.acquire()
+    cursor, drained = None, False
+    try:
+        cursor = _backend.stream_cursor(conn)
+        cursor.execute(_backend.sql(query), params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+        drained = True
+    finally:
+        # A half-read unbuffered result blocks the connection's next query, so drop it instead
+        if drained or not _backend.unbuffered_streams:
+            if cursor is not None:
+                cursor.close()
+            pool.release(conn)
+        else:
+            pool.release(conn, discard=True)
+
+@timed("db.get_websites")
+def get_websites(user_id: int) -> list:
+    """Retrieves the website names a user has stored, without their passwords."""
+    try:
+        with get_connection() as conn:
+            cursor = execute(conn, "SELECT website FROM passwords WHERE user_id = %s", (user_id,))
+            websites = [row[0] for row in cursor.fetchall()]
+            cursor.close()
+        return websites
+    except DB_ERRORS as err:
+        print(f"\u274c Database connection error: {err}")
+        return []
+
+@timed("db.search_websites")
+def search_websites(user_id: int, prefix: str, limit: int = 50) -> list:
+    """Finds websites starting with prefix using a range scan on the (user_id, website) index.
+
+    Case sensitivity follows the backend's collation (insensitive on MySQL by default).
+    """
+    try:
+        with get_connection() as conn:
+            cursor = execute(conn, """
+                SELECT website FROM passwords
+                WHERE user_id = %s AND website >= %s AND website < %s
+                ORDER BY website LIMIT %s
+            """, (user_id, prefix, prefix + "\uffff", limit))
+            websites = [row[0] for row in cursor.fetchall()]
+            cursor.close()
+        return websites
+    except DB_ERRORS as err:
+        print(f"\u274c Database connection error: {err}")
+        return []
+
+@timed("db.count_passwords")
+def count_passwords(user_id: int) -> int:
+    """Returns how many passwords a user has stored."""
+    try:
+        with get_connection() as conn:
+            cursor = execute(conn, "SELECT COUNT(*) FROM passwords WHERE user_id = %s", (user_id,))
+            count = cursor.fetchone()[0]
+            cursor.close()
+        return count
+    except DB_ERRORS as err:
+        print(f"\u274c Database connection error: {err}")
+        return 0
+
+@timed("db.get_passwords_page")
+def get_passwords_page(user_id: int, offset: int, limit: int):
+    """Retrieves one page of a user's passwords, ordered by website."""
+    try:
+        with get_connection() as conn:
+            cursor = execute(conn, """
+                SELECT website, encrypted_password FROM passwords
+                WHERE user_id = %s ORDER BY website LIMIT %s OFFSET %s
+            """, (user_id, limit, offset))
+            passwords = cursor.fetchall()
+            cursor.close()
+        return passwords
+    except DB_ERRORS as err:
+        print(f"\u274c Database connection error: {err}")
+        return []
+
+@timed("db.delete_password")
+def delete_password(user_id: int, website: str) -> bool:
+    """Deletes a stored password for a specific website."""
+    try:
+        with UnitOfWork() as work:
+            work.delete_password(user_id, website)
+        return work.results[0]  # Returns True if deletion was successful
+    except DB_ERRORS as err:
+        print(f"\u274c Error deleting password: {err}")
+        return False
+
+def _in_chunks(values: list, size: int = 500):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+class UnitOfWork:
+    """Collects user and password writes and applies them in order in one transaction.
+
+        with UnitOfWork() as work:
+            work.add_password(user_id, "example.com", encrypted_password)
+            work.delete_password(user_id, "old.example.com")
+        work.results  # [True, False]: the second website had nothing stored
+
+    Runs of the same kind of write go to the database as one executemany. Leaving the
+    block commits; an exception inside it discards the queued writes, and a failed flush
+    is rolled back in full and raised. Change listeners are told after the commit.
+    """
+
+    def __init__(self):
+        self._writes = []  # (kind, params), in the order they were queued
+        self.results = None
+
+    def __len__(self):
+        return len(self._writes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self._writes = []
+        return False
+
+    def add_user(self, username: str, hashed_password: str):
+        self._writes.append(("add_user", (username, hashed_password)))
+
+    def add_password(self, user_id: int, website: str, encrypted_password: bytes, fingerprint: bytes = None):
+        """Queues an upsert, tagged like add_password() with the key the row is under."""
+        self._writes.append(("add_password", (user_id, website, encrypted_password, AES_KEY_ID, user_id,
+                                              fingerprint, user_id)))
+
+    def delete_password(self, user_id: int, website: str):
+        self._writes.append(("delete_password", (user_id, website)))
+
+    def delete_user(self, username: str):
+        """Queues deleting a user together with their stored passwords."""
+        self._writes.append(("delete_user", (username,)))
+
+    def commit(self) -> list:
+        """Writes everything queued and returns one result per write, in order.
+
+        Deletes report whether there was something to delete; other writes report True.
+        """
+        writes, self._writes = self._writes, []
+        results, changes = [], []
+        if writes:
+            with get_connection() as conn:
+                start = 0
+                while start < len(writes):
+                    end = start + 1
+                    while end < len(writes) and writes[end][0] == writes[start][0]:
+                        end += 1
+                    kind = writes[start][0]
+                    results += getattr(self, f"_flush_{kind}")(conn, [params for _, params in writes[start:end]],
+                                                                  changes)
+                    start = end
+                conn.commit()
+
+        per_user = {}
+        for user_id, _, _ in changes:
+            per_user[user_id] = per_user.get(user_id, 0) + 1
+        for user_id, website, action in changes:
+            if per_user[user_id] <= BULK_CHANGE_THRESHOLD:
+                notify_change(user_id, website, action)
+        for user_id, count in per_user.items():
+            if count > BULK_CHANGE_THRESHOLD:
+                notify_change(user_id, None, "put")
+        self.results = results
+        return results
+
+    @staticmethod
+    def _executemany(conn, query: str, rows: list) -> int:
+        cursor = conn.cursor()
+        cursor.executemany(_backend.sql(query), rows)
+        count = cursor.rowcount
+        cursor.close()
+        return count
+
+    def _flush_add_user(self, conn, rows: list, changes: list) -> list:
+        self._executemany(conn, "INSERT INTO users (username, master_password_hash) VALUES (%s, %s)", rows)
+        return [True] * len(rows)
+
+    def _flush_add_password(self, conn, rows: list, changes: list) -> list:
+        self._executemany(conn, _upsert_password_sql(), rows)
+        changes += [(user_id, website, "put") for user_id, website, *_ in rows]
+        return [True] * len(rows)
+
+    def _flush_delete_password(self, conn, rows: list, changes: list) -> list:
+        query = "DELETE FROM passwords WHERE user_id = %s AND website = %s"
+        if len(rows) == 1:
+            existing = set(rows) if self._executemany(conn, query, rows) else set()
+        else:
+            # executemany only reports a total, so look up which rows exist (this transaction's
+            # earlier writes included) before deleting them
+            existing = set()
+            for user_id in {user_id for user_id, _ in rows}:
+                websites = [website for uid, website in rows if uid == user_id]
+                for chunk in _in_chunks(websites):
+                    cursor = execute(conn, f"""
+                        SELECT website FROM passwords
+                        WHERE user_id = %s AND website IN ({", ".join(["%s"] * len(chunk))})
+                    """, (user_id, *chunk))
+                    existing.update((user_id, website) for website, in cursor.fetchall())
+                    cursor.close()
+            self._executemany(conn, query, rows)
+
+        results = []
+        for row in rows:
+            results.append(row in existing)
+            if row in existing:
+                existing.discard(row)
+                changes.append((*row, "delete"))
+        return results
+
+    def _flush_delete_user(self, conn, rows: list, changes: list) -> list:
+        usernames = [username for username, in rows]
+        user_ids = {}
+        for chunk in _in_chunks(usernames):
+            cursor = execute(conn, f"SELECT username, id FROM users WHERE username IN ({', '.join(['%s'] * len(chunk))})",
+                             chunk)
+            user_ids.update(cursor.fetchall())
+            cursor.close()
+
+        # Delete passwords first (to maintain database integrity)
+        self._executemany(conn, "DELETE FROM passwords WHERE user_id IN (SELECT id FROM users WHERE username = %s)",
+                          rows)
+        self._executemany(conn, "DELETE FROM users WHERE username = %s", rows)
+
+        results = []
+        for username in usernames:
+            user_id = user_ids.pop(username, None)
+            results.append(user_id is not None)
+            if user_id is not None:
+                changes.append((user_id, None, "delete"))
+        return results
+
+@timed("db.delete_user")
+def delete_user(username: str):
+    """Deletes a user and their stored passwords."""
+    try:
+        with UnitOfWork() as work:
+            work.delete_user(username)
+        if not work.results[0]:
+            print(f"\u274c User '{username}' not found.")
+            return False
+
+        print(f"\U0001F5D1 User '{username}' and all stored passwords deleted successfully!")
+        return True
+    except DB_ERRORS as err:
+        print(f"\u274c Error deleting user: {err}")
+        return False
+
+def count_passwords_by_key() -> dict:
+    """Returns {key_id: row count} across all users (0 is per-user vault keys)."""
+    with get_connection() as conn:
+        cursor = execute(conn, "SELECT key_id, COUNT(*) FROM passwords GROUP BY key_id")
+        counts = dict(cursor.fetchall())
+        cursor.close()
+    return counts
+
+def get_rotation_checkpoint(target_key_id: int):
+    """Returns (last_id, rotated, failed) of an unfinished rotation to target_key_id, or None."""
+    with get_connection() as conn:
+        cursor = execute(conn, "SELECT last_id, rotated, failed FROM key_rotations WHERE target_key_id = %s",
+                         (target_key_id,))
+        checkpoint = cursor.fetchone()
+        cursor.close()
+    return checkpoint
+
+def clear_rotation_checkpoint(target_key_id: int):
+    with get_connection() as conn:
+        execute(conn, "DELETE FROM key_rotations WHERE target_key_id = %s", (target_key_id,)).close()
+        conn.commit()
+
+def get_rows_to_rotate(target_key_id: int, after_id: int, limit: int) -> list:
+    """Returns up to limit (id, key_id, encrypted_password) global-key rows to rewrite, by id.
+
+    That is rows on other global keys, plus rows on the target key still in the legacy format.
+    """
+    with get_connection() as conn:
+        cursor = execute(conn, f"""
+            SELECT id, key_id, encrypted_password FROM passwords
+            WHERE key_id <> 0 AND (key_id <> %s OR {LEGACY_FORMAT_SQL}) AND id > %s ORDER BY id LIMIT %s
+        """, (target_key_id, after_id, limit))
+        rows = cursor.fetchall()
+        cursor.close()
+    return rows
+
+@timed("db.store_rotated_rows")
+def store_rotated_rows(target_key_id: int, rows: list, last_id: int, rotated: int, failed: int) -> int:
+    """Writes one chunk of re-encrypted rows and the rotation checkpoint in one transaction.
+
+    rows holds (id, old_ciphertext, new_ciphertext); a row is only replaced if it still
+    holds old_ciphertext, so concurrent writes win. Returns how many rows were replaced.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(_backend.sql("""
+            UPDATE passwords SET encrypted_password = %s, key_id = %s
+            WHERE id = %s AND encrypted_password = %s
+        """), [(new, target_key_id, row_id, old) for row_id, old, new in rows])
+        replaced = cursor.rowcount if rows else 0
+        cursor.close()
+        execute(conn, _backend.upsert("key_rotations", ("target_key_id", "last_id", "rotated", "failed"),
+                                      ("target_key_id",)),
+                (target_key_id, last_id, rotated + replaced, failed)).close()
+        conn.commit()
+    return replaced
+
+def get_rows_to_upgrade(user_id: int, after_id: int, limit: int) -> list:
+    """Returns up to limit (id, encrypted_password) rows of a user's vault, by id, that are
+    still in the legacy format or have no fingerprint yet."""
+    with get_connection() as conn:
+        cursor = execute(conn, f"""
+            SELECT id, encrypted_password FROM passwords
+            WHERE user_id = %s AND key_id = 0 AND id > %s AND ({LEGACY_FORMAT_SQL} OR fingerprint IS NULL)
+            ORDER BY id LIMIT %s
+        """, (user_id, after_id, limit))
+        rows = cursor.fetchall()
+        cursor.close()
+    return rows
+
+@timed("db.store_upgraded_rows")
+def store_upgraded_rows(rows: list) -> int:
+    """Writes (id, old_ciphertext, new_ciphertext, fingerprint) rows that still hold old_ciphertext.
+
+    Returns how many rows were replaced.
+    """
+    if not rows:
+        return 0
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(_backend.sql("""
+            UPDATE passwords SET encrypted_password = %s, fingerprint = %s
+            WHERE id = %s AND encrypted_password = %s
+        """), [(new, fingerprint, row_id, old) for row_id, old, new, fingerprint in rows])
+        replaced = cursor.rowcount
+        cursor.close()
+        conn.commit()
+    return replaced
+
+@timed("db.find_reused_passwords")
+def find_reused_passwords(user_id: int) -> list:
+    """Returns groups of websites sharing one password, largest first, from the fingerprint index."""
+    with get_connection() as conn:
+        cursor = execute(conn, """
+            SELECT p.fingerprint, p.website
+            FROM (SELECT fingerprint FROM passwords
+                  WHERE user_id = %s AND fingerprint IS NOT NULL
+                  GROUP BY fingerprint HAVING COUNT(*) > 1) reused
+            JOIN passwords p ON p.user_id = %s AND p.fingerprint = reused.fingerprint
+            ORDER BY p.fingerprint, p.website
+        """, (user_id, user_id))
+        groups = {}
+        for fingerprint, website in cursor.fetchall():
+            groups.setdefault(bytes(fingerprint), []).append(website)
+        cursor.close()
+    return sorted(groups.values(), key=lambda websites: (-len(websites), websites))
+
+def count_unfingerprinted(user_id: int) -> int:
+    """Returns how many of a user's passwords have no fingerprint yet (so reuse checks miss them)."""
+    with get_connection() as conn:
+        cursor = execute(conn, "SELECT COUNT(*) FROM passwords WHERE user_id = %s AND fingerprint IS NULL",
+                         (user_id,))
+        count = cursor.fetchone()[0]
+        cursor.close()
+    return count
+
+def latest_change_seq() -> int:
+    """Returns the newest sequence number in the password change log (0 if it is empty)."""
+    with get_connection() as conn:
+        cursor = execute(conn, "SELECT MAX(seq) FROM password_changes")
+        seq = cursor.fetchone()[0]
+        cursor.close()
+    return seq or 0
+
+def get_changed_websites(user_id: int, after_seq: int, up_to_seq: int) -> list:
+    """Returns the websites of a user written or deleted in the change log range (after_seq, up_to_seq]."""
+    with get_connection() as conn:
+        cursor = execute(conn, """
+            SELECT DISTINCT website FROM password_changes
+            WHERE user_id = %s AND seq > %s AND seq <= %s
+        """, (user_id, after_seq, up_to_seq))
+        websites = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+    return websites
+
+def get_current_passwords(user_id: int, websites: list) -> dict:
+    """Returns {website: encrypted_password} for those of the websites that are stored. Database errors are raised."""
+    found = {}
+    with get_connection() as conn:
+        for chunk in _in_chunks(websites):
+            cursor = execute(conn, f"""
+                SELECT website, encrypted_password FROM passwords
+                WHERE user_id = %s AND website IN ({', '.join(['%s'] * len(chunk))})
+            """, (user_id, *chunk))
+            found.update(cursor.fetchall())
+            cursor.close()
+    return found
+
+def get_user_auth_record(user_id: int):
+    """Returns (username, master_password_hash, kdf_salt, kdf_iterations, wrapped_key), or None. Database errors are raised."""
+    with get_connection() as conn:
+        cursor = execute(conn, """
+            SELECT username, master_password_hash, kdf_salt, kdf_iterations, wrapped_key
+            FROM users WHERE id = %s
+        """, (user_id,))
+        record = cursor.fetchone()
+        cursor.close()
+    return record
+
+# Tables copied by snapshot backups (see backup.py), in the order they are restored
+SNAPSHOT_TABLES = ("users", "passwords")
+
+# The unique key besides id of each snapshot table, which a restored row may take over from another id
+SNAPSHOT_UNIQUE_KEYS = {"users": ("username",), "passwords": ("user_id", "website")}
+
+@contextmanager
+def snapshot_connection():
+    """Checks a connection out inside a read-only transaction that sees one consistent snapshot."""
+    with get_connection() as conn:
+        _backend.begin_snapshot(conn)
+        yield conn
+        conn.rollback()
+
+def table_columns(conn, table: str) -> list:
+    cursor = execute(conn, f"SELECT * FROM {table} WHERE 1 = 0")
+    cursor.fetchall()
+    columns = [column[0] for column in cursor.description]
+    cursor.close()
+    return columns
+
+def current_timestamp(conn) -> str:
+    """Returns the database's CURRENT_TIMESTAMP in the text form updated_at compares against."""
+    cursor = execute(conn, "SELECT CURRENT_TIMESTAMP")
+    value = cursor.fetchone()[0]
+    cursor.close()
+    return str(value)
+
+def stream_table(conn, table: str, columns: list, updated_since: str = None,
+                 chunk_size: int = DB_STREAM_CHUNK_SIZE):
+    """Yields a table's rows in id order from a streaming cursor on conn.
+
+    With updated_since, only rows updated at or after that timestamp are read. The rows
+    must be read to the end before conn runs another query.
+    """
+    query = f"SELECT {', '.join(columns)} FROM {table}"
+    params = ()
+    if updated_since is not None:
+        query += " WHERE updated_at >= %s OR updated_at IS NULL"
+        params = (updated_since,)
+    cursor = _backend.stream_cursor(conn)
+    cursor.execute(_backend.sql(query + " ORDER BY id"), params)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield from rows
+    cursor.close()
+
+def iter_ids(table: str):
+    """Yields every id in a table in ascending order. Database errors are raised."""
+    return (row[0] for row in _stream_rows(f"SELECT id FROM {table} ORDER BY id", (), DB_STREAM_CHUNK_SIZE))
+
+def restore_rows(table: str, columns: list, rows: list) -> int:
+    """Writes snapshot rows in one transaction, replacing any row with the same id or unique key.
+
+    A row under another id that holds a restored row's unique key (a website deleted and
+    stored again, a username moved to another account) is deleted first; deleting a user
+    takes their passwords with them. Database errors are raised.
+    """
+    key = SNAPSHOT_UNIQUE_KEYS[table]
+    key_positions = [columns.index(c) for c in key + ("id",)]
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(_backend.sql(
+            f"DELETE FROM {table} WHERE {' AND '.join(f'{c} = %s' for c in key)} AND id <> %s"),
+            [[row[i] for i in key_positions] for row in rows])
+        cursor.executemany(_backend.sql(_backend.upsert(table, tuple(columns), ("id",))), rows)
+        stamps = [c for c in ("created_at", "updated_at") if c in columns]
+        if stamps and _backend.timestamp_triggers:
+            # The insert triggers stamped every row with the current time; put the snapshot's back
+            positions = [columns.index(c) for c in stamps + ["id"]]
+            cursor.executemany(_backend.sql(
+                f"UPDATE {table} SET {', '.join(f'{c} = %s' for c in stamps)} WHERE id = %s"),
+                [[row[i] for i in positions] for row in rows])
+        cursor.close()
+        conn.commit()
+    return len(rows)
+
+def delete_rows(table: str, ids: list) -> int:
+    """Deletes rows by id in one transaction (a user's passwords go with them). Database errors are raised."""
+    with get_connection() as conn:
+        for chunk in _in_chunks(ids):
+            execute(conn, f"DELETE FROM {table} WHERE id IN ({', '.join(['%s'] * len(chunk))})", chunk).close()
+        conn.commit()
+    return len(ids)
+
+# Initialize database tables if they don't exist
+if __name__ == "__main__":
+    create_tables()
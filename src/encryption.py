@@ -1,57 +1,219 @@
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from cryptography.hazmat.primitives import hashes
-import base64
-import os
-from config import AES_KEY  
-
-def encrypt_password(password: str) -> str:
-    """Encrypts a password using AES encryption."""
-    try:
-        password_bytes = password.encode()
-
-        # Generate a random IV (Initialization Vector)
-        iv = os.urandom(16)
-
-        # Create AES cipher
-        cipher = Cipher(algorithms.AES(AES_KEY), modes.CBC(iv))
-        encryptor = cipher.encryptor()
-
-        # Pad password to be multiple of block size (16 bytes)
-        padding_length = 16 - (len(password_bytes) % 16)
-        padded_password = password_bytes + bytes([padding_length] * padding_length)
-
-        # Encrypt
-        encrypted_password = encryptor.update(padded_password) + encryptor.finalize()
-
-        # Encode as Base64 for storage
-        encrypted_data = base64.b64encode(iv + encrypted_password).decode()
-        return encrypted_data
-    
-    except Exception as e:
-        return f"⚠️ Encryption Error: {str(e)}"
-
-def decrypt_password(encrypted_data: str) -> str:
-    """Decrypts an AES-encrypted password."""
-    try:
-        encrypted_data_bytes = base64.b64decode(encrypted_data)
-
-        # Extract IV and encrypted password
-        iv = encrypted_data_bytes[:16]
-        encrypted_password = encrypted_data_bytes[16:]
-
-        # Create AES cipher
-        cipher = Cipher(algorithms.AES(AES_KEY), modes.CBC(iv))
-        decryptor = cipher.decryptor()
-
-        # Decrypt
-        decrypted_padded_password = decryptor.update(encrypted_password) + decryptor.finalize()
-
-        # Remove padding
-        padding_length = decrypted_padded_password[-1]
-        decrypted_password = decrypted_padded_password[:-padding_length]
-
-        return decrypted_password.decode()
-    
-    except Exception as e:
-        return f"⚠️ Decryption Error: {str(e)}"
+from functools import partial
+import base64
+import hashlib
+import hmac
+import os
+import struct
+import threading
+import config
+from config import CRYPTO_PARALLEL_THRESHOLD, CRYPTO_WORKERS
+from metrics import timed
+
+# Ciphertext record format, stored as binary:
+#   version (1 byte) | key ID (2 bytes, big-endian) | nonce (12 bytes) | AES-GCM ciphertext + 16-byte tag
+# The version and key ID are authenticated as associated data. Records written before this
+# format are base64 text of IV + AES-CBC ciphertext; they never start with a 0x01 byte and
+# are still read.
+FORMAT_VERSION = 1
+NONCE_SIZE = 12
+TAG_SIZE = 16
+_HEADER = struct.Struct(">BH")
+HEADER_SIZE = _HEADER.size
+
+BLOCK_SIZE = 16
+
+# PKCS#7 padding for every possible pad length, built once instead of per password
+_PADDING = [bytes([n] * n) for n in range(BLOCK_SIZE + 1)]
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _aes():
+    """Returns (Cipher, algorithms, modes), importing the cryptography backend on first use."""
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    return Cipher, algorithms, modes
+
+def _aesgcm(key: bytes):
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    return AESGCM(key)
+
+def is_legacy_format(encrypted_data) -> bool:
+    """True for base64 AES-CBC records written before the versioned binary format."""
+    return isinstance(encrypted_data, str) or not encrypted_data or encrypted_data[0] != FORMAT_VERSION
+
+def record_key_id(encrypted_data) -> int:
+    """Returns the key ID in a record's header (None for legacy records)."""
+    if is_legacy_format(encrypted_data):
+        return None
+    return _HEADER.unpack_from(encrypted_data)[1]
+
+@timed("crypto.encrypt_password")
+def encrypt_password(password: str, key: bytes = None, key_id: int = 0) -> bytes:
+    """Encrypts a password with AES-GCM (with the user's vault key, if given) into a binary record."""
+    try:
+        key = config.AES_KEY if key is None else key
+        header = _HEADER.pack(FORMAT_VERSION, key_id)
+
+        # A fresh random nonce per record; GCM appends the authentication tag
+        nonce = os.urandom(NONCE_SIZE)
+        return header + nonce + _aesgcm(key).encrypt(nonce, password.encode(), header)
+
+    except Exception as e:
+        return f"⚠️ Encryption Error: {str(e)}"
+
+@timed("crypto.decrypt_password")
+def decrypt_password(encrypted_data, key: bytes = None) -> str:
+    """Decrypts a stored record of either format (with the user's vault key, if given)."""
+    try:
+        key = config.AES_KEY if key is None else key
+        if is_legacy_format(encrypted_data):
+            return _decrypt_cbc_chunk([encrypted_data], key)[0]
+
+        header = encrypted_data[:HEADER_SIZE]
+        nonce = encrypted_data[HEADER_SIZE:HEADER_SIZE + NONCE_SIZE]
+        return _aesgcm(key).decrypt(nonce, encrypted_data[HEADER_SIZE + NONCE_SIZE:], header).decode()
+
+    except Exception as e:
+        return f"⚠️ Decryption Error: {str(e) or type(e).__name__}"
+
+# Fingerprints are truncated HMAC-SHA256 tags of a password under a key derived from the
+# vault key. Equal passwords in one vault get equal fingerprints, so reuse can be found
+# with an indexed query; without the key a fingerprint reveals nothing about the password.
+FINGERPRINT_SIZE = 16
+_FINGERPRINT_CONTEXT = b"password fingerprint v1"
+
+def fingerprint_many(passwords, key: bytes = None) -> list:
+    """Returns the reuse fingerprint of each password, in order."""
+    fingerprint_key = hmac.new(config.AES_KEY if key is None else key, _FINGERPRINT_CONTEXT, hashlib.sha256).digest()
+    return [hmac.new(fingerprint_key, password.encode(), hashlib.sha256).digest()[:FINGERPRINT_SIZE]
+            for password in passwords]
+
+def fingerprint_password(password: str, key: bytes = None) -> bytes:
+    return fingerprint_many([password], key)[0]
+
+def _encrypt_chunk(passwords: list, key: bytes, key_id: int = 0) -> list:
+    """Encrypts a list of passwords reusing one AES-GCM key object and one block of random nonces."""
+    aesgcm = _aesgcm(key)
+    header = _HEADER.pack(FORMAT_VERSION, key_id)
+    nonces = os.urandom(NONCE_SIZE * len(passwords))
+    results = []
+
+    for i, password in enumerate(passwords):
+        try:
+            nonce = nonces[i * NONCE_SIZE:(i + 1) * NONCE_SIZE]
+            results.append(header + nonce + aesgcm.encrypt(nonce, password.encode(), header))
+        except Exception as e:
+            results.append(f"⚠️ Encryption Error: {str(e)}")
+
+    return results
+
+def _decrypt_chunk(encrypted_items: list, key: bytes, key_id: int = 0) -> list:
+    """Decrypts a list of records of either format reusing one key object per format."""
+    aesgcm = None
+    results = []
+
+    for encrypted_data in encrypted_items:
+        if is_legacy_format(encrypted_data):
+            results.append(_decrypt_cbc_chunk([encrypted_data], key)[0])
+            continue
+        try:
+            aesgcm = aesgcm or _aesgcm(key)
+            data = memoryview(encrypted_data)
+            nonce = data[HEADER_SIZE:HEADER_SIZE + NONCE_SIZE]
+            results.append(aesgcm.decrypt(nonce, data[HEADER_SIZE + NONCE_SIZE:], data[:HEADER_SIZE]).decode())
+        except Exception as e:
+            results.append(f"⚠️ Decryption Error: {str(e) or type(e).__name__}")
+
+    return results
+
+def _encrypt_cbc_chunk(passwords: list, key: bytes, key_id: int = 0) -> list:
+    """Writes the legacy base64 AES-CBC format; kept for compatibility checks and benchmarks."""
+    Cipher, algorithms, modes = _aes()
+    algorithm = algorithms.AES(key)
+    ivs = os.urandom(BLOCK_SIZE * len(passwords))
+    buffer = bytearray(256)
+    results = []
+
+    for i, password in enumerate(passwords):
+        try:
+            password_bytes = password.encode()
+            padded_password = password_bytes + _PADDING[BLOCK_SIZE - len(password_bytes) % BLOCK_SIZE]
+            if len(buffer) < len(padded_password) + BLOCK_SIZE:
+                buffer = bytearray(2 * len(padded_password) + BLOCK_SIZE)
+
+            iv = ivs[i * BLOCK_SIZE:(i + 1) * BLOCK_SIZE]
+            encryptor = Cipher(algorithm, modes.CBC(iv)).encryptor()
+            length = encryptor.update_into(padded_password, buffer)
+            encryptor.finalize()
+
+            results.append(base64.b64encode(iv + buffer[:length]).decode())
+        except Exception as e:
+            results.append(f"⚠️ Encryption Error: {str(e)}")
+
+    return results
+
+def _decrypt_cbc_chunk(encrypted_items: list, key: bytes) -> list:
+    """Decrypts legacy base64 AES-CBC records reusing one AES key object and output buffer."""
+    Cipher, algorithms, modes = _aes()
+    algorithm = algorithms.AES(key)
+    buffer = bytearray(256)
+    results = []
+
+    for encrypted_data in encrypted_items:
+        try:
+            encrypted_data_bytes = memoryview(base64.b64decode(encrypted_data))
+            iv = encrypted_data_bytes[:BLOCK_SIZE]
+            encrypted_password = encrypted_data_bytes[BLOCK_SIZE:]
+            if len(buffer) < len(encrypted_password) + BLOCK_SIZE:
+                buffer = bytearray(2 * len(encrypted_password) + BLOCK_SIZE)
+
+            decryptor = Cipher(algorithm, modes.CBC(bytes(iv))).decryptor()
+            length = decryptor.update_into(encrypted_password, buffer)
+            decryptor.finalize()
+
+            padding_length = buffer[length - 1]
+            results.append(bytes(buffer[:length - padding_length]).decode())
+        except Exception as e:
+            results.append(f"⚠️ Decryption Error: {str(e)}")
+
+    return results
+
+def _get_executor():
+    """Returns the shared process pool used for very large batches."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            from concurrent.futures import ProcessPoolExecutor
+            _executor = ProcessPoolExecutor(max_workers=CRYPTO_WORKERS)
+    return _executor
+
+def _run_batch(worker, items, key, parallel_threshold, key_id=0):
+    items = list(items)
+    worker = partial(worker, key=config.AES_KEY if key is None else key, key_id=key_id)
+    if not parallel_threshold or len(items) < parallel_threshold or CRYPTO_WORKERS < 2:
+        return worker(items)
+
+    # A few chunks per worker keeps them evenly loaded; map() preserves order
+    chunk_size = -(-len(items) // (CRYPTO_WORKERS * 4))
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    results = []
+    for chunk_result in _get_executor().map(worker, chunks):
+        results.extend(chunk_result)
+    return results
+
+@timed("crypto.encrypt_many")
+def encrypt_many(passwords, key: bytes = None, parallel_threshold: int = CRYPTO_PARALLEL_THRESHOLD,
+                 key_id: int = 0) -> list:
+    """Encrypts an iterable of passwords, returning records in the same order.
+
+    Batches of at least `parallel_threshold` items are spread over a process pool.
+    """
+    return _run_batch(_encrypt_chunk, passwords, key, parallel_threshold, key_id)
+
+@timed("crypto.decrypt_many")
+def decrypt_many(encrypted_items, key: bytes = None, parallel_threshold: int = CRYPTO_PARALLEL_THRESHOLD) -> list:
+    """Decrypts an iterable of records of either format, returning passwords in the same order.
+
+    Batches of at least `parallel_threshold` items are spread over a process pool.
+    """
+    return _run_batch(_decrypt_chunk, encrypted_items, key, parallel_threshold)
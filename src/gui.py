@@ -1,182 +1,329 @@
-from PyQt6.QtWidgets import (
-    QApplication, QWidget, QVBoxLayout, QLineEdit, QPushButton, 
-    QMessageBox, QInputDialog, QTableWidget, QTableWidgetItem
-)
-from auth import register_user, login_user
-from database import add_password, get_passwords, delete_password, delete_user
-from encryption import encrypt_password, decrypt_password
-import sys
-
-class PasswordManagerGUI(QWidget):
-    def __init__(self):
-        super().__init__()
-        self.user_id = None
-        self.table_window = None  # Store reference for password retrieval window
-        self.init_login_screen()
-
-    def clear_layout(self):
-        """Clears the existing layout to prevent multiple layouts on the same widget."""
-        if self.layout():
-            QWidget().setLayout(self.layout())
-
-    def init_login_screen(self):
-        """Initializes the login screen."""
-        self.setWindowTitle("🔐 Secure Password Manager - Login")
-        self.setGeometry(100, 100, 400, 300)
-        self.clear_layout()
-
-        layout = QVBoxLayout()
-        
-        self.username_input = QLineEdit(self)
-        self.username_input.setPlaceholderText("Enter Username")
-        layout.addWidget(self.username_input)
-
-        self.password_input = QLineEdit(self)
-        self.password_input.setPlaceholderText("Enter Master Password")
-        self.password_input.setEchoMode(QLineEdit.EchoMode.Password)
-        layout.addWidget(self.password_input)
-
-        self.login_button = QPushButton("Login", self)
-        self.login_button.clicked.connect(self.login)
-        layout.addWidget(self.login_button)
-
-        self.register_button = QPushButton("Register", self)
-        self.register_button.clicked.connect(self.register)
-        layout.addWidget(self.register_button)
-
-        self.setLayout(layout)
-
-    def login(self):
-        """Handles user login."""
-        username = self.username_input.text()
-        password = self.password_input.text()
-        if not username or not password:
-            QMessageBox.warning(self, "Input Error", "Username and password cannot be empty.")
-            return
-        
-        user = login_user(username, password)
-        if user:
-            self.user_id = user[0]  # Retrieve user_id correctly
-            self.init_dashboard()
-        else:
-            QMessageBox.warning(self, "Login Failed", "Invalid username or password.")
-
-    def register(self):
-        """Handles user registration."""
-        username = self.username_input.text()
-        password = self.password_input.text()
-        if not username or not password:
-            QMessageBox.warning(self, "Input Error", "Username and password cannot be empty.")
-            return
-        
-        if register_user(username, password):
-            QMessageBox.information(self, "Success", "Registration successful. You can now log in.")
-        else:
-            QMessageBox.warning(self, "Error", "Username already exists.")
-
-    def init_dashboard(self):
-        """Initializes the dashboard."""
-        self.setWindowTitle("🔑 Password Manager Dashboard")
-        self.setGeometry(100, 100, 500, 400)
-        self.clear_layout()
-
-        layout = QVBoxLayout()
-
-        store_btn = QPushButton("Store a New Password", self)
-        store_btn.clicked.connect(self.store_password)
-        layout.addWidget(store_btn)
-
-        retrieve_btn = QPushButton("Retrieve a Stored Password", self)
-        retrieve_btn.clicked.connect(self.retrieve_password)
-        layout.addWidget(retrieve_btn)
-
-        delete_btn = QPushButton("Delete a Stored Password", self)
-        delete_btn.clicked.connect(self.delete_password)
-        layout.addWidget(delete_btn)
-
-        delete_acc_btn = QPushButton("Delete Your Account", self)
-        delete_acc_btn.clicked.connect(self.delete_account)
-        layout.addWidget(delete_acc_btn)
-
-        logout_btn = QPushButton("Logout", self)
-        logout_btn.clicked.connect(self.logout)
-        layout.addWidget(logout_btn)
-
-        self.setLayout(layout)
-
-    def store_password(self):
-        """Stores an encrypted password."""
-        website, ok = QInputDialog.getText(self, "Store Password", "Enter Website:")
-        if ok and website:
-            password, ok = QInputDialog.getText(self, "Store Password", "Enter Password:")
-            if ok and password:
-                encrypted_password = encrypt_password(password)
-                if add_password(self.user_id, website, encrypted_password):
-                    QMessageBox.information(self, "Success", "Password stored successfully!")
-                else:
-                    QMessageBox.warning(self, "Error", "Failed to store password.")
-
-    def retrieve_password(self):
-        """Retrieves stored passwords and displays them in a table."""
-        passwords = get_passwords(self.user_id)
-        if not passwords:
-            QMessageBox.information(self, "No Data", "No passwords stored.")
-            return
-
-        self.table_window = QWidget()
-        self.table_window.setWindowTitle("Stored Passwords")
-        self.table_window.setGeometry(150, 150, 400, 300)
-
-        layout = QVBoxLayout()
-
-        table = QTableWidget()
-        table.setRowCount(len(passwords))
-        table.setColumnCount(2)
-        table.setHorizontalHeaderLabels(["Website", "Decrypted Password"])
-
-        for row, (website, enc_password) in enumerate(passwords):
-            decrypted_pass = decrypt_password(enc_password)
-            table.setItem(row, 0, QTableWidgetItem(website))
-            table.setItem(row, 1, QTableWidgetItem(decrypted_pass))
-
-        layout.addWidget(table)
-        self.table_window.setLayout(layout)
-        self.table_window.show()
-
-    def delete_password(self):
-        """Deletes a stored password."""
-        website, ok = QInputDialog.getText(self, "Delete Password", "Enter Website to delete:")
-        if ok and website:
-            if delete_password(self.user_id, website):
-                QMessageBox.information(self, "Success", "Password deleted successfully!")
-            else:
-                QMessageBox.warning(self, "Error", "Password not found.")
-
-    def delete_account(self):
-        """Deletes the user's account."""
-        confirm = QMessageBox.question(
-            self, "Delete Account", "Are you sure? This cannot be undone!",
-            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
-        )
-        if confirm == QMessageBox.StandardButton.Yes:
-            if delete_user(self.user_id):
-                QMessageBox.information(self, "Deleted", "Account deleted successfully!")
-                self.logout()
-            else:
-                QMessageBox.warning(self, "Error", "Failed to delete account.")
-
-    def logout(self):
-        """Logs out the user."""
-        self.user_id = None
-        self.init_login_screen()
-
-def launch_gui():
-    """Launches the GUI application."""
-    app = QApplication(sys.argv)
-    window = PasswordManagerGUI()
-    window.show()
-    sys.exit(app.exec())
-
-# Allow direct execution of this script
-if __name__ == "__main__":
-    launch_gui()
+from PyQt6.QtWidgets import (
+    QApplication, QWidget, QVBoxLayout, QLineEdit, QPushButton, 
+    QMessageBox, QInputDialog, QTableView, QHeaderView, QCheckBox,
+    QHBoxLayout, QProgressBar, QLabel
+)
+from auth import register_user, login_user
+from breach import check_password
+from database import delete_user
+from encryption import encrypt_password, fingerprint_password
+from health import format_health_report, vault_health
+from keys import get_user_key, lock_vault
+from replica import read_count, remove_password, store_password
+from search import warm_index, drop_index
+from session_cache import secret_cache
+from vault_model import VaultTableModel
+from workers import TaskRunner
+import sys
+
+class PasswordManagerGUI(QWidget):
+    def __init__(self):
+        super().__init__()
+        self.user_id = None
+        self.username = None
+        self.table_window = None  # Store reference for password retrieval window
+        self.tasks = TaskRunner(self)  # Runs bcrypt and database calls off the GUI thread
+        self.tasks.active_changed.connect(self.update_busy_indicator)
+        self.init_login_screen()
+
+    def add_busy_indicator(self, layout):
+        """Adds a progress bar and cancel button shown while background tasks run."""
+        status = QHBoxLayout()
+        self.busy_label = QLabel(self)
+        status.addWidget(self.busy_label)
+
+        self.busy_bar = QProgressBar(self)
+        self.busy_bar.setRange(0, 0)  # Indeterminate
+        status.addWidget(self.busy_bar)
+
+        self.cancel_button = QPushButton("Cancel", self)
+        self.cancel_button.clicked.connect(self.tasks.cancel_all)
+        status.addWidget(self.cancel_button)
+
+        layout.addLayout(status)
+        self.update_busy_indicator(self.tasks.active)
+
+    def update_busy_indicator(self, active: int):
+        """Shows the busy indicator while any background task is running."""
+        for widget in (self.busy_label, self.busy_bar, self.cancel_button):
+            widget.setVisible(active > 0)
+        self.busy_label.setText(f"Working on {active} task(s)...")
+
+    def set_auth_buttons_enabled(self, enabled: bool):
+        self.login_button.setEnabled(enabled)
+        self.register_button.setEnabled(enabled)
+
+    def clear_layout(self):
+        """Clears the existing layout to prevent multiple layouts on the same widget."""
+        if self.layout():
+            QWidget().setLayout(self.layout())
+
+    def init_login_screen(self):
+        """Initializes the login screen."""
+        self.setWindowTitle("🔐 Secure Password Manager - Login")
+        self.setGeometry(100, 100, 400, 300)
+        self.clear_layout()
+
+        layout = QVBoxLayout()
+        
+        self.username_input = QLineEdit(self)
+        self.username_input.setPlaceholderText("Enter Username")
+        layout.addWidget(self.username_input)
+
+        self.password_input = QLineEdit(self)
+        self.password_input.setPlaceholderText("Enter Master Password")
+        self.password_input.setEchoMode(QLineEdit.EchoMode.Password)
+        layout.addWidget(self.password_input)
+
+        self.login_button = QPushButton("Login", self)
+        self.login_button.clicked.connect(self.login)
+        layout.addWidget(self.login_button)
+
+        self.register_button = QPushButton("Register", self)
+        self.register_button.clicked.connect(self.register)
+        layout.addWidget(self.register_button)
+
+        self.add_busy_indicator(layout)
+        self.setLayout(layout)
+
+    def login(self):
+        """Handles user login."""
+        username = self.username_input.text()
+        password = self.password_input.text()
+        if not username or not password:
+            QMessageBox.warning(self, "Input Error", "Username and password cannot be empty.")
+            return
+
+        def on_result(result):
+            user_id, message = result
+            if user_id:
+                self.user_id = user_id
+                self.username = username
+                warm_index(user_id)  # Build the search index behind the dashboard
+                self.init_dashboard()
+            else:
+                QMessageBox.warning(self, "Login Failed", message)
+
+        self.run_auth_task(login_user, username, password, on_result=on_result)
+
+    def register(self):
+        """Handles user registration."""
+        username = self.username_input.text()
+        password = self.password_input.text()
+        if not username or not password:
+            QMessageBox.warning(self, "Input Error", "Username and password cannot be empty.")
+            return
+
+        def on_result(message):
+            if message.startswith("✅"):
+                QMessageBox.information(self, "Success", "Registration successful. You can now log in.")
+            else:
+                QMessageBox.warning(self, "Error", message)
+
+        self.run_auth_task(register_user, username, password, on_result=on_result)
+
+    def run_auth_task(self, fn, *args, on_result):
+        """Runs a login or registration call in the background, one at a time."""
+        self.set_auth_buttons_enabled(False)
+
+        def on_done(*_):
+            # The login screen may have been replaced while the task ran
+            if self.user_id is None:
+                self.set_auth_buttons_enabled(True)
+
+        worker = self.tasks.start(fn, *args, on_result=on_result, on_error=self.show_task_error)
+        worker.signals.done.connect(on_done)
+
+    def show_task_error(self, message: str):
+        QMessageBox.warning(self, "Error", message)
+
+    def init_dashboard(self):
+        """Initializes the dashboard."""
+        self.setWindowTitle("🔑 Password Manager Dashboard")
+        self.setGeometry(100, 100, 500, 400)
+        self.clear_layout()
+
+        layout = QVBoxLayout()
+
+        store_btn = QPushButton("Store a New Password", self)
+        store_btn.clicked.connect(self.store_password)
+        layout.addWidget(store_btn)
+
+        retrieve_btn = QPushButton("Retrieve a Stored Password", self)
+        retrieve_btn.clicked.connect(self.retrieve_password)
+        layout.addWidget(retrieve_btn)
+
+        delete_btn = QPushButton("Delete a Stored Password", self)
+        delete_btn.clicked.connect(self.delete_password)
+        layout.addWidget(delete_btn)
+
+        health_btn = QPushButton("Vault Health Report", self)
+        health_btn.clicked.connect(self.show_health_report)
+        layout.addWidget(health_btn)
+
+        delete_acc_btn = QPushButton("Delete Your Account", self)
+        delete_acc_btn.clicked.connect(self.delete_account)
+        layout.addWidget(delete_acc_btn)
+
+        logout_btn = QPushButton("Logout", self)
+        logout_btn.clicked.connect(self.logout)
+        layout.addWidget(logout_btn)
+
+        self.add_busy_indicator(layout)
+        self.setLayout(layout)
+
+    def store_password(self):
+        """Stores an encrypted password."""
+        website, ok = QInputDialog.getText(self, "Store Password", "Enter Website:")
+        if ok and website:
+            password, ok = QInputDialog.getText(self, "Store Password", "Enter Password:")
+            if ok and password:
+                def on_result(stored):
+                    if stored:
+                        QMessageBox.information(self, "Success", "Password stored successfully!")
+                    else:
+                        QMessageBox.warning(self, "Error", "Failed to store password.")
+
+                def on_checked(breaches):
+                    if breaches:
+                        confirm = QMessageBox.question(
+                            self, "Breached Password",
+                            f"This password has appeared {breaches} times in data breaches. Store it anyway?",
+                            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
+                        )
+                        if confirm != QMessageBox.StandardButton.Yes:
+                            return
+                    def store():
+                        key = get_user_key(user_id)
+                        return store_password(user_id, website, encrypt_password(password, key),
+                                              fingerprint_password(password, key))
+
+                    self.tasks.start(store, on_result=on_result, on_error=self.show_task_error)
+
+                user_id = self.user_id
+                self.tasks.start(check_password, password, on_result=on_checked, on_error=self.show_task_error)
+
+    def retrieve_password(self):
+        """Counts the stored passwords in the background, then opens the table of them."""
+        def on_result(row_count):
+            if row_count == 0:
+                QMessageBox.information(self, "No Data", "No passwords stored.")
+                return
+            self.show_table_window(VaultTableModel(self.user_id, row_count, self.tasks))
+
+        self.tasks.start(read_count, self.user_id, on_result=on_result, on_error=self.show_task_error)
+
+    def show_table_window(self, model):
+        """Opens a table of stored passwords that loads and decrypts rows on demand."""
+        self.close_table_window()
+        self.table_window = QWidget()
+        self.table_window.setWindowTitle("Stored Passwords")
+        self.table_window.setGeometry(150, 150, 400, 300)
+
+        layout = QVBoxLayout()
+
+        filter_input = QLineEdit()
+        filter_input.setPlaceholderText("Filter websites...")
+        layout.addWidget(filter_input)
+
+        reveal_box = QCheckBox("Show passwords")
+        layout.addWidget(reveal_box)
+
+        table = QTableView()
+        table.setModel(model)
+        # Fixed row heights let the view lay out any number of rows without measuring them
+        table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        table.horizontalHeader().setStretchLastSection(True)
+        table.doubleClicked.connect(lambda index: model.toggle_reveal(index.row()))
+        reveal_box.toggled.connect(model.set_reveal_all)
+
+        def update_visible_rows():
+            first = table.rowAt(0)
+            last = table.rowAt(table.viewport().height() - 1)
+            model.set_visible_range(max(first, 0), last if last >= 0 else model.rowCount() - 1)
+
+        table.verticalScrollBar().valueChanged.connect(update_visible_rows)
+        table.verticalScrollBar().rangeChanged.connect(update_visible_rows)
+        filter_input.textChanged.connect(model.set_filter)
+        model.modelReset.connect(update_visible_rows)  # Filter results arrive from the task runner
+        update_visible_rows()
+
+        layout.addWidget(table)
+        self.table_window.setLayout(layout)
+        self.table_window.model = model
+        self.table_window.show()
+
+    def close_table_window(self):
+        """Closes the password table and drops any decrypted values it holds."""
+        if self.table_window:
+            model = getattr(self.table_window, "model", None)
+            if model:
+                model.clear()
+            self.table_window.close()
+            self.table_window = None
+
+    def delete_password(self):
+        """Deletes a stored password."""
+        website, ok = QInputDialog.getText(self, "Delete Password", "Enter Website to delete:")
+        if ok and website:
+            def on_result(deleted):
+                if deleted:
+                    QMessageBox.information(self, "Success", "Password deleted successfully!")
+                else:
+                    QMessageBox.warning(self, "Error", "Password not found.")
+
+            self.tasks.start(remove_password, self.user_id, website,
+                             on_result=on_result, on_error=self.show_task_error)
+
+    def show_health_report(self):
+        """Shows which websites share a password."""
+        self.tasks.start(vault_health, self.user_id,
+                         on_result=lambda report: QMessageBox.information(self, "Vault Health",
+                                                                          format_health_report(report)),
+                         on_error=self.show_task_error)
+
+    def delete_account(self):
+        """Deletes the user's account."""
+        confirm = QMessageBox.question(
+            self, "Delete Account", "Are you sure? This cannot be undone!",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
+        )
+        if confirm == QMessageBox.StandardButton.Yes:
+            def on_result(deleted):
+                if deleted:
+                    QMessageBox.information(self, "Deleted", "Account deleted successfully!")
+                    self.logout()
+                else:
+                    QMessageBox.warning(self, "Error", "Failed to delete account.")
+
+            self.tasks.start(delete_user, self.username,
+                             on_result=on_result, on_error=self.show_task_error)
+
+    def logout(self):
+        """Logs out the user."""
+        self.tasks.cancel_all()
+        self.close_table_window()
+        if self.user_id is not None:
+            secret_cache.invalidate(self.user_id)  # Wipe this session's decrypted secrets
+            lock_vault(self.user_id)
+            drop_index(self.user_id)
+        self.user_id = None
+        self.username = None
+        self.init_login_screen()
+
+    def closeEvent(self, event):
+        """Lets running database writes finish before the application exits."""
+        self.tasks.cancel_all()
+        self.tasks.wait()
+        super().closeEvent(event)
+
+def launch_gui():
+    """Launches the GUI application."""
+    app = QApplication(sys.argv)
+    window = PasswordManagerGUI()
+    window.show()
+    sys.exit(app.exec())
+
+# Allow direct execution of this script
+if __name__ == "__main__":
+    launch_gui()
@@ -0,0 +1,34 @@
+"""Vault health report: passwords reused across websites, from the fingerprint index.
+
+Reuse is found with an indexed GROUP BY over the keyed fingerprints stored with each
+row, so the report never decrypts the vault. Rows written before fingerprints existed
+are backfilled first (see keys.upgrade_vault_rows).
+"""
+from database import count_passwords, count_unfingerprinted, find_reused_passwords
+from keys import upgrade_vault_rows
+
+def vault_health(user_id: int, backfill: bool = True) -> dict:
+    """Returns {"total", "reused", "unchecked"} for a logged-in user.
+
+    reused is a list of website groups that share one password; unchecked counts rows
+    that have no fingerprint (only rows still on a global key, once backfilled).
+    """
+    if backfill:
+        upgrade_vault_rows(user_id)
+    return {
+        "total": count_passwords(user_id),
+        "reused": find_reused_passwords(user_id),
+        "unchecked": count_unfingerprinted(user_id),
+    }
+
+def format_health_report(report: dict) -> str:
+    lines = [f"🔐 {report['total']} stored passwords"]
+    if report["reused"]:
+        shared = sum(len(group) for group in report["reused"])
+        lines.append(f"⚠️ {shared} websites share {len(report['reused'])} reused passwords:")
+        lines += [f"   • {', '.join(group)}" for group in report["reused"]]
+    else:
+        lines.append("✅ No password is used for more than one website.")
+    if report["unchecked"]:
+        lines.append(f"ℹ️ {report['unchecked']} passwords could not be checked for reuse yet.")
+    return "\n".join(lines)
@@ -0,0 +1,251 @@
+import base64
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+import config
+from config import VAULT_UPGRADE_CHUNK_SIZE, KEY_CACHE_SIZE
+import database
+from database import get_rows_to_upgrade, get_user_key_record, store_upgraded_rows, store_user_key_record
+from encryption import encrypt_many, decrypt_many, fingerprint_many, is_legacy_format
+from metrics import timed
+
+SALT_SIZE = 16
+KEY_SIZE = 32
+
+class VaultLockedError(Exception):
+    """Raised when a user's vault key is needed but the user has not unlocked it."""
+
+class KeyCache:
+    """Bounded LRU cache of unlocked per-user vault keys, wiped on eviction.
+
+    Pinned keys (e.g. of users with a live API session) are never evicted and do not
+    count towards max_entries; they stay until unpinned and discarded.
+    """
+
+    def __init__(self, max_entries: int = KEY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._keys = OrderedDict()  # user_id -> bytearray
+        self._pins = {}  # user_id -> number of holders keeping the key unlocked
+        self._lock = threading.Lock()
+
+    def put(self, user_id: int, key: bytes):
+        with self._lock:
+            self._discard(user_id)
+            self._keys[user_id] = bytearray(key)
+            unpinned = [uid for uid in self._keys if uid not in self._pins]
+            for uid in unpinned[:max(0, len(unpinned) - self.max_entries)]:
+                self._discard(uid)
+
+    def pin(self, user_id: int) -> bool:
+        """Keeps a user's key from being evicted; returns False if it is not cached (already evicted)."""
+        with self._lock:
+            if user_id not in self._keys:
+                return False
+            self._pins[user_id] = self._pins.get(user_id, 0) + 1
+            return True
+
+    def unpin(self, user_id: int):
+        with self._lock:
+            count = self._pins.pop(user_id, 0) - 1
+            if count > 0:
+                self._pins[user_id] = count
+
+    def __contains__(self, user_id: int) -> bool:
+        with self._lock:
+            return user_id in self._keys
+
+    def get(self, user_id: int):
+        with self._lock:
+            key = self._keys.get(user_id)
+            if key is None:
+                return None
+            self._keys.move_to_end(user_id)
+            return bytes(key)
+
+    def discard(self, user_id: int):
+        with self._lock:
+            self._discard(user_id)
+
+    def _discard(self, user_id: int):
+        key = self._keys.pop(user_id, None)
+        if key is not None:
+            key[:] = bytes(len(key))
+
+    def clear(self):
+        with self._lock:
+            self._pins.clear()
+            for user_id in list(self._keys):
+                self._discard(user_id)
+
+# Keys of users that are logged in to this process
+key_cache = KeyCache()
+
+@timed("keys.derive_key")
+def derive_key(master_password: str, salt: bytes, iterations: int) -> bytes:
+    """Derives a key-encryption key from the master password with PBKDF2-HMAC-SHA256."""
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+    kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=KEY_SIZE, salt=salt, iterations=iterations)
+    return kdf.derive(master_password.encode())
+
+def wrap_vault_key(vault_key: bytes, master_password: str, iterations: int = None) -> tuple:
+    """Wraps a vault key under the master password; returns (kdf_salt, kdf_iterations, wrapped_key)."""
+    from cryptography.hazmat.primitives.keywrap import aes_key_wrap
+    iterations = iterations or config.KDF_ITERATIONS
+    salt = os.urandom(SALT_SIZE)
+    wrapped_key = aes_key_wrap(derive_key(master_password, salt, iterations), vault_key)
+    return base64.b64encode(salt).decode(), iterations, base64.b64encode(wrapped_key).decode()
+
+def unwrap_vault_key(master_password: str, key_record: tuple) -> bytes:
+    """Recovers a vault key from its (kdf_salt, kdf_iterations, wrapped_key) record."""
+    from cryptography.hazmat.primitives.keywrap import aes_key_unwrap
+    salt, iterations, wrapped_key = key_record
+    kek = derive_key(master_password, base64.b64decode(salt), iterations)
+    return aes_key_unwrap(kek, base64.b64decode(wrapped_key))
+
+def unlock_vault(user_id: int, master_password: str) -> bytes:
+    """Unlocks a user's vault key after login and keeps it in the key cache.
+
+    This is the only place the expensive key derivation runs, once per login. Users
+    created before per-user keys existed get a fresh key on their first login, and their
+    passwords are re-encrypted from the global keyring in the same transaction.
+    Raises VaultLockedError if the key cannot be unwrapped or the migration fails.
+    """
+    from cryptography.hazmat.primitives.keywrap import InvalidUnwrap
+    for _ in range(3):
+        key_record = get_user_key_record(user_id)
+        if key_record is None:
+            raise VaultLockedError("Could not load the vault key.")
+
+        if key_record[2] is not None:
+            try:
+                vault_key = unwrap_vault_key(master_password, key_record)
+            except (InvalidUnwrap, ValueError) as e:
+                raise VaultLockedError(f"Could not unwrap the vault key: {str(e) or 'integrity check failed'}") from e
+            # Re-wrap under the current iteration policy, like bcrypt rehash-on-login
+            if key_record[1] != config.KDF_ITERATIONS:
+                store_user_key_record(user_id, wrap_vault_key(vault_key, master_password),
+                                      previous_wrapped_key=key_record[2])
+            key_cache.put(user_id, vault_key)
+            return vault_key
+
+        vault_key = os.urandom(KEY_SIZE)
+        try:
+            stored = store_user_key_record(user_id, wrap_vault_key(vault_key, master_password),
+                                           reencrypt=lambda rows: _reencrypt_legacy(rows, vault_key))
+        except ValueError as e:
+            # Nothing was stored, so the entries stay readable under the global keyring;
+            # the login fails rather than hand out a shared key as this user's vault key
+            raise VaultLockedError(f"Could not migrate the vault to a per-user key: {e}") from e
+        if stored:
+            key_cache.put(user_id, vault_key)
+            return vault_key
+        # Another login installed a key first; loop round and unwrap that one
+
+    raise VaultLockedError("Could not unlock the vault key.")
+
+def _reencrypt_legacy(rows: list, vault_key: bytes) -> list:
+    """Moves (key_id, ciphertext) rows from global keys to a user's vault key, refusing on any failure.
+
+    Returns (ciphertext, fingerprint) pairs under the vault key.
+    """
+    passwords = [None] * len(rows)
+    positions = {}  # key_id -> indexes of the rows it encrypted
+    for i, (key_id, _) in enumerate(rows):
+        positions.setdefault(key_id, []).append(i)
+
+    for key_id, indexes in positions.items():
+        key = config.AES_KEYRING.get(key_id)
+        if key is None:
+            raise ValueError(f"Some stored passwords use unknown key ID {key_id}.")
+        for i, password in zip(indexes, decrypt_many([rows[i][1] for i in indexes], key=key)):
+            if password.startswith("⚠️ Decryption Error"):
+                raise ValueError(f"Some stored passwords could not be decrypted with key ID {key_id}.")
+            passwords[i] = password
+    return list(zip(encrypt_many(passwords, key=vault_key), fingerprint_many(passwords, vault_key)))
+
+def upgrade_vault_rows(user_id: int, chunk_size: int = VAULT_UPGRADE_CHUNK_SIZE) -> int:
+    """Brings a logged-in user's rows up to date, one chunk per transaction: legacy AES-CBC
+    records are rewritten as AES-GCM ones and missing reuse fingerprints are filled in.
+
+    Stops early if the user logs out. Rows changed meanwhile are left to the newer write,
+    and unreadable rows are skipped. Returns the number of rows updated.
+    """
+    upgraded, after_id = 0, 0
+    while True:
+        vault_key = key_cache.get(user_id)
+        rows = get_rows_to_upgrade(user_id, after_id, chunk_size) if vault_key else None
+        if not rows:
+            return upgraded
+        after_id = rows[-1][0]
+
+        passwords = decrypt_many((row[1] for row in rows), key=vault_key)
+        readable = [(row, password) for row, password in zip(rows, passwords) if not password.startswith("⚠️")]
+        legacy = [password for row, password in readable if is_legacy_format(row[1])]
+        ciphertexts = iter(encrypt_many(legacy, key=vault_key))
+        fingerprints = fingerprint_many((password for _, password in readable), vault_key)
+        upgraded += store_upgraded_rows([
+            (row[0], row[1], next(ciphertexts) if is_legacy_format(row[1]) else row[1], fingerprint)
+            for (row, _), fingerprint in zip(readable, fingerprints)
+        ])
+
+def upgrade_in_background(user_id: int):
+    """Starts upgrade_vault_rows for a user on a daemon thread (after login)."""
+    def run():
+        try:
+            upgrade_vault_rows(user_id)
+        except database.DB_ERRORS as err:
+            print(f"⚠️ Stopped upgrading stored passwords: {err}")
+    threading.Thread(target=run, daemon=True).start()
+
+def rewrap_vault_key(user_id: int, old_password: str, new_password: str) -> tuple:
+    """Returns a new key record that wraps the user's vault key under a new master password."""
+    key_record = get_user_key_record(user_id)
+    if key_record is None or key_record[2] is None:
+        return None
+    vault_key = unwrap_vault_key(old_password, key_record)
+    return wrap_vault_key(vault_key, new_password)
+
+def get_user_key(user_id: int) -> bytes:
+    """Returns the unlocked vault key of a logged-in user."""
+    key = key_cache.get(user_id)
+    if key is None:
+        raise VaultLockedError("Vault is locked. Please log in again.")
+    return key
+
+def lock_vault(user_id: int):
+    """Wipes a user's vault key from memory (on logout or account deletion)."""
+    key_cache.discard(user_id)
+
+def measure_derivation_time(iterations: int, samples: int = 3) -> float:
+    """Returns the best-of-n time in milliseconds for one key derivation."""
+    salt = os.urandom(SALT_SIZE)
+    best = float("inf")
+    for _ in range(samples):
+        start = time.perf_counter()
+        derive_key("benchmark", salt, iterations)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+def calibrate_kdf_iterations(target_ms: float = None, step: int = 50000) -> int:
+    """Picks the iteration count (a multiple of step) whose derivation takes about target_ms."""
+    target_ms = target_ms or config.KDF_TARGET_MS
+    per_iteration_ms = measure_derivation_time(step) / step
+    return max(step, int(target_ms / per_iteration_ms) // step * step)
+
+# Benchmark the KDF: python keys.py benchmark | python keys.py calibrate [target_ms]
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "benchmark":
+        for iterations in (100000, 300000, 600000, 1000000, config.KDF_ITERATIONS):
+            print(f"{iterations:>9} iterations: {measure_derivation_time(iterations):8.1f} ms")
+    elif command == "calibrate":
+        target_ms = float(sys.argv[2]) if len(sys.argv) > 2 else config.KDF_TARGET_MS
+        iterations = calibrate_kdf_iterations(target_ms)
+        path = config.save_setting("KDF_ITERATIONS", iterations)
+        print(f"✅ {iterations} PBKDF2 iterations take ~{measure_derivation_time(iterations):.0f} ms "
+              f"(target {target_ms:.0f} ms). Saved to {path}.")
+    else:
+        print("Usage: python keys.py benchmark | python keys.py calibrate [target_ms]")
@@ -0,0 +1,336 @@
+"""Load test of the register/login/store/retrieve paths with many simultaneous users.
+
+Seeds a population of accounts in a throwaway SQLite vault (like benchmark.py, so no
+database server is needed), then runs one virtual user per worker at each concurrency
+level for a fixed time. Each virtual user logs in to one account and repeats operations
+drawn from the mix. Workers are threads sharing one process and connection pool, or
+separate processes:
+
+    python loadtest.py --users 200 --concurrency 1,2,4,8,16,32,64 --duration 10
+    python loadtest.py --mode process --mix login=1,retrieve=9 --out load.json
+
+Throughput and p50/p95/p99 latency are reported per operation and level, counting only
+operations that succeeded; failures are reported separately, by cause. The saturation
+curve at the end shows where throughput stops rising while latency keeps growing.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from benchmark import configure_environment
+
+OPERATIONS = ("register", "login", "store", "retrieve")
+DEFAULT_MIX = "register=2,login=8,store=20,retrieve=70"
+DEFAULT_CONCURRENCY = (1, 2, 4, 8, 16, 32, 64)
+
+MASTER_PASSWORD = "load-test-master-password"
+USERNAME_PREFIX = "load-user-"
+
+# Throughput must grow by this much from one level to the next to count as scaling
+SCALING_GAIN = 0.10
+
+def parse_mix(text: str) -> dict:
+    """Parses "login=1,retrieve=9" into {operation: weight}."""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation {name!r}; choose from {', '.join(OPERATIONS)}.")
+        mix[name] = float(weight or 1)
+    if not any(weight > 0 for weight in mix.values()):
+        raise ValueError("The operation mix needs at least one positive weight.")
+    return mix
+
+def percentile(sorted_samples: list, p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_samples:
+        return 0.0
+    return sorted_samples[max(0, math.ceil(p / 100 * len(sorted_samples)) - 1)]
+
+def seed_population(users: int, vault_size: int) -> list:
+    """Creates the accounts virtual users log in to, each with vault_size stored passwords.
+
+    Every account shares one bcrypt hash and one wrapped vault key, so seeding costs one
+    hash and one key derivation however large the population is. Returns the usernames.
+    """
+    from auth import hash_password
+    from database import UnitOfWork, execute, get_connection
+    from encryption import encrypt_many, fingerprint_many
+    from keys import KEY_SIZE, wrap_vault_key
+
+    usernames = [f"{USERNAME_PREFIX}{i:06d}" for i in range(users)]
+    hashed_password = hash_password(MASTER_PASSWORD)
+    with UnitOfWork() as work:
+        for username in usernames:
+            work.add_user(username, hashed_password)
+
+    vault_key = os.urandom(KEY_SIZE)
+    with get_connection() as conn:
+        execute(conn, "UPDATE users SET kdf_salt = %s, kdf_iterations = %s, wrapped_key = %s WHERE username LIKE %s",
+                (*wrap_vault_key(vault_key, MASTER_PASSWORD), USERNAME_PREFIX + "%")).close()
+        cursor = execute(conn, "SELECT id FROM users WHERE username LIKE %s", (USERNAME_PREFIX + "%",))
+        user_ids = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+        conn.commit()
+
+    passwords = [f"password-{i}" for i in range(vault_size)]
+    fingerprints = fingerprint_many(passwords, vault_key)
+    for user_id in user_ids:
+        with UnitOfWork() as work:
+            for i, (encrypted_password, fingerprint) in enumerate(
+                    zip(encrypt_many(passwords, key=vault_key), fingerprints)):
+                work.add_password(user_id, f"load-site-{i}", encrypted_password, fingerprint)
+    return usernames
+
+def virtual_user(task: tuple) -> dict:
+    """Logs in to one account and runs operations from the mix until the deadline.
+
+    Returns {"samples": {operation: [seconds, ...]}, "errors": {operation: {cause: count}}}.
+    Only successful operations are sampled; a failure is counted under its exception type
+    (or "failed" when the operation reported failure) and does not touch the latencies.
+    """
+    username, mix, vault_size, deadline, seed = task
+    from auth import login_user, register_user
+    from database import add_password, get_password
+    from encryption import decrypt_password, encrypt_password, fingerprint_password
+    from keys import VaultLockedError, get_user_key
+
+    rng = random.Random(seed)
+    operations, weights = list(mix), list(mix.values())
+    samples = {name: [] for name in OPERATIONS}
+    errors = {name: {} for name in OPERATIONS}
+    user_id = None
+
+    def login():
+        nonlocal user_id
+        user_id, _ = login_user(username, MASTER_PASSWORD)
+        return user_id is not None
+
+    def register():
+        return register_user(f"load-new-{uuid.uuid4().hex[:16]}", MASTER_PASSWORD).startswith("✅")
+
+    def store():
+        key = get_user_key(user_id)
+        password = f"password-{rng.randrange(10 ** 9)}"
+        return add_password(user_id, f"load-site-{rng.randrange(2 * vault_size)}",
+                            encrypt_password(password, key), fingerprint_password(password, key))
+
+    def retrieve():
+        encrypted_password = get_password(user_id, f"load-site-{rng.randrange(vault_size)}")
+        return encrypted_password is not None and not decrypt_password(
+            encrypted_password, get_user_key(user_id)).startswith("⚠️")
+
+    actions = {"register": register, "login": login, "store": store, "retrieve": retrieve}
+    name = "login"  # Every virtual user starts by logging in
+    while time.time() < deadline:
+        start = time.perf_counter()
+        try:
+            cause = None if actions[name]() else "failed"
+        except VaultLockedError:
+            # The key was evicted from the cache; log in again as a real client would
+            cause, user_id = "VaultLockedError", None
+        except Exception as e:
+            cause = type(e).__name__
+        if cause is None:
+            samples[name].append(time.perf_counter() - start)
+        else:
+            errors[name][cause] = errors[name].get(cause, 0) + 1
+        name = "login" if user_id is None else rng.choices(operations, weights)[0]
+    return {"samples": samples, "errors": errors}
+
+def _warm_up(barrier=None):
+    # Pays for the app's imports and first connection before the clock starts
+    from database import count_passwords
+    count_passwords(0)
+    if barrier is not None:
+        barrier.wait()
+
+def run_level(mode: str, concurrency: int, usernames: list, mix: dict, vault_size: int,
+              duration: float, seed: int) -> dict:
+    """Runs `concurrency` virtual users for `duration` seconds; returns the level's report."""
+    if mode == "process":
+        import multiprocessing
+        # Spawned children open their own connections rather than sharing the parent's
+        context = multiprocessing.get_context("spawn")
+        ready = context.Barrier(concurrency + 1)
+        executor = context.Pool(concurrency, initializer=_warm_up, initargs=(ready,))
+        ready.wait()
+    else:
+        from multiprocessing.pool import ThreadPool
+        executor = ThreadPool(concurrency)
+        _warm_up()
+
+    with executor:
+        deadline = time.time() + duration
+        tasks = [(usernames[i % len(usernames)], mix, vault_size, deadline, seed * 100003 + i)
+                 for i in range(concurrency)]
+        started = time.perf_counter()
+        results = executor.map(virtual_user, tasks, chunksize=1)
+        elapsed = time.perf_counter() - started
+
+    operations = {}
+    causes = {}
+    for name in OPERATIONS:
+        samples = sorted(s for result in results for s in result["samples"][name])
+        failed = {}
+        for result in results:
+            for cause, count in result["errors"][name].items():
+                failed[cause] = failed.get(cause, 0) + count
+                causes[cause] = causes.get(cause, 0) + count
+        if not samples and not failed:
+            continue
+        operations[name] = {
+            "count": len(samples),
+            "errors": sum(failed.values()),
+            "error_causes": failed,
+            "ops_per_s": len(samples) / elapsed,
+            "p50_ms": percentile(samples, 50) * 1000,
+            "p95_ms": percentile(samples, 95) * 1000,
+            "p99_ms": percentile(samples, 99) * 1000,
+            "max_ms": samples[-1] * 1000 if samples else 0.0,
+        }
+    everything = sorted(s for result in results for samples in result["samples"].values() for s in samples)
+    return {
+        "concurrency": concurrency,
+        "elapsed_s": elapsed,
+        "ops": len(everything),
+        "errors": sum(causes.values()),
+        "error_causes": causes,
+        "ops_per_s": len(everything) / elapsed,
+        "p50_ms": percentile(everything, 50) * 1000,
+        "p95_ms": percentile(everything, 95) * 1000,
+        "p99_ms": percentile(everything, 99) * 1000,
+        "operations": operations,
+    }
+
+def _format_causes(causes: dict) -> str:
+    return ", ".join(f"{cause} {count}" for cause, count in sorted(causes.items(), key=lambda item: -item[1]))
+
+def print_level(mode: str, level: dict):
+    print(f"\n[{mode} x{level['concurrency']}] {level['ops']} ops in {level['elapsed_s']:.1f} s, "
+          f"{level['ops_per_s']:.1f} ops/s, {level['errors']} errors")
+    for name, stats in level["operations"].items():
+        print(f"  {name:<9} {stats['count']:>8} {stats['ops_per_s']:>9.1f}/s  p50 {stats['p50_ms']:>8.1f} ms"
+              f"  p95 {stats['p95_ms']:>8.1f} ms  p99 {stats['p99_ms']:>8.1f} ms  errors {stats['errors']}")
+        if stats["errors"]:
+            print(f"  {'':<9} failed: {_format_causes(stats['error_causes'])}")
+    if "pool" in level:
+        pool = level["pool"]
+        print(f"  pool of {pool['size']}: {pool['checkouts']} checkouts, "
+              f"avg wait {pool['wait_avg_s'] * 1000:.2f} ms, {pool['timeouts']} timeouts")
+
+def saturation_point(levels: list):
+    """Returns the first concurrency whose throughput gained less than SCALING_GAIN over the previous level."""
+    for previous, level in zip(levels, levels[1:]):
+        if level["ops_per_s"] < previous["ops_per_s"] * (1 + SCALING_GAIN):
+            return level["concurrency"]
+    return None
+
+def print_curve(levels: list):
+    """Prints throughput and overall latency against concurrency."""
+    peak = max(level["ops_per_s"] for level in levels) or 1
+    print(f"\n{'users':>6} {'ops/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}  throughput")
+    for level in levels:
+        bar = "#" * round(40 * level["ops_per_s"] / peak)
+        print(f"{level['concurrency']:>6} {level['ops_per_s']:>10.1f} {level['p50_ms']:>9.1f} "
+              f"{level['p95_ms']:>9.1f} {level['p99_ms']:>9.1f}  {bar}")
+
+    knee = saturation_point(levels)
+    if knee:
+        print(f"⚠️ Throughput stops scaling at {knee} concurrent users "
+              f"(less than {SCALING_GAIN:.0%} more than the level before).")
+    else:
+        print("✅ Throughput kept scaling up to the highest level tested.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the password manager with many simultaneous users.")
+    parser.add_argument("--users", type=int, default=100, help="Accounts in the seeded population")
+    parser.add_argument("--vault-size", type=int, default=20, help="Passwords stored per seeded account")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Operation weights (default {DEFAULT_MIX})")
+    parser.add_argument("--concurrency", help="Comma-separated virtual user counts (default 1..64)")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to run each concurrency level")
+    parser.add_argument("--mode", choices=("thread", "process"), default="thread",
+                        help="Run virtual users as threads in one process or as separate processes")
+    parser.add_argument("--pool-size", type=int, help="Override DB_POOL_SIZE")
+    parser.add_argument("--bcrypt-rounds", type=int, help="Override BCRYPT_ROUNDS")
+    parser.add_argument("--kdf-iterations", type=int, help="Override KDF_ITERATIONS")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for the operation sequence")
+    parser.add_argument("--out", help="Write JSON results to this file")
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(2)
+    levels_to_run = [int(c) for c in args.concurrency.split(",")] if args.concurrency else list(DEFAULT_CONCURRENCY)
+
+    configure_environment(args)
+    if args.pool_size:
+        os.environ["DB_POOL_SIZE"] = str(args.pool_size)
+    # Every virtual user holds one unlocked key; a smaller cache would evict live users' keys
+    # and fill the report with VaultLockedError failures instead of load
+    needed = min(max(levels_to_run), args.users)
+    os.environ["KEY_CACHE_SIZE"] = str(max(needed, int(os.getenv("KEY_CACHE_SIZE", "32"))))
+    import config
+    from database import create_tables, pool_stats
+
+    create_tables()
+    start = time.perf_counter()
+    usernames = seed_population(args.users, args.vault_size)
+    print(f"✅ Seeded {len(usernames)} users with {args.vault_size} passwords each "
+          f"in {time.perf_counter() - start:.1f} s")
+
+    levels = []
+    for concurrency in levels_to_run:
+        before = pool_stats()
+        level = run_level(args.mode, concurrency, usernames, mix, args.vault_size, args.duration, args.seed)
+        if args.mode == "thread":
+            # The shared pool is only meaningful when every virtual user goes through it
+            after = pool_stats()
+            checkouts = after["checkouts"] - before["checkouts"]
+            level["pool"] = {
+                "size": after["size"],
+                "checkouts": checkouts,
+                "timeouts": after["timeouts"] - before["timeouts"],
+                "wait_avg_s": (after["wait_total_s"] - before["wait_total_s"]) / checkouts if checkouts else 0.0,
+            }
+        print_level(args.mode, level)
+        levels.append(level)
+
+    print_curve(levels)
+
+    if args.out:
+        report = {
+            "meta": {
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "backend": config.DB_BACKEND,
+                "mode": args.mode,
+                "mix": mix,
+                "users": args.users,
+                "vault_size": args.vault_size,
+                "duration_s": args.duration,
+                "pool_size": config.DB_POOL_SIZE,
+                "key_cache_size": config.KEY_CACHE_SIZE,
+                "bcrypt_rounds": config.BCRYPT_ROUNDS,
+                "kdf_iterations": config.KDF_ITERATIONS,
+            },
+            "levels": levels,
+            "saturation_concurrency": saturation_point(levels),
+        }
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Results written to {args.out}")
+
+if __name__ == "__main__":
+    main()
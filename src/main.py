@@ -1,124 +1,377 @@
-import sys
-from getpass import getpass  
-from auth import register_user, login_user, delete_user_account
-from database import connect_db
-from encryption import encrypt_password, decrypt_password
-from gui import launch_gui  # Import GUI function
-
-def main():
-    print("\n🔐 Secure Password Manager 🔐")
-    print("1. Use Command Line Interface (CLI)")
-    print("2. Use Graphical User Interface (GUI)")
-    
-    mode = input("Choose (1/2): ")
-    
-    if mode == "2":
-        launch_gui()
-        return  # Exit CLI flow if GUI is chosen
-    
-    while True:
-        print("\n🔐 Secure Password Manager 🔐")
-        print("1. Register")
-        print("2. Login")
-        print("3. Exit")
-
-        choice = input("Choose (1/2/3): ")
-
-        if choice == "1":
-            username = input("Enter a new username: ")
-            master_password = getpass("Set a master password: ")  # Hidden input
-            register_user(username, master_password)
-
-        elif choice == "2":
-            username = input("Enter your username: ")
-            master_password = getpass("Enter your master password: ")  # Hidden input
-            user_id = login_user(username, master_password)
-
-            if user_id:
-                manage_passwords(user_id, username)  # Pass username for account deletion
-
-        elif choice == "3":
-            print("Exiting...")
-            sys.exit()
-
-        else:
-            print("❌ Invalid choice. Try again.")
-
-def manage_passwords(user_id, username):
-    """Function to manage stored passwords after login"""
-    while True:
-        print("\n🔑 Password Manager Menu")
-        print("1. Store a new password")
-        print("2. Retrieve a stored password")
-        print("3. Delete a stored password")
-        print("4. Delete your account")
-        print("5. Logout")
-
-        choice = input("Choose (1/2/3/4/5): ")
-
-        if choice == "1":
-            website = input("Enter the website/app name: ")
-            stored_password = getpass("Enter the password to store: ")  # Hidden input
-
-            encrypted_password = encrypt_password(stored_password)
-            conn = connect_db()
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO passwords (user_id, website, encrypted_password) VALUES (%s, %s, %s)",
-                (user_id, website, encrypted_password),
-            )
-            conn.commit()
-            cursor.close()
-            conn.close()
-            print("✅ Password stored successfully!")
-
-        elif choice == "2":
-            website = input("Enter the website/app name to retrieve password: ")
-
-            conn = connect_db()
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT encrypted_password FROM passwords WHERE user_id = %s AND website = %s",
-                (user_id, website),
-            )
-            result = cursor.fetchone()
-            cursor.close()
-            conn.close()
-
-            if result:
-                decrypted_password = decrypt_password(result[0])
-                print(f"🔓 Password for {website}: {decrypted_password}")  
-            else:
-                print("❌ No password found for this website.")
-
-        elif choice == "3":  
-            website = input("Enter the website/app name to delete password: ")
-
-            conn = connect_db()
-            cursor = conn.cursor()
-            cursor.execute(
-                "DELETE FROM passwords WHERE user_id = %s AND website = %s",
-                (user_id, website),
-            )
-            conn.commit()
-            cursor.close()
-            conn.close()
-
-            print(f"🗑️ Password for {website} deleted successfully!")
-
-        elif choice == "4":
-            confirm = input("⚠️ Are you sure you want to delete your account? (yes/no): ").lower()
-            if confirm == "yes":
-                delete_user_account(username)  
-                print("Your account has been deleted. Logging out...")
-                break
-
-        elif choice == "5":
-            print("Logging out...")
-            break
-
-        else:
-            print("❌ Invalid choice. Try again.")
-
-if __name__ == "__main__":
-    main()
+import argparse
+import os
+import sys
+from contextlib import redirect_stdout
+from getpass import getpass  
+import database
+from database import iter_passwords
+from encryption import encrypt_password, fingerprint_password
+from config import METRICS_FILE, PROFILE_MODE, PROFILE_OUTPUT, REPLICA_CONFLICT_POLICIES
+import metrics
+
+# bcrypt and the crypto backends load with auth, keys and replica, so those (and the
+# modules built on them) are imported by the commands that need them
+
+def main():
+    print("\n🔐 Secure Password Manager 🔐")
+    print("1. Use Command Line Interface (CLI)")
+    print("2. Use Graphical User Interface (GUI)")
+    
+    mode = input("Choose (1/2): ")
+    
+    if mode == "2":
+        from gui import launch_gui  # Qt is only loaded when the GUI is chosen
+        launch_gui()
+        return  # Exit CLI flow if GUI is chosen
+
+    from auth import register_user, login_user
+    from search import warm_index
+
+    while True:
+        print("\n🔐 Secure Password Manager 🔐")
+        print("1. Register")
+        print("2. Login")
+        print("3. Exit")
+
+        choice = input("Choose (1/2/3): ")
+
+        if choice == "1":
+            username = input("Enter a new username: ")
+            master_password = getpass("Set a master password: ")  # Hidden input
+            print(register_user(username, master_password))
+
+        elif choice == "2":
+            username = input("Enter your username: ")
+            master_password = getpass("Enter your master password: ")  # Hidden input
+            user_id, message = login_user(username, master_password)
+            print(message)
+
+            if user_id:
+                warm_index(user_id)  # Build the search index while the menu is shown
+                manage_passwords(user_id, username)  # Pass username for account deletion
+
+        elif choice == "3":
+            print("Exiting...")
+            sys.exit()
+
+        else:
+            print("❌ Invalid choice. Try again.")
+
+def manage_passwords(user_id, username):
+    """Function to manage stored passwords after login"""
+    from auth import delete_user_account
+    from breach import check_password
+    from health import format_health_report, vault_health
+    from keys import get_user_key, lock_vault
+    from replica import remove_password, store_password
+    from search import search, drop_index
+    from session_cache import lookup_password, secret_cache
+
+    while True:
+        print("\n🔑 Password Manager Menu")
+        print("1. Store a new password")
+        print("2. Retrieve a stored password")
+        print("3. Delete a stored password")
+        print("4. Search stored websites")
+        print("5. Vault health report")
+        print("6. Delete your account")
+        print("7. Logout")
+
+        choice = input("Choose (1/2/3/4/5/6/7): ")
+
+        if choice == "1":
+            website = input("Enter the website/app name: ")
+            stored_password = getpass("Enter the password to store: ")  # Hidden input
+
+            breaches = check_password(stored_password)
+            if breaches and input(f"⚠️ This password has appeared {breaches} times in data breaches. "
+                                  "Store it anyway? (y/N): ").lower() != "y":
+                continue
+
+            key = get_user_key(user_id)
+            encrypted_password = encrypt_password(stored_password, key)
+            if store_password(user_id, website, encrypted_password, fingerprint_password(stored_password, key)):
+                print("✅ Password stored successfully!")
+
+        elif choice == "2":
+            website = input("Enter the website/app name to retrieve password: ")
+
+            decrypted_password = lookup_password(user_id, website)
+
+            if decrypted_password is not None:
+                print(f"🔓 Password for {website}: {decrypted_password}")  
+            else:
+                print("❌ No password found for this website.")
+                suggest_websites(user_id, website)
+
+        elif choice == "3":  
+            website = input("Enter the website/app name to delete password: ")
+
+            if remove_password(user_id, website):
+                print(f"🗑️ Password for {website} deleted successfully!")
+            else:
+                print("❌ No password found for this website.")
+                suggest_websites(user_id, website)
+
+        elif choice == "4":
+            query = input("Search for (prefix, part of the name, or a misspelling): ")
+            results = search(user_id, query)
+            if results:
+                print(f"🔎 {len(results)} match(es):")
+                for website in results:
+                    print(f"  - {website}")
+            else:
+                print("❌ No matching websites.")
+
+        elif choice == "5":
+            try:
+                print(format_health_report(vault_health(user_id)))
+            except database.DB_ERRORS as err:
+                print(f"❌ Database error: {err}")
+
+        elif choice == "6":
+            confirm = input("⚠️ Are you sure you want to delete your account? (yes/no): ").lower()
+            if confirm == "yes":
+                delete_user_account(username)  
+                print("Your account has been deleted. Logging out...")
+                secret_cache.invalidate(user_id)
+                lock_vault(user_id)
+                drop_index(user_id)  # Forget the deleted vault's website names
+                break
+
+        elif choice == "7":
+            print("Logging out...")
+            secret_cache.invalidate(user_id)  # Wipe this session's decrypted secrets
+            lock_vault(user_id)
+            drop_index(user_id)
+            break
+
+        else:
+            print("❌ Invalid choice. Try again.")
+
+def suggest_websites(user_id, website):
+    """Prints close matches after an exact website lookup fails"""
+    from search import get_index
+
+    suggestions = get_index(user_id).fuzzy(website, limit=5)
+    if suggestions:
+        print(f"💡 Did you mean: {', '.join(suggestions)}?")
+
+def build_parser() -> argparse.ArgumentParser:
+    """Subcommands for scripting; with no subcommand the interactive menu runs."""
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--user", default=os.getenv("PM_USERNAME"), help="Username (default: $PM_USERNAME)")
+
+    parser = argparse.ArgumentParser(
+        description="Secure Password Manager. Run without a command for the interactive menu.",
+        epilog="Commands log in once; the master password is read from $PM_MASTER_PASSWORD or prompted for. "
+               "Export passphrases come from $PM_EXPORT_PASSPHRASE or a prompt.")
+    commands = parser.add_subparsers(dest="command")
+
+    get = commands.add_parser("get", parents=[common], help="Print the password stored for a website")
+    get.add_argument("website")
+    put = commands.add_parser("put", parents=[common], help="Store a password for a website")
+    put.add_argument("website")
+    put.add_argument("--password-stdin", action="store_true", help="Read the password from stdin instead of a prompt")
+    put.add_argument("--force", action="store_true", help="Store the password even if it appears in known breaches")
+    commands.add_parser("list", parents=[common], help="List stored websites")
+    delete = commands.add_parser("delete", parents=[common], help="Delete the password stored for a website")
+    delete.add_argument("website")
+    search_command = commands.add_parser("search", parents=[common], help="Find websites by prefix, substring or misspelling")
+    search_command.add_argument("query")
+    search_command.add_argument("--limit", type=int, default=50)
+    commands.add_parser("batch", parents=[common], help="Run newline-delimited JSON commands from stdin (see batch.py)")
+    commands.add_parser("health", parents=[common], help="Report passwords reused across websites")
+    commands.add_parser("audit", parents=[common], help="List stored passwords found in the breach corpus (see breach.py)")
+    import_command = commands.add_parser("import", parents=[common],
+                                         help="Import a CSV, JSON or JSON Lines file, or an encrypted export (see transfer.py)")
+    import_command.add_argument("path")
+    import_command.add_argument("--format", choices=("csv", "json", "jsonl"), help="Default: from the file extension")
+    export_command = commands.add_parser("export", parents=[common], help="Write every password to an encrypted file")
+    export_command.add_argument("path")
+    sync_command = commands.add_parser("sync", parents=[common], help="Sync the local replica with the server (see replica.py)")
+    sync_command.add_argument("--policy", choices=REPLICA_CONFLICT_POLICIES,
+                              help="How to resolve offline writes that conflict (default: $REPLICA_CONFLICT_POLICY)")
+    return parser
+
+def run_command(args) -> int:
+    """Runs one subcommand after a single login; returns the process exit code"""
+    from auth import login_user
+    from keys import lock_vault
+    from search import drop_index
+    from session_cache import secret_cache
+
+    if not args.user:
+        print("❌ Pass --user or set PM_USERNAME.", file=sys.stderr)
+        return 2
+    master_password = os.getenv("PM_MASTER_PASSWORD") or getpass("Enter your master password: ")
+
+    # Results go to stdout; status messages from the database layer go to stderr
+    out = sys.stdout
+    with redirect_stdout(sys.stderr):
+        # A one-shot command exits before background upgrade or sync threads could finish
+        user_id, message = login_user(args.user, master_password, background=False)
+        if not user_id:
+            print(message)
+            return 1
+        try:
+            return _run_logged_in(args, user_id, out)
+        finally:
+            secret_cache.invalidate(user_id)
+            lock_vault(user_id)
+            drop_index(user_id)
+
+def _run_logged_in(args, user_id, out) -> int:
+    if args.command == "batch":
+        from batch import BatchRunner
+        return 0 if BatchRunner(user_id, out).run(sys.stdin) else 1
+
+    if args.command in ("import", "export"):
+        return _run_transfer(args, user_id)
+
+    if args.command == "sync":
+        return _run_sync(args, user_id)
+
+    from breach import audit_vault, check_password
+    from health import format_health_report, vault_health
+    from keys import get_user_key
+    from replica import active_replica, remove_password, store_password
+    from search import search
+    from session_cache import lookup_password
+
+    if args.command == "get":
+        password = lookup_password(user_id, args.website)
+        if password is None:
+            print("❌ No password found for this website.")
+            suggest_websites(user_id, args.website)
+            return 1
+        print(password, file=out)
+    elif args.command == "put":
+        password = sys.stdin.readline().rstrip("\n") if args.password_stdin else getpass("Enter the password to store: ")
+        if not password:
+            print("❌ Password was not stored.")
+            return 1
+        breaches = check_password(password)
+        if breaches and not args.force:
+            print(f"❌ This password has appeared {breaches} times in data breaches; not stored. "
+                  "Pass --force to store it anyway.")
+            return 1
+        key = get_user_key(user_id)
+        if not store_password(user_id, args.website, encrypt_password(password, key),
+                              fingerprint_password(password, key)):
+            print("❌ Password was not stored.")
+            return 1
+        if breaches:
+            print(f"⚠️ Stored, but this password has appeared {breaches} times in data breaches.")
+    elif args.command == "delete":
+        if not remove_password(user_id, args.website):
+            print("❌ No password found for this website.")
+            return 1
+    elif args.command == "list":
+        replica = active_replica(user_id)
+        try:
+            websites = (replica.get_websites(user_id) if replica else
+                        (website for _, website, _ in iter_passwords(user_id, order_by="website")))
+            for website in websites:
+                print(website, file=out)
+        except database.DB_ERRORS as err:
+            print(f"❌ Database error: {err}")
+            return 1
+    elif args.command == "search":
+        for website in search(user_id, args.query, args.limit):
+            print(website, file=out)
+    elif args.command == "health":
+        try:
+            report = vault_health(user_id)
+        except database.DB_ERRORS as err:
+            print(f"❌ Database error: {err}")
+            return 1
+        print(format_health_report(report), file=out)
+        return 1 if report["reused"] else 0
+    elif args.command == "audit":
+        try:
+            breached = audit_vault(user_id)
+        except (OSError, ValueError) as e:
+            print(f"❌ Breach corpus unavailable: {e}")
+            return 2
+        if breached is None:
+            print("❌ No breach corpus configured; set BREACH_CORPUS_PATH.")
+            return 2
+        for website, breaches in breached:
+            print(f"{website}\t{breaches}", file=out)
+        print(f"{'⚠️' if breached else '✅'} {len(breached)} stored passwords appear in known breaches.")
+        return 1 if breached else 0
+    return 0
+
+def _run_sync(args, user_id) -> int:
+    """Runs the sync subcommand and reports what moved in each direction"""
+    from replica import get_replica
+
+    replica = get_replica()
+    if replica is None:
+        print("❌ No local replica configured; set REPLICA_PATH.")
+        return 2
+    try:
+        result = replica.sync(user_id, args.policy)
+    except database.DB_ERRORS as err:
+        print(f"📴 Could not reach the server: {err}. {replica.pending(user_id)} offline change(s) still queued.")
+        return 1
+    print(f"🔄 Pushed {result['pushed']} offline change(s) ({result['conflicts']} conflicting), "
+          f"pulled {result['pulled']} and removed {result['removed']} password(s).")
+    return 0
+
+def _run_transfer(args, user_id) -> int:
+    """Runs the import and export subcommands with a running count on the terminal"""
+    import transfer
+
+    def progress(count):
+        if sys.stderr.isatty():
+            print(f"  ... {count} entries", end="\r", flush=True)
+
+    try:
+        if args.command == "export":
+            passphrase = _export_passphrase(confirm=True)
+            if not passphrase:
+                return 1
+            exported, unreadable = transfer.export_vault(user_id, args.path, passphrase, progress=progress)
+            print(f"✅ Exported {exported} passwords to {args.path}.")
+            if unreadable:
+                print(f"⚠️ {unreadable} passwords could not be decrypted and were left out.")
+                return 1
+            return 0
+
+        passphrase = _export_passphrase() if transfer.is_export_file(args.path) else None
+        entries = transfer.open_entries(args.path, args.format, passphrase)
+        imported, skipped = transfer.import_entries(user_id, entries, progress=progress)
+        print(f"✅ Imported {imported} passwords from {args.path}.")
+        if skipped:
+            print(f"⚠️ {skipped} entries had no website or password and were skipped.")
+        return 0
+    except (OSError, transfer.TransferError) as e:
+        print(f"❌ {e}")
+    except database.DB_ERRORS as err:
+        kept = " Entries written before the error were kept." if args.command == "import" else ""
+        print(f"❌ Database error: {err}.{kept}")
+    return 1
+
+def _export_passphrase(confirm: bool = False) -> str:
+    passphrase = os.getenv("PM_EXPORT_PASSPHRASE")
+    if passphrase:
+        return passphrase
+    passphrase = getpass("Export passphrase: ")
+    if confirm and getpass("Repeat the export passphrase: ") != passphrase:
+        print("❌ Passphrases do not match.")
+        return None
+    return passphrase
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    status = 0
+    try:
+        with metrics.profiled(PROFILE_MODE, PROFILE_OUTPUT):
+            status = run_command(args) if args.command else main()
+    finally:
+        # Export the latency histograms collected during this session
+        if metrics.is_enabled() and METRICS_FILE:
+            metrics.dump(METRICS_FILE)
+    sys.exit(status)
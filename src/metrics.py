@@ -0,0 +1,221 @@
+import functools
+import io
+import json
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from config import METRICS_ENABLED
+
+# Latency histogram bucket upper bounds, in seconds
+BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_enabled = METRICS_ENABLED
+_lock = threading.Lock()
+_counters = {}     # name -> int
+_histograms = {}   # operation -> Histogram
+_collectors = []   # callables returning {gauge name: value}, sampled at export time
+
+class Histogram:
+    """Cumulative latency histogram for one operation."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)  # The last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+
+    def observe(self, seconds: float, error: bool = False):
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if error:
+            self.errors += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "sum_s": self.sum,
+            "avg_s": self.sum / self.count if self.count else 0.0,
+            "buckets": {str(bound): n for bound, n in zip(BUCKETS + ("+Inf",), self.buckets)},
+        }
+
+def enable(enabled: bool = True):
+    """Turns metric collection on or off at runtime."""
+    global _enabled
+    _enabled = enabled
+
+def is_enabled() -> bool:
+    return _enabled
+
+def observe(operation: str, seconds: float, error: bool = False):
+    """Records one timing sample for an operation."""
+    with _lock:
+        histogram = _histograms.get(operation)
+        if histogram is None:
+            histogram = _histograms[operation] = Histogram()
+        histogram.observe(seconds, error)
+
+def increment(name: str, amount: int = 1):
+    """Adds to a named counter."""
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+def timed(operation: str):
+    """Decorator that records the latency of every call; costs one flag check when disabled."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            error = True
+            try:
+                result = fn(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                observe(operation, time.perf_counter() - start, error)
+        return wrapper
+    return decorator
+
+class timer:
+    """Context manager version of @timed for timing a block of code."""
+
+    __slots__ = ("operation", "start")
+
+    def __init__(self, operation: str):
+        self.operation = operation
+        self.start = None
+
+    def __enter__(self):
+        if _enabled:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.start is not None:
+            observe(self.operation, time.perf_counter() - self.start, exc_type is not None)
+        return False
+
+def register_collector(collector):
+    """Registers a callable returning {gauge name: value}, sampled when metrics are exported."""
+    _collectors.append(collector)
+
+def snapshot() -> dict:
+    """Returns all counters, histograms and gauges as plain data."""
+    gauges = {}
+    for collector in _collectors:
+        try:
+            gauges.update(collector())
+        except Exception:
+            pass
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "operations": {name: h.to_dict() for name, h in sorted(_histograms.items())},
+            "gauges": gauges,
+        }
+
+def export_json(data: dict = None) -> str:
+    """Returns the metrics as a JSON document."""
+    return json.dumps(data or snapshot(), indent=2)
+
+def _metric_name(name: str) -> str:
+    return "".join(c if c.isalnum() else "_" for c in name)
+
+def export_prometheus(data: dict = None) -> str:
+    """Returns the metrics in the Prometheus text exposition format."""
+    data = data or snapshot()
+    lines = []
+
+    if data["operations"]:
+        lines.append("# HELP pm_operation_duration_seconds Latency of instrumented operations.")
+        lines.append("# TYPE pm_operation_duration_seconds histogram")
+        for operation, h in data["operations"].items():
+            cumulative = 0
+            for bound, n in h["buckets"].items():
+                cumulative += n
+                lines.append(f'pm_operation_duration_seconds_bucket{{op="{operation}",le="{bound}"}} {cumulative}')
+            lines.append(f'pm_operation_duration_seconds_sum{{op="{operation}"}} {h["sum_s"]}')
+            lines.append(f'pm_operation_duration_seconds_count{{op="{operation}"}} {h["count"]}')
+        lines.append("# HELP pm_operation_errors_total Instrumented operations that raised.")
+        lines.append("# TYPE pm_operation_errors_total counter")
+        for operation, h in data["operations"].items():
+            lines.append(f'pm_operation_errors_total{{op="{operation}"}} {h["errors"]}')
+
+    for name, value in sorted(data["counters"].items()):
+        lines.append(f"# TYPE pm_{_metric_name(name)}_total counter")
+        lines.append(f"pm_{_metric_name(name)}_total {value}")
+    for name, value in sorted(data["gauges"].items()):
+        lines.append(f"# TYPE pm_{_metric_name(name)} gauge")
+        lines.append(f"pm_{_metric_name(name)} {value}")
+
+    return "\n".join(lines) + "\n"
+
+def dump(path: str):
+    """Writes the metrics to a file, as Prometheus text for *.prom and JSON otherwise."""
+    with open(path, "w") as f:
+        f.write(export_prometheus() if path.endswith(".prom") else export_json())
+
+def reset():
+    """Clears all recorded metrics."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+@contextmanager
+def profiled(mode: str = None, output: str = None, limit: int = 25):
+    """Profiles the enclosed block with cProfile ("cprofile") or tracemalloc ("tracemalloc").
+
+    The report goes to `output` (a .pstats file for cProfile, text otherwise) or stderr.
+    With no mode the block runs unprofiled.
+    """
+    if mode == "cprofile":
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            if output and output.endswith(".pstats"):
+                profiler.dump_stats(output)
+            else:
+                stream = io.StringIO()
+                pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(limit)
+                _write_report(stream.getvalue(), output)
+    elif mode == "tracemalloc":
+        import tracemalloc
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics("lineno")[:limit]
+            tracemalloc.stop()
+            report = [f"current={current / 1024:.1f} KiB peak={peak / 1024:.1f} KiB"]
+            report += [str(stat) for stat in top]
+            _write_report("\n".join(report) + "\n", output)
+    else:
+        yield
+
+def _write_report(text: str, output: str = None):
+    if output:
+        with open(output, "w") as f:
+            f.write(text)
+    else:
+        sys.stderr.write(text)
+
+# Convert a JSON dump to Prometheus text: python metrics.py metrics.json
+if __name__ == "__main__":
+    if len(sys.argv) == 2:
+        with open(sys.argv[1]) as f:
+            print(export_prometheus(json.load(f)), end="")
+    else:
+        print("Usage: python metrics.py <metrics.json>")
@@ -0,0 +1,138 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes available in time."""
+
+class ConnectionPool:
+    """A thread-safe, bounded pool of reusable database connections."""
+
+    def __init__(self, connect, size=5, timeout=10.0, ping=None, ping_interval=30.0):
+        self._connect = connect
+        self._ping = ping
+        self.size = size
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+
+        # Bounds the number of connections that can be checked out at once
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+
+        self._created = 0
+        self._discarded = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._in_use = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def acquire(self):
+        """Checks a connection out of the pool, opening one if none are idle."""
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeoutError(f"No database connection available after {self.timeout}s")
+
+        try:
+            conn = self._take_idle()
+            if conn is None:
+                conn = self._connect()
+                with self._lock:
+                    self._created += 1
+        except BaseException:
+            self._slots.release()
+            raise
+
+        waited = time.perf_counter() - start
+        with self._lock:
+            self._checkouts += 1
+            self._in_use += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return conn
+
+    def _take_idle(self):
+        """Returns a healthy idle connection, or None if there is none."""
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+
+            # Only ping connections that have been sitting idle for a while
+            stale = time.monotonic() - last_used >= self.ping_interval
+            if not stale or self._ping is None or self._ping(conn):
+                return conn
+            self._close(conn)
+
+    def release(self, conn, discard=False):
+        """Returns a connection to the pool, or closes it if it is broken."""
+        try:
+            if not discard:
+                try:
+                    # End any open transaction so the next user sees fresh data
+                    conn.rollback()
+                except Exception:
+                    discard = True
+
+            if discard:
+                self._close(conn)
+            else:
+                self._idle.put((conn, time.monotonic()))
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Context manager that checks a connection out and always returns it."""
+        conn = self.acquire()
+        discard = False
+        try:
+            yield conn
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def _close(self, conn):
+        with self._lock:
+            self._discarded += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        """Closes every idle connection held by the pool."""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._close(conn)
+
+    def stats(self) -> dict:
+        """Returns checkout counts and wait times, useful for sizing the pool."""
+        with self._lock:
+            return {
+                "size": self.size,
+                "created": self._created,
+                "discarded": self._discarded,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "wait_total_s": self._wait_total,
+                "wait_avg_s": self._wait_total / self._checkouts if self._checkouts else 0.0,
+                "wait_max_s": self._wait_max,
+            }
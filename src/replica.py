@@ -0,0 +1,563 @@
+"""Optional local replica of logged-in users' vaults, for fast reads and offline use.
+
+Set REPLICA_PATH to a local file to keep one. After each login the replica syncs with
+the server in the background, and again every REPLICA_SYNC_INTERVAL seconds while the
+user stays logged in. Once this process has synced a user's vault, the replica serves
+their lookups, listings and the GUI table with no network round trips. Before that, a
+copy left by an earlier session is only read while the server is unreachable, and
+Replica.is_current() tells such possibly stale reads apart. Writes still go to the
+server, and to the replica too. When the server cannot be reached, they are applied to
+the replica and queued, and the periodic sync pushes them once it is back. Login then
+falls back to the replica's copy of the account.
+
+The replica is a single SQLite file, and nothing in it is readable without the user's
+vault key:
+- Passwords are kept as the server's AES-GCM records.
+- Websites are stored as a keyed lookup token plus an AES-GCM sealed name.
+- The account is stored as the bcrypt hash and wrapped vault key it already has on
+  the server.
+
+Syncing first pushes the queued writes, then pulls changes. Pulls are driven by the
+server's password change log, which triggers fill in (see migration 9). Only websites
+changed since the last sync are fetched, and a fresh replica pulls the whole vault.
+
+A queued write conflicts when the server's password for that website changed after the
+replica last saw it. REPLICA_CONFLICT_POLICY decides what happens:
+- "copy" (the default) keeps the server's password and stores the offline one beside
+  it as "<website> (offline copy <date>)". A queued delete of a password edited
+  elsewhere is dropped.
+- "server" drops the offline write.
+- "client" applies it anyway.
+
+Both ends can be local files, which is how sync is tested (see tests/test_replica.py):
+
+    DB_BACKEND=sqlite SQLITE_PATH=server.db REPLICA_PATH=laptop.db python main.py sync --user alice
+"""
+import hashlib
+import hmac
+import os
+import sqlite3
+import threading
+import time
+import bcrypt
+import config
+import database
+from database import (UnitOfWork, add_change_listener, count_passwords, get_changed_websites, get_current_passwords,
+                      get_password, get_user_auth_record, get_websites, iter_passwords, latest_change_seq,
+                      notify_change)
+from encryption import NONCE_SIZE, decrypt_password
+from keys import VaultLockedError, get_user_key, key_cache, unwrap_vault_key
+
+CONFLICT_POLICIES = config.REPLICA_CONFLICT_POLICIES
+
+# Transactions can commit out of sequence order, so each pull re-reads this many log
+# entries before the last one it saw; re-applying a change is harmless
+SYNC_OVERLAP = 100
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS accounts (
+        user_id INTEGER PRIMARY KEY,
+        username_digest BLOB UNIQUE NOT NULL,
+        master_password_hash TEXT NOT NULL,
+        kdf_salt TEXT,
+        kdf_iterations INTEGER,
+        wrapped_key TEXT,
+        change_cursor INTEGER NOT NULL DEFAULT 0,  -- last server change log entry applied
+        synced_at REAL
+    );
+    CREATE TABLE IF NOT EXISTS entries (
+        user_id INTEGER NOT NULL,
+        token BLOB NOT NULL,
+        sealed_website BLOB NOT NULL,
+        encrypted_password BLOB NOT NULL,
+        PRIMARY KEY (user_id, token)
+    );
+    CREATE TABLE IF NOT EXISTS outbox (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        token BLOB NOT NULL,
+        sealed_website BLOB NOT NULL,
+        action TEXT NOT NULL,
+        encrypted_password BLOB,
+        fingerprint BLOB,
+        base_password BLOB,  -- the server's password the write replaced, NULL if there was none
+        queued_at REAL NOT NULL,
+        UNIQUE (user_id, token)
+    );
+"""
+
+class _VaultKeys:
+    """Keys derived from a vault key for website tokens and sealed website names."""
+
+    def __init__(self, user_id: int, vault_key: bytes):
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        self._token_key = hmac.new(vault_key, b"replica website token v1", hashlib.sha256).digest()
+        self._names = AESGCM(hmac.new(vault_key, b"replica website name v1", hashlib.sha256).digest())
+        self._aad = str(user_id).encode()
+
+    def token(self, website: str) -> bytes:
+        return hmac.new(self._token_key, website.encode(), hashlib.sha256).digest()[:16]
+
+    def seal(self, website: str) -> bytes:
+        nonce = os.urandom(NONCE_SIZE)
+        return nonce + self._names.encrypt(nonce, website.encode(), self._aad)
+
+    def unseal(self, sealed: bytes) -> str:
+        return self._names.decrypt(sealed[:NONCE_SIZE], sealed[NONCE_SIZE:], self._aad).decode()
+
+def _username_digest(username: str) -> bytes:
+    return hashlib.sha256(username.encode()).digest()
+
+class Replica:
+    """A local, encrypted copy of users' vaults with a queue of writes made offline."""
+
+    def __init__(self, path: str):
+        self.path = path
+        created = not os.path.exists(path)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        if created and path != ":memory:":
+            os.chmod(path, 0o600)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()  # one sync at a time, so no queued write is pushed twice
+        self._sorted = {}  # user_id -> [(website, token), ...] sorted by website, built on first use
+        self._current = set()  # users whose vault this process has synced
+        self._syncer = None  # _PeriodicSync, started by the first sync_periodically()
+        self.offline = False  # set when the server could not be reached, until a sync succeeds
+
+    def _keys(self, user_id: int) -> _VaultKeys:
+        return _VaultKeys(user_id, get_user_key(user_id))
+
+    def is_ready(self, user_id: int) -> bool:
+        """True once the replica has synced a user's vault at least once."""
+        with self._lock:
+            row = self._conn.execute("SELECT synced_at FROM accounts WHERE user_id = ?", (user_id,)).fetchone()
+        return row is not None and row[0] is not None
+
+    def is_current(self, user_id: int) -> bool:
+        """True once this process has synced a user's vault; before that it may predate changes made elsewhere."""
+        return user_id in self._current
+
+    def pending(self, user_id: int) -> int:
+        """Returns how many offline writes of a user are waiting to be pushed."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+    # Reads
+
+    def get_password(self, user_id: int, website: str):
+        """Returns the encrypted password stored for one website, or None."""
+        token = self._keys(user_id).token(website)
+        with self._lock:
+            row = self._conn.execute("SELECT encrypted_password FROM entries WHERE user_id = ? AND token = ?",
+                                     (user_id, token)).fetchone()
+        return row[0] if row else None
+
+    def _sorted_entries(self, user_id: int) -> list:
+        with self._lock:
+            entries = self._sorted.get(user_id)
+            if entries is None:
+                keys = self._keys(user_id)
+                rows = self._conn.execute("SELECT sealed_website, token FROM entries WHERE user_id = ?", (user_id,))
+                entries = self._sorted[user_id] = sorted((keys.unseal(sealed), token) for sealed, token in rows)
+            return entries
+
+    def get_websites(self, user_id: int) -> list:
+        return [website for website, _ in self._sorted_entries(user_id)]
+
+    def count(self, user_id: int) -> int:
+        return len(self._sorted_entries(user_id))
+
+    def get_page(self, user_id: int, offset: int, limit: int) -> list:
+        """Returns (website, encrypted_password) rows ordered by website, like database.get_passwords_page."""
+        page = self._sorted_entries(user_id)[offset:offset + limit]
+        found = self._find(user_id, [token for _, token in page])
+        return [(website, found[token]) for website, token in page if token in found]
+
+    def get_passwords(self, user_id: int, websites: list) -> dict:
+        """Returns {website: encrypted_password} for those of the websites that are stored."""
+        keys = self._keys(user_id)
+        tokens = {keys.token(website): website for website in websites}
+        found = self._find(user_id, list(tokens))
+        return {tokens[token]: encrypted_password for token, encrypted_password in found.items()}
+
+    def _find(self, user_id: int, tokens: list) -> dict:
+        found = {}
+        with self._lock:
+            for start in range(0, len(tokens), 500):
+                chunk = tokens[start:start + 500]
+                found.update(self._conn.execute(
+                    f"SELECT token, encrypted_password FROM entries WHERE user_id = ? AND token IN "
+                    f"({', '.join('?' * len(chunk))})", (user_id, *chunk)).fetchall())
+        return found
+
+    # Writes
+
+    def put(self, user_id: int, website: str, encrypted_password: bytes, fingerprint: bytes = None) -> bool:
+        """Stores a password on the server and in the replica, or queues it if the server is unreachable."""
+        try:
+            with UnitOfWork() as work:
+                work.add_password(user_id, website, encrypted_password, fingerprint)
+        except database.DB_ERRORS as err:
+            self.offline = True
+            self._queue(user_id, website, "put", encrypted_password, fingerprint)
+            print(f"📴 Server unreachable ({err}). Saved locally; it will sync on reconnect.")
+            return True
+        self._store_entries(user_id, {website: encrypted_password})
+        self._push_if_pending(user_id)
+        return True
+
+    def delete(self, user_id: int, website: str) -> bool:
+        """Deletes a password on the server and in the replica, or queues the delete if the server is unreachable."""
+        try:
+            with UnitOfWork() as work:
+                work.delete_password(user_id, website)
+        except database.DB_ERRORS as err:
+            self.offline = True
+            if self.get_password(user_id, website) is None:
+                return False
+            self._queue(user_id, website, "delete")
+            print(f"📴 Server unreachable ({err}). Deleted locally; it will sync on reconnect.")
+            return True
+        self._remove_entries(user_id, [website])
+        self._push_if_pending(user_id)
+        return work.results[0]
+
+    def _queue(self, user_id: int, website: str, action: str, encrypted_password: bytes = None,
+               fingerprint: bytes = None):
+        keys = self._keys(user_id)
+        token = keys.token(website)
+        with self._lock, self._conn:
+            base = self._conn.execute("SELECT encrypted_password FROM entries WHERE user_id = ? AND token = ?",
+                                      (user_id, token)).fetchone()
+            # A website written twice offline keeps the base of its first write
+            self._conn.execute("""
+                INSERT INTO outbox (user_id, token, sealed_website, action, encrypted_password, fingerprint,
+                                    base_password, queued_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, token) DO UPDATE SET action = excluded.action,
+                    encrypted_password = excluded.encrypted_password, fingerprint = excluded.fingerprint,
+                    queued_at = excluded.queued_at
+            """, (user_id, token, keys.seal(website), action, encrypted_password, fingerprint,
+                  base[0] if base else None, time.time()))
+            if action == "put":
+                self._conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                                   (user_id, token, keys.seal(website), encrypted_password))
+            else:
+                self._conn.execute("DELETE FROM entries WHERE user_id = ? AND token = ?", (user_id, token))
+            self._sorted.pop(user_id, None)
+        notify_change(user_id, website, action)
+
+    def _store_entries(self, user_id: int, passwords: dict, skip: set = frozenset()):
+        keys = self._keys(user_id)
+        rows = [(user_id, token, keys.seal(website), encrypted_password)
+                for website, encrypted_password in passwords.items()
+                for token in [keys.token(website)] if token not in skip]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", rows)
+            self._sorted.pop(user_id, None)
+
+    def _remove_entries(self, user_id: int, websites: list, skip: set = frozenset()):
+        keys = self._keys(user_id)
+        tokens = [(user_id, token) for token in map(keys.token, websites) if token not in skip]
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM entries WHERE user_id = ? AND token = ?", tokens)
+            self._sorted.pop(user_id, None)
+
+    # Sync
+
+    def sync(self, user_id: int, policy: str = None) -> dict:
+        """Pushes a logged-in user's queued writes, then pulls the server's changes.
+
+        Returns {"pushed", "conflicts", "pulled", "removed"}. Database errors are raised and
+        leave the queue as it was.
+        """
+        with self._sync_lock:
+            try:
+                pushed, conflicts = self.push(user_id, policy)
+                pulled, removed = self.pull(user_id)
+            except database.DB_ERRORS:
+                self.offline = True
+                raise
+            self.offline = False
+        if pushed or pulled or removed:
+            notify_change(user_id, None)
+        return {"pushed": pushed, "conflicts": conflicts, "pulled": pulled, "removed": removed}
+
+    def push(self, user_id: int, policy: str = None) -> tuple:
+        """Applies queued offline writes to the server; returns (pushed, conflicts)."""
+        policy = policy or config.REPLICA_CONFLICT_POLICY
+        if policy not in CONFLICT_POLICIES:
+            raise ValueError(f"Unknown conflict policy {policy!r}; choose from {', '.join(CONFLICT_POLICIES)}.")
+        with self._lock:
+            queued = self._conn.execute("""
+                SELECT seq, queued_at, sealed_website, action, encrypted_password, fingerprint, base_password
+                FROM outbox WHERE user_id = ? ORDER BY seq
+            """, (user_id,)).fetchall()
+        if not queued:
+            return 0, 0
+
+        keys, key = self._keys(user_id), get_user_key(user_id)
+        websites = [keys.unseal(row[2]) for row in queued]
+        current = get_current_passwords(user_id, websites)
+
+        def password(encrypted_password):
+            return None if encrypted_password is None else decrypt_password(encrypted_password, key)
+
+        conflicts = 0
+        with UnitOfWork() as work:
+            for (_, queued_at, _, action, encrypted_password, fingerprint, base), website in zip(queued, websites):
+                # Compare what the passwords say, so a re-encrypted but unchanged row is no conflict,
+                # and the server already holding this very write is none either
+                server = password(current.get(website))
+                conflict = server not in (password(base), password(encrypted_password))
+                conflicts += conflict
+                if not conflict or policy == "client":
+                    if action == "put":
+                        work.add_password(user_id, website, encrypted_password, fingerprint)
+                    else:
+                        work.delete_password(user_id, website)
+                elif policy == "copy" and action == "put":
+                    copy = f"{website} (offline copy {time.strftime('%Y-%m-%d %H:%M', time.localtime(queued_at))})"
+                    work.add_password(user_id, copy, encrypted_password, fingerprint)
+                # Otherwise the server's version stays, and the pull brings it back here
+
+        with self._lock, self._conn:
+            # A write queued again meanwhile has a new queued_at and stays for the next push
+            self._conn.executemany("DELETE FROM outbox WHERE seq = ? AND queued_at = ?",
+                                   [(row[0], row[1]) for row in queued])
+        return len(queued), conflicts
+
+    def _push_if_pending(self, user_id: int):
+        # A successful write means the server is back, so send what was queued meanwhile
+        if self.pending(user_id):
+            try:
+                self.sync(user_id)
+            except database.DB_ERRORS:
+                pass
+
+    def pull(self, user_id: int) -> tuple:
+        """Brings the replica up to date with the server's change log; returns (pulled, removed)."""
+        up_to = latest_change_seq()
+        record = get_user_auth_record(user_id)
+        if record is None:
+            return 0, 0
+        with self._lock:
+            row = self._conn.execute("SELECT change_cursor, synced_at FROM accounts WHERE user_id = ?",
+                                     (user_id,)).fetchone()
+            pending = {token for (token,) in self._conn.execute("SELECT token FROM outbox WHERE user_id = ?",
+                                                                (user_id,))}
+        cursor, synced_at = row or (0, None)
+
+        # Writes still queued here win over the server until they are pushed
+        if synced_at is None or cursor > up_to:
+            # First sync, or the server's log was reset (e.g. restored from a backup)
+            passwords = {website: encrypted_password for _, website, encrypted_password in iter_passwords(user_id)}
+            keys = self._keys(user_id)
+            stale = set()
+            with self._lock:
+                for (token,) in self._conn.execute("SELECT token FROM entries WHERE user_id = ?", (user_id,)):
+                    stale.add(token)
+            stale -= {keys.token(website) for website in passwords} | pending
+            with self._lock, self._conn:
+                self._conn.executemany("DELETE FROM entries WHERE user_id = ? AND token = ?",
+                                       [(user_id, token) for token in stale])
+            removed = len(stale)
+        else:
+            websites = get_changed_websites(user_id, max(0, cursor - SYNC_OVERLAP), up_to)
+            passwords = get_current_passwords(user_id, websites)
+            missing = [website for website in websites if website not in passwords]
+            self._remove_entries(user_id, missing, pending)
+            removed = len(missing)
+        self._store_entries(user_id, passwords, pending)
+
+        username, *account = record
+        with self._lock, self._conn:
+            self._conn.execute("""
+                INSERT INTO accounts (user_id, username_digest, master_password_hash, kdf_salt, kdf_iterations,
+                                      wrapped_key, change_cursor, synced_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET username_digest = excluded.username_digest,
+                    master_password_hash = excluded.master_password_hash, kdf_salt = excluded.kdf_salt,
+                    kdf_iterations = excluded.kdf_iterations, wrapped_key = excluded.wrapped_key,
+                    change_cursor = excluded.change_cursor, synced_at = excluded.synced_at
+            """, (user_id, _username_digest(username), *account, up_to, time.time()))
+        self._current.add(user_id)
+        return len(passwords), removed
+
+    def sync_periodically(self, user_id: int):
+        """Syncs a user's vault now, then every REPLICA_SYNC_INTERVAL seconds until their vault is locked."""
+        with self._lock:
+            if self._syncer is None:
+                self._syncer = _PeriodicSync(self)
+        self._syncer.add(user_id)
+
+    # Accounts
+
+    def login(self, username: str, master_password: str):
+        """Unlocks a vault from the replica's copy of the account; returns the user ID, or None."""
+        with self._lock:
+            row = self._conn.execute("""
+                SELECT user_id, master_password_hash, kdf_salt, kdf_iterations, wrapped_key
+                FROM accounts WHERE username_digest = ?
+            """, (_username_digest(username),)).fetchone()
+        if row is None or row[4] is None:
+            return None
+        user_id, hashed_password, *key_record = row
+        if not bcrypt.checkpw(master_password.encode(), hashed_password.encode()):
+            return None
+        key_cache.put(user_id, unwrap_vault_key(master_password, key_record))
+        self.offline = True  # Only used when the server cannot be reached
+        return user_id
+
+    def forget(self, user_id: int):
+        """Removes a user's account, entries and queued writes from the replica."""
+        with self._lock, self._conn:
+            for table in ("entries", "outbox", "accounts"):
+                self._conn.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+            self._sorted.pop(user_id, None)
+            self._current.discard(user_id)
+
+    def close(self):
+        if self._syncer is not None:
+            self._syncer.stop()
+        with self._lock:
+            self._conn.close()
+
+class _PeriodicSync:
+    """Syncs logged-in users' vaults on one daemon thread, every REPLICA_SYNC_INTERVAL seconds.
+
+    Each round pushes queued offline writes before pulling, so while the server is down
+    the outbox is retried every round and goes out on the first one after it is back.
+    Users whose vault has been locked (logged out) are dropped.
+    """
+
+    def __init__(self, replica: Replica):
+        self.replica = replica
+        self._users = set()
+        self._failing = set()  # users whose last sync could not reach the server
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add(self, user_id: int):
+        with self._lock:
+            self._users.add(user_id)
+        self._wake.set()  # Sync the new user right away
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            self._wake.wait(config.REPLICA_SYNC_INTERVAL or None)
+            self._wake.clear()
+            if self._stopped:
+                return
+            with self._lock:
+                users = list(self._users)
+            for user_id in users:
+                if self._stopped:
+                    return
+                self._sync(user_id)
+
+    def _sync(self, user_id: int):
+        try:
+            if user_id not in key_cache:
+                self._drop(user_id)
+                return
+            pushed = self.replica.sync(user_id)["pushed"]
+        except VaultLockedError:  # Locked while the sync ran
+            self._drop(user_id)
+            return
+        except database.DB_ERRORS as err:
+            if user_id not in self._failing:  # Report an outage once, not every round
+                self._failing.add(user_id)
+                print(f"⚠️ Could not sync the local replica: {err}")
+            return
+        if user_id in self._failing:
+            self._failing.discard(user_id)
+            print(f"🔄 Server reachable again; pushed {pushed} offline change(s).")
+
+    def _drop(self, user_id: int):
+        with self._lock:
+            self._users.discard(user_id)
+        self._failing.discard(user_id)
+
+_replica = None
+_replica_lock = threading.Lock()
+
+def get_replica():
+    """Returns the replica at REPLICA_PATH, or None if no replica is configured."""
+    global _replica
+    if _replica is None and config.REPLICA_PATH:
+        with _replica_lock:
+            if _replica is None:
+                _replica = Replica(config.REPLICA_PATH)
+    return _replica
+
+def _forget_deleted_user(user_id: int, website: str, action: str):
+    # A deleted account is the one change reported for a whole user as a delete
+    if _replica is not None and website is None and action == "delete":
+        _replica.forget(user_id)
+
+add_change_listener(_forget_deleted_user)
+
+def active_replica(user_id: int):
+    """Returns the replica if it should serve this user's reads, else None.
+
+    That is once this process has synced the user's vault or, while the server cannot be
+    reached, when an earlier sync left a copy of it (see Replica.is_current).
+    """
+    replica = get_replica()
+    if replica is None or not replica.is_ready(user_id):
+        return None
+    return replica if replica.is_current(user_id) or replica.offline else None
+
+def server_reachable() -> bool:
+    try:
+        with database.get_connection():
+            return True
+    except database.DB_ERRORS:
+        return False
+
+def sync_in_background(user_id: int):
+    """Keeps a user's replica in sync in the background after login, if a replica is configured."""
+    replica = get_replica()
+    if replica is not None:
+        replica.sync_periodically(user_id)
+
+# The app reads and writes through these, so a configured replica is used transparently
+
+def read_password(user_id: int, website: str):
+    replica = active_replica(user_id)
+    return replica.get_password(user_id, website) if replica else get_password(user_id, website)
+
+def read_passwords(user_id: int, websites: list) -> dict:
+    replica = active_replica(user_id)
+    return replica.get_passwords(user_id, websites) if replica else get_current_passwords(user_id, websites)
+
+def read_websites(user_id: int) -> list:
+    replica = active_replica(user_id)
+    return replica.get_websites(user_id) if replica else get_websites(user_id)
+
+def read_count(user_id: int) -> int:
+    replica = active_replica(user_id)
+    return replica.count(user_id) if replica else count_passwords(user_id)
+
+def store_password(user_id: int, website: str, encrypted_password: bytes, fingerprint: bytes = None) -> bool:
+    replica = get_replica()
+    if replica is None:
+        return database.add_password(user_id, website, encrypted_password, fingerprint)
+    return replica.put(user_id, website, encrypted_password, fingerprint)
+
+def remove_password(user_id: int, website: str) -> bool:
+    replica = get_replica()
+    if replica is None:
+        return database.delete_password(user_id, website)
+    return replica.delete(user_id, website)
@@ -0,0 +1,129 @@
+"""Re-encrypts rows still under retired global keys with the current AES_KEY.
+
+Every row in `passwords` carries a key_id: 0 for the owner's vault key, otherwise the
+ID of the global key it was encrypted with. To rotate AES_KEY:
+
+    1. Move the old key to AES_RETIRED_KEYS ("1:<old key>") and set a new AES_KEY
+       with a new AES_KEY_ID (e.g. 2).
+    2. python rotation.py run [--chunk-size N] [--workers N]
+    3. Once `python rotation.py status` shows no rows left on the old ID, drop it
+       from AES_RETIRED_KEYS.
+
+Rows are streamed in id order, one chunk per transaction, with a checkpoint saved in
+the same transaction, so an interrupted run resumes where it stopped. Chunks are
+re-encrypted in worker processes while the next ones are read. Rows written
+concurrently are left alone, and reads keep working throughout because the retired
+keys stay in the keyring.
+
+Rows on the current key that are still in the legacy AES-CBC format are rewritten as
+AES-GCM records in the same pass. (Rows on per-user vault keys are upgraded in the
+background when their owner logs in; see keys.upgrade_vault_rows.)
+"""
+import argparse
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import config
+import database
+from database import (clear_rotation_checkpoint, count_passwords_by_key, get_rotation_checkpoint,
+                      get_rows_to_rotate, store_rotated_rows)
+from encryption import encrypt_many, decrypt_many
+
+def _reencrypt_chunk(rows: list, keyring: dict, target_key_id: int) -> tuple:
+    """Worker: returns ([(id, old_ciphertext, new_ciphertext)], failed count) for one chunk."""
+    readable, failed = [], 0
+    by_key = {}
+    for row_id, key_id, ciphertext in rows:
+        by_key.setdefault(key_id, []).append((row_id, ciphertext))
+
+    for key_id, entries in by_key.items():
+        key = keyring.get(key_id)
+        if key is None:
+            failed += len(entries)
+            continue
+        passwords = decrypt_many([c for _, c in entries], key=key, parallel_threshold=0)
+        for (row_id, ciphertext), password in zip(entries, passwords):
+            if password.startswith("⚠️ Decryption Error"):
+                failed += 1
+            else:
+                readable.append((row_id, ciphertext, password))
+
+    ciphertexts = encrypt_many([p for _, _, p in readable], key=keyring[target_key_id], parallel_threshold=0,
+                               key_id=target_key_id)
+    return [(row_id, old, new) for (row_id, old, _), new in zip(readable, ciphertexts)], failed
+
+def rotate(chunk_size: int = None, workers: int = None, restart: bool = False, verbose: bool = True) -> tuple:
+    """Moves every row on a retired global key to AES_KEY_ID; returns (rotated, failed).
+
+    Rows that cannot be decrypted (unknown key ID or corrupt data) are counted as failed
+    and skipped. A finished run clears its checkpoint, so rerunning retries them.
+    """
+    chunk_size = chunk_size or config.ROTATION_CHUNK_SIZE
+    workers = workers or config.CRYPTO_WORKERS
+    target = config.AES_KEY_ID
+
+    checkpoint = None if restart else get_rotation_checkpoint(target)
+    last_id, rotated, failed = checkpoint or (0, 0, 0)
+    if checkpoint and verbose:
+        print(f"Resuming rotation to key {target} after row {last_id} ({rotated} rotated so far)")
+
+    started, resumed_from = time.perf_counter(), rotated
+    pending = deque()  # (last id of chunk, future), in id order
+    read_up_to, exhausted = last_id, False
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            # Keep a couple of chunks per worker in flight; memory stays bounded by that
+            while not exhausted and len(pending) < 2 * workers:
+                rows = get_rows_to_rotate(target, read_up_to, chunk_size)
+                if not rows:
+                    exhausted = True
+                    break
+                read_up_to = rows[-1][0]
+                pending.append((read_up_to, pool.submit(_reencrypt_chunk, rows, config.AES_KEYRING, target)))
+            if not pending:
+                break
+
+            chunk_last_id, future = pending.popleft()
+            updates, chunk_failed = future.result()
+            failed += chunk_failed
+            rotated += store_rotated_rows(target, updates, chunk_last_id, rotated, failed)
+            if verbose:
+                rate = (rotated - resumed_from) / (time.perf_counter() - started or 1)
+                print(f"  ... up to row {chunk_last_id}: {rotated} rotated, {failed} failed ({rate:.0f} rows/s)")
+
+    clear_rotation_checkpoint(target)
+    return rotated, failed
+
+def print_status():
+    counts = count_passwords_by_key()
+    print(f"Current key ID: {config.AES_KEY_ID}")
+    print(f"Rows on per-user vault keys: {counts.pop(0, 0)}")
+    for key_id, count in sorted(counts.items()):
+        state = "current" if key_id == config.AES_KEY_ID else \
+            "retired" if key_id in config.AES_KEYRING else "unknown, cannot be read"
+        print(f"Rows on global key {key_id} ({state}): {count}")
+    checkpoint = get_rotation_checkpoint(config.AES_KEY_ID)
+    if checkpoint:
+        print(f"Unfinished rotation: stopped after row {checkpoint[0]} ({checkpoint[1]} rotated)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rotate the global AES key.")
+    parser.add_argument("command", choices=("status", "run"))
+    parser.add_argument("--chunk-size", type=int, help=f"Rows per transaction (default {config.ROTATION_CHUNK_SIZE})")
+    parser.add_argument("--workers", type=int, help=f"Worker processes (default {config.CRYPTO_WORKERS})")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and rescan from the start")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "status":
+            print_status()
+        else:
+            rotated, failed = rotate(args.chunk_size, args.workers, args.restart)
+            print(f"✅ Rotated {rotated} rows to key {config.AES_KEY_ID}.")
+            if failed:
+                print(f"⚠️ {failed} rows could not be decrypted and were left as they were.")
+                sys.exit(1)
+    except database.DB_ERRORS as err:
+        print(f"❌ Database error: {err}. Run again to resume from the last checkpoint.")
+        sys.exit(1)
@@ -0,0 +1,246 @@
+import threading
+from bisect import bisect_left
+from database import add_change_listener, search_websites
+from replica import read_websites
+
+GRAM_SIZES = (2, 3)
+# Above this many candidates, walking the sorted list beats intersecting and sorting them
+DENSE_CANDIDATES = 1000
+# Shortest query that gets typo-tolerant matching; shorter ones only match as a prefix
+FUZZY_MIN_LENGTH = 4
+
+def _normalize(website: str) -> str:
+    return website.casefold()
+
+def _grams(text: str, size: int) -> set:
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+def _one_edit_variants(text: str, alphabet) -> set:
+    """Strings one deletion, substitution, insertion or adjacent swap away from text."""
+    splits = [(text[:i], text[i:]) for i in range(len(text) + 1)]
+    variants = {left + right[1:] for left, right in splits if right}
+    variants |= {left + right[1] + right[0] + right[2:] for left, right in splits if len(right) > 1}
+    variants |= {left + char + right[1:] for left, right in splits if right for char in alphabet}
+    variants |= {left + char + right for left, right in splits for char in alphabet}
+    variants.discard(text)
+    return variants
+
+class WebsiteIndex:
+    """In-memory index of one user's website names supporting prefix, substring and fuzzy search.
+
+    Prefix lookups bisect a sorted list; substring lookups intersect bigram/trigram
+    postings; fuzzy lookups run a prefix lookup for every string one typo away from the
+    query. All matching is case-insensitive.
+    """
+
+    def __init__(self, websites=()):
+        self._sorted = sorted({(_normalize(w), w) for w in websites})  # (normalized, website) pairs
+        self._postings = {}     # n-gram -> set of websites
+        self._alphabet = set("".join(n for n, _ in self._sorted))
+        self._lock = threading.RLock()
+        for normalized, website in self._sorted:
+            self._index_grams(normalized, website)
+
+    def __len__(self):
+        return len(self._sorted)
+
+    def add(self, website: str):
+        """Indexes a website (no-op if already present)."""
+        normalized = _normalize(website)
+        entry = (normalized, website)
+        with self._lock:
+            position = bisect_left(self._sorted, entry)
+            if position < len(self._sorted) and self._sorted[position] == entry:
+                return
+            self._sorted.insert(position, entry)
+            self._alphabet.update(normalized)
+            self._index_grams(normalized, website)
+
+    def _index_grams(self, normalized: str, website: str):
+        for size in GRAM_SIZES:
+            for gram in _grams(normalized, size):
+                websites = self._postings.get(gram)
+                if websites is None:
+                    self._postings[gram] = {website}
+                else:
+                    websites.add(website)
+
+    def remove(self, website: str):
+        """Removes a website from the index."""
+        normalized = _normalize(website)
+        entry = (normalized, website)
+        with self._lock:
+            position = bisect_left(self._sorted, entry)
+            if position == len(self._sorted) or self._sorted[position] != entry:
+                return
+            del self._sorted[position]
+            for size in GRAM_SIZES:
+                for gram in _grams(normalized, size):
+                    websites = self._postings.get(gram)
+                    if websites is not None:
+                        websites.discard(website)
+                        if not websites:
+                            del self._postings[gram]
+
+    def prefix(self, query: str, limit: int = 50) -> list:
+        """Websites starting with query, in sorted order."""
+        normalized = _normalize(query)
+        results = []
+        with self._lock:
+            position = bisect_left(self._sorted, (normalized, ""))
+            while position < len(self._sorted) and len(results) < limit:
+                name, website = self._sorted[position]
+                if not name.startswith(normalized):
+                    break
+                results.append(website)
+                position += 1
+        return results
+
+    def substring(self, query: str, limit: int = 50) -> list:
+        """Websites containing query anywhere, in sorted order."""
+        normalized = _normalize(query)
+        if not normalized:
+            return []
+        with self._lock:
+            if len(normalized) < min(GRAM_SIZES):
+                # Single characters have no postings; scan until the limit is reached
+                return self._scan(lambda name, website: normalized in name, limit)
+
+            grams = [g for size in GRAM_SIZES if size <= len(normalized) for g in _grams(normalized, size)]
+            postings = sorted((self._postings.get(g, set()) for g in grams), key=len)
+            candidates = postings[0].intersection(*postings[1:])
+            if len(candidates) > DENSE_CANDIDATES:
+                # Matches are common, so the first `limit` of them turn up early in sorted order
+                return self._scan(lambda name, website: website in candidates and normalized in name, limit)
+
+        matches = sorted((_normalize(w), w) for w in candidates if normalized in _normalize(w))
+        return [w for _, w in matches[:limit]]
+
+    def _scan(self, predicate, limit: int) -> list:
+        """Walks the sorted list, stopping once limit matches are found."""
+        results = []
+        for name, website in self._sorted:
+            if predicate(name, website):
+                results.append(website)
+                if len(results) >= limit:
+                    break
+        return results
+
+    def fuzzy(self, query: str, limit: int = 10) -> list:
+        """Websites starting with query give or take one typo, exact prefix matches first."""
+        normalized = _normalize(query)
+        results = self.prefix(normalized, limit)
+        if len(normalized) < FUZZY_MIN_LENGTH or len(results) >= limit:
+            return results
+
+        matches = set()
+        with self._lock:
+            entries = self._sorted
+            for variant in _one_edit_variants(normalized, self._alphabet):
+                # Most variants match nothing, so test the first candidate before scanning
+                position = bisect_left(entries, (variant,))
+                while position < len(entries) and entries[position][0].startswith(variant):
+                    matches.add(entries[position])
+                    position += 1
+                    if len(matches) > 10 * limit:
+                        break
+        seen = set(results)
+        return results + [w for _, w in sorted(matches) if w not in seen][:limit - len(results)]
+
+    def search(self, query: str, limit: int = 50) -> list:
+        """Prefix matches first, then substring matches, then typo-tolerant matches."""
+        results = self.prefix(query, limit)
+        for more in (self.substring, self.fuzzy):
+            if len(results) >= limit:
+                break
+            seen = set(results)
+            results += [w for w in more(query, limit) if w not in seen][:limit - len(results)]
+        return results
+
+class _Build:
+    """A user's index being built; writes seen meanwhile are applied to it before it is published."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.changes = []  # (website, action), in the order they were notified
+
+_indexes = {}   # user_id -> WebsiteIndex
+_building = {}  # user_id -> _Build
+_indexes_lock = threading.Lock()  # Guards both dicts; never held while reading websites
+
+def get_index(user_id: int, wait: bool = True) -> WebsiteIndex:
+    """Returns a user's website index, building it from the replica or database on first use.
+
+    Only one thread builds a user's index; other callers wait for it, or get None with
+    wait=False.
+    """
+    while True:
+        with _indexes_lock:
+            index = _indexes.get(user_id)
+            if index is not None:
+                return index
+            build = _building.get(user_id)
+            if build is None:
+                build = _building[user_id] = _Build()
+                break
+        if not wait:
+            return None
+        build.done.wait()  # Then take the published index, or build it if that build failed
+
+    try:
+        while True:
+            index = WebsiteIndex(read_websites(user_id))
+            with _indexes_lock:
+                changes, build.changes = build.changes, []
+                if any(website is None for website, _ in changes):
+                    continue  # A bulk change landed during the read; read again
+                for website, action in changes:
+                    if action == "delete":
+                        index.remove(website)
+                    else:
+                        index.add(website)
+                if _building.get(user_id) is build:  # Not dropped by a logout meanwhile
+                    _indexes[user_id] = index
+                    del _building[user_id]
+                return index
+    finally:
+        with _indexes_lock:
+            if _building.get(user_id) is build:
+                del _building[user_id]
+        build.done.set()
+
+def warm_index(user_id: int):
+    """Builds a user's index in the background right after login."""
+    threading.Thread(target=get_index, args=(user_id,), daemon=True).start()
+
+def drop_index(user_id: int):
+    """Forgets a user's index (on logout); one still being built is not kept."""
+    with _indexes_lock:
+        _indexes.pop(user_id, None)
+        _building.pop(user_id, None)
+
+def search(user_id: int, query: str, limit: int = 50) -> list:
+    """Searches a user's websites; falls back to the indexed SQL prefix query while the index builds elsewhere."""
+    index = get_index(user_id, wait=False)
+    if index is None:
+        return search_websites(user_id, query, limit)
+    return index.search(query, limit)
+
+def _on_change(user_id: int, website: str, action: str):
+    """Keeps built indexes, and those being built, in step with writes."""
+    with _indexes_lock:
+        index = _indexes.get(user_id)
+        build = _building.get(user_id)
+        if build is not None:
+            build.changes.append((website, action))
+    if index is None:
+        return
+    if website is None:
+        # Bulk change; rebuilding on the next search beats applying it entry by entry
+        drop_index(user_id)
+    elif action == "delete":
+        index.remove(website)
+    else:
+        index.add(website)
+
+add_change_listener(_on_change)
@@ -0,0 +1,310 @@
+"""Local JSON API over the vault, for other tools on this machine.
+
+    python server.py                        # listens on API_HOST:API_PORT (127.0.0.1:8765)
+    python server.py --socket /tmp/pm.sock  # listens on a Unix socket instead
+
+Each request is one line of JSON and gets one line of JSON back, in order:
+
+    {"op": "login", "username": "alice", "password": "..."}   -> {"ok": true, "token": "..."}
+    {"op": "get", "token": "...", "website": "example.com"}    -> {"ok": true, "password": "..."}
+    {"op": "put", "token": "...", "website": "...", "password": "..."}
+    {"op": "list", "token": "...", "offset": 0, "limit": 100, "query": "exa"}
+    {"op": "delete", "token": "...", "website": "..."}
+    {"op": "register", ...} and {"op": "logout", "token": "..."}
+
+Failures are {"ok": false, "error": "..."}. An "id" field in a request is echoed back.
+The server only ever binds to loopback or a Unix socket readable by its owner.
+"""
+import argparse
+import asyncio
+import ipaddress
+import json
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import config
+from auth import register_user, login_user
+import database
+from database import add_password, count_passwords, delete_password, get_password, get_passwords_page
+from encryption import encrypt_password, decrypt_password, fingerprint_password
+from keys import VaultLockedError, get_user_key, key_cache, lock_vault
+from metrics import timer
+from search import drop_index, search, warm_index
+from session_cache import secret_cache
+
+MAX_REQUEST_BYTES = 64 * 1024
+MAX_LIST_LIMIT = 1000
+
+class RequestError(Exception):
+    """A request that cannot be served; its message is sent back to the client."""
+
+class SessionStore:
+    """Session tokens handed out at login, so requests do not re-run bcrypt.
+
+    Tokens expire after `idle_ttl` seconds without use. Each session pins its user's
+    vault key in the key cache, so other logins cannot evict it; the key is wiped with
+    the user's last session. Should the key be gone anyway (locked elsewhere), the
+    user's sessions end with it.
+    """
+
+    def __init__(self, idle_ttl: float = config.API_SESSION_TTL):
+        self.idle_ttl = idle_ttl
+        self._sessions = {}  # token -> [user_id, last_used]
+        self._lock = threading.Lock()
+
+    def create(self, user_id: int) -> str:
+        """Starts a session for a user whose vault key was just unlocked."""
+        if not key_cache.pin(user_id):
+            raise RequestError("Vault was locked again before the session started. Please log in again.")
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._sessions[token] = [user_id, time.monotonic()]
+        return token
+
+    def user_id(self, token) -> int:
+        """Returns the user behind a live token, refreshing its idle timer."""
+        with self._lock:
+            session = self._sessions.get(token) if isinstance(token, str) else None
+            if session is not None and session[0] not in key_cache:
+                self._end_user(session[0])
+                session = None
+            if session is None or time.monotonic() - session[1] > self.idle_ttl:
+                raise RequestError("Invalid or expired session. Please log in again.")
+            session[1] = time.monotonic()
+            return session[0]
+
+    def end(self, token: str):
+        with self._lock:
+            session = self._sessions.pop(token, None)
+            if session:
+                self._release(session[0])
+
+    def expire(self):
+        """Ends every session that has been idle for longer than the TTL."""
+        deadline = time.monotonic() - self.idle_ttl
+        with self._lock:
+            for token in [t for t, (_, last_used) in self._sessions.items() if last_used < deadline]:
+                self._release(self._sessions.pop(token)[0])
+
+    def clear(self):
+        with self._lock:
+            while self._sessions:
+                self._release(self._sessions.popitem()[1][0])
+
+    def _end_user(self, user_id: int):
+        for token in [t for t, (uid, _) in self._sessions.items() if uid == user_id]:
+            self._release(self._sessions.pop(token)[0])
+
+    def _release(self, user_id: int):
+        key_cache.unpin(user_id)
+        if not any(session[0] == user_id for session in self._sessions.values()):
+            secret_cache.invalidate(user_id)
+            lock_vault(user_id)
+            drop_index(user_id)
+
+class VaultServer:
+    """Serves vault requests; blocking work runs on two bounded thread pools.
+
+    bcrypt, key derivation and AES go to the crypto pool and database calls to the
+    database pool, so a slow login ties up one crypto worker rather than the event
+    loop or the connections other clients are waiting on.
+    """
+
+    def __init__(self, sessions: SessionStore = None):
+        self.sessions = sessions or SessionStore()
+        self.crypto_pool = ThreadPoolExecutor(config.API_CRYPTO_WORKERS, thread_name_prefix="api-crypto")
+        self.db_pool = ThreadPoolExecutor(config.API_DB_WORKERS, thread_name_prefix="api-db")
+        self.handlers = {
+            "register": self.register,
+            "login": self.login,
+            "logout": self.logout,
+            "list": self.list,
+            "get": self.get,
+            "put": self.put,
+            "delete": self.delete,
+        }
+
+    async def crypto(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.crypto_pool, fn, *args)
+
+    async def db(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.db_pool, fn, *args)
+
+    async def handle_client(self, reader, writer):
+        """Answers one client's requests in order until it disconnects."""
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    writer.write(b'{"ok": false, "error": "Request too large."}\n')
+                    break
+                if not line:
+                    break
+                if line.strip():
+                    response = await self.dispatch(line)
+                    writer.write(json.dumps(response).encode() + b"\n")
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, line: bytes) -> dict:
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return {"ok": False, "error": "Request is not valid JSON."}
+        if not isinstance(request, dict):
+            return {"ok": False, "error": "Request must be a JSON object."}
+
+        handler = self.handlers.get(request.get("op"))
+        if handler is None:
+            response = {"ok": False, "error": f"Unknown op: {request.get('op')!r}"}
+        else:
+            try:
+                with timer(f"api.{request['op']}"):
+                    response = {"ok": True, **await handler(request)}
+            except (RequestError, VaultLockedError) as e:
+                response = {"ok": False, "error": str(e)}
+            except database.DB_ERRORS as e:
+                response = {"ok": False, "error": f"Database error: {e}"}
+            except Exception as e:
+                print(f"❌ Error handling {request.get('op')!r}: {e}")
+                response = {"ok": False, "error": "Internal error."}
+        if "id" in request:
+            response["id"] = request["id"]
+        return response
+
+    async def register(self, request: dict) -> dict:
+        message = await self.crypto(register_user, _field(request, "username"), _field(request, "password"))
+        if not message.startswith("✅"):
+            raise RequestError(message)
+        return {"message": message}
+
+    async def login(self, request: dict) -> dict:
+        user_id, message = await self.crypto(login_user, _field(request, "username"), _field(request, "password"))
+        if not user_id:
+            raise RequestError(message)
+        warm_index(user_id)
+        return {"token": self.sessions.create(user_id)}
+
+    async def logout(self, request: dict) -> dict:
+        self.sessions.user_id(request.get("token"))
+        self.sessions.end(request["token"])
+        return {}
+
+    async def list(self, request: dict) -> dict:
+        user_id = self.sessions.user_id(request.get("token"))
+        offset = _int_field(request, "offset", 0)
+        limit = min(_int_field(request, "limit", 100), MAX_LIST_LIMIT)
+        if request.get("query"):
+            websites = await self.db(search, user_id, _field(request, "query"), limit)
+            return {"websites": websites}
+        rows = await self.db(get_passwords_page, user_id, offset, limit)
+        total = await self.db(count_passwords, user_id)
+        return {"websites": [website for website, _ in rows], "total": total}
+
+    async def get(self, request: dict) -> dict:
+        user_id = self.sessions.user_id(request.get("token"))
+        website = _field(request, "website")
+        secret = secret_cache.get(user_id, website)
+        if secret is None:
+            encrypted_password = await self.db(get_password, user_id, website)
+            if encrypted_password is None:
+                raise RequestError("No password found for this website.")
+            secret = await self.crypto(decrypt_password, encrypted_password, get_user_key(user_id))
+            if secret.startswith("⚠️"):
+                raise RequestError(secret)
+            secret_cache.put(user_id, website, secret)
+        return {"password": secret}
+
+    async def put(self, request: dict) -> dict:
+        user_id = self.sessions.user_id(request.get("token"))
+        website, password = _field(request, "website"), _field(request, "password")
+        key = get_user_key(user_id)
+        encrypted_password = await self.crypto(encrypt_password, password, key)
+        fingerprint = await self.crypto(fingerprint_password, password, key)
+        if not await self.db(add_password, user_id, website, encrypted_password, fingerprint):
+            raise RequestError("Failed to store password.")
+        return {}
+
+    async def delete(self, request: dict) -> dict:
+        user_id = self.sessions.user_id(request.get("token"))
+        if not await self.db(delete_password, user_id, _field(request, "website")):
+            raise RequestError("No password found for this website.")
+        return {}
+
+    async def expire_sessions(self, interval: float = 30):
+        while True:
+            await asyncio.sleep(interval)
+            self.sessions.expire()
+
+    def close(self):
+        self.sessions.clear()
+        self.crypto_pool.shutdown(wait=True, cancel_futures=True)
+        self.db_pool.shutdown(wait=True, cancel_futures=True)
+
+def _field(request: dict, name: str) -> str:
+    value = request.get(name)
+    if not isinstance(value, str) or not value:
+        raise RequestError(f"Missing or invalid field: {name}")
+    return value
+
+def _int_field(request: dict, name: str, default: int) -> int:
+    value = request.get(name, default)
+    if not isinstance(value, int) or value < 0:
+        raise RequestError(f"Invalid field: {name}")
+    return value
+
+def _check_loopback(host: str):
+    """Refuses to expose the vault beyond this machine."""
+    if host == "localhost":
+        return
+    try:
+        loopback = ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        loopback = False
+    if not loopback:
+        raise ValueError(f"API_HOST must be a loopback address, not {host!r}")
+
+async def serve(host: str = None, port: int = None, socket_path: str = None):
+    """Runs the API server until cancelled."""
+    vault_server = VaultServer()
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = await asyncio.start_unix_server(vault_server.handle_client, socket_path, limit=MAX_REQUEST_BYTES)
+        os.chmod(socket_path, 0o600)
+        print(f"✅ Vault API listening on {socket_path}")
+    else:
+        host = host or config.API_HOST
+        _check_loopback(host)
+        server = await asyncio.start_server(vault_server.handle_client, host, port or config.API_PORT,
+                                            limit=MAX_REQUEST_BYTES)
+        print(f"✅ Vault API listening on {host}:{port or config.API_PORT}")
+
+    expiry = asyncio.create_task(vault_server.expire_sessions())
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        expiry.cancel()
+        vault_server.close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the vault over a local JSON API.")
+    parser.add_argument("--host", help=f"Loopback address to bind (default {config.API_HOST})")
+    parser.add_argument("--port", type=int, help=f"Port to bind (default {config.API_PORT})")
+    parser.add_argument("--socket", default=config.API_SOCKET, help="Unix socket path to bind instead of host/port")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.socket))
+    except (ValueError, OSError) as e:
+        print(f"❌ Could not start the API server: {e}")
+    except KeyboardInterrupt:
+        print("Server stopped.")
@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict
+from config import SECRET_CACHE_SIZE, SECRET_CACHE_TTL
+from database import add_change_listener
+from encryption import decrypt_password
+from keys import get_user_key
+from metrics import register_collector
+from replica import read_password
+
+class SecretCache:
+    """In-memory LRU cache of decrypted secrets for unlocked sessions.
+
+    Entries are keyed by (user_id, website), expire after `idle_ttl` seconds without
+    being read, and are stored in bytearrays that are zeroed when evicted. Strings
+    handed back to callers are ordinary Python copies and cannot be wiped.
+    """
+
+    def __init__(self, max_entries: int = SECRET_CACHE_SIZE, idle_ttl: float = SECRET_CACHE_TTL):
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self._entries = OrderedDict()  # (user_id, website) -> (bytearray, last_used); oldest first
+        self._lock = threading.Lock()
+        self._timer = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _wipe(buffer: bytearray):
+        buffer[:] = bytes(len(buffer))
+
+    def get(self, user_id: int, website: str):
+        """Returns the cached secret, or None if it is missing or expired."""
+        key = (user_id, website)
+        with self._lock:
+            self._purge_expired()
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries[key] = (entry[0], time.monotonic())
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0].decode()
+
+    def put(self, user_id: int, website: str, secret: str):
+        """Caches a decrypted secret, evicting the least recently used entries if full."""
+        if self.max_entries <= 0:
+            return
+
+        key = (user_id, website)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self._wipe(old[0])
+            self._entries[key] = (bytearray(secret.encode()), time.monotonic())
+            while len(self._entries) > self.max_entries:
+                _, (buffer, _) = self._entries.popitem(last=False)
+                self._wipe(buffer)
+            self._schedule_purge()
+
+    def invalidate(self, user_id: int, website: str = None):
+        """Drops one cached secret, or all of a user's secrets when website is None."""
+        with self._lock:
+            if website is not None:
+                keys = [(user_id, website)] if (user_id, website) in self._entries else []
+            else:
+                keys = [key for key in self._entries if key[0] == user_id]
+            for key in keys:
+                self._wipe(self._entries.pop(key)[0])
+
+    def clear(self):
+        """Wipes every cached secret."""
+        with self._lock:
+            for buffer, _ in self._entries.values():
+                self._wipe(buffer)
+            self._entries.clear()
+
+    def purge_expired(self):
+        """Wipes entries that have been idle for longer than the TTL."""
+        with self._lock:
+            self._purge_expired()
+
+    def _purge_expired(self):
+        # Entries are kept in last-used order, so expired ones are all at the front
+        deadline = time.monotonic() - self.idle_ttl
+        while self._entries:
+            key, (buffer, last_used) = next(iter(self._entries.items()))
+            if last_used > deadline:
+                break
+            del self._entries[key]
+            self._wipe(buffer)
+
+    def _schedule_purge(self):
+        """Arms a background timer so idle secrets are wiped even if nobody calls in."""
+        if self._timer is None and self._entries:
+            self._timer = threading.Timer(self.idle_ttl, self._on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            self._purge_expired()
+            self._schedule_purge()
+
+    def __len__(self):
+        return len(self._entries)
+
+# Process-wide cache, kept consistent with writes through database change notifications
+secret_cache = SecretCache()
+add_change_listener(lambda user_id, website, action: secret_cache.invalidate(user_id, website))
+register_collector(lambda: {
+    "secret_cache_entries": len(secret_cache),
+    "secret_cache_hits": secret_cache.hits,
+    "secret_cache_misses": secret_cache.misses,
+})
+
+def lookup_password(user_id: int, website: str):
+    """Returns the decrypted password for a website, serving repeats from the session cache."""
+    secret = secret_cache.get(user_id, website)
+    if secret is not None:
+        return secret
+
+    encrypted_password = read_password(user_id, website)
+    if encrypted_password is None:
+        return None
+
+    secret = decrypt_password(encrypted_password, get_user_key(user_id))
+    if not secret.startswith("⚠️"):
+        secret_cache.put(user_id, website, secret)
+    return secret
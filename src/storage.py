@@ -0,0 +1,232 @@
+import sqlite3
+from config import DB_BACKEND, DB_CONFIG, SQLITE_PATH
+
+class StorageBackend:
+    """Describes how to connect to, and speak the SQL dialect of, one database engine.
+
+    All queries in database.py are written with `%s` placeholders; backends translate
+    them (and anything else dialect specific) so callers never touch the driver directly.
+    """
+
+    name = None
+    # Number of connections the engine can usefully share (None means no limit)
+    max_connections = None
+
+    @property
+    def Error(self):
+        """Base exception class raised by the driver."""
+        raise NotImplementedError
+
+    def connect(self):
+        """Opens a new DB-API connection."""
+        raise NotImplementedError
+
+    def ping(self, conn) -> bool:
+        """Returns True if an idle connection is still usable."""
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    # True if a connection cannot run another query until a streamed result is fully read
+    unbuffered_streams = False
+    # True if triggers stamp created_at/updated_at, overwriting values written explicitly
+    timestamp_triggers = False
+
+    def stream_cursor(self, conn):
+        """Returns a cursor that hands rows over as they are fetched instead of reading them all first."""
+        return conn.cursor()
+
+    def begin_snapshot(self, conn):
+        """Starts a read-only transaction in which every query sees the same snapshot."""
+        conn.rollback()
+        cursor = conn.cursor()
+        cursor.execute("BEGIN")
+        cursor.close()
+
+    def sql(self, query: str) -> str:
+        """Translates a `%s`-style query into this backend's dialect."""
+        return query
+
+    def schema_object_exists(self, conn, kind: str, table: str, name: str) -> bool:
+        """Returns True if a "column", "index" or "trigger" called name already exists on table."""
+        raise NotImplementedError
+
+    @staticmethod
+    def _exists(conn, query: str, params: tuple) -> bool:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        found = cursor.fetchall()
+        cursor.close()
+        return bool(found)
+
+    def schema(self) -> list:
+        """Returns the statements that create the base tables."""
+        raise NotImplementedError
+
+    def upsert(self, table: str, columns: tuple, key_columns: tuple, source: str = None) -> str:
+        """Returns an INSERT that updates the non-key columns when the key already exists.
+
+        source, e.g. a `SELECT ... WHERE ...` or a VALUES list with subqueries, replaces the
+        plain VALUES list of placeholders.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def _insert(table: str, columns: tuple, source: str = None) -> str:
+        source = source or f"VALUES ({', '.join(['%s'] * len(columns))})"
+        return f"INSERT INTO {table} ({', '.join(columns)}) {source}"
+
+class MySQLBackend(StorageBackend):
+    """MySQL server reached through mysql.connector."""
+
+    name = "mysql"
+
+    def __init__(self, config: dict):
+        self._driver = None
+        self._config = config
+
+    @property
+    def driver(self):
+        # mysql.connector takes longer to import than the rest of the app, so load it on first use
+        if self._driver is None:
+            import mysql.connector
+            self._driver = mysql.connector
+        return self._driver
+
+    @property
+    def Error(self):
+        return self.driver.Error
+
+    def connect(self):
+        return self.driver.connect(**self._config)
+
+    unbuffered_streams = True
+
+    def stream_cursor(self, conn):
+        # Rows stay on the server and are read off the socket as fetchmany() asks for them
+        return conn.cursor(buffered=False)
+
+    def begin_snapshot(self, conn):
+        conn.rollback()
+        conn.start_transaction(consistent_snapshot=True, readonly=True)
+
+    def ping(self, conn) -> bool:
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except self.driver.Error:
+            return False
+
+    # MySQL has no IF NOT EXISTS for columns, indexes or (before 8.0.29) triggers
+    _EXISTS_QUERIES = {
+        "column": """SELECT 1 FROM information_schema.columns
+                     WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s""",
+        "index": """SELECT 1 FROM information_schema.statistics
+                    WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s""",
+        "trigger": """SELECT 1 FROM information_schema.triggers
+                      WHERE trigger_schema = DATABASE() AND event_object_table = %s AND trigger_name = %s""",
+    }
+
+    def schema_object_exists(self, conn, kind: str, table: str, name: str) -> bool:
+        return self._exists(conn, self._EXISTS_QUERIES[kind], (table, name))
+
+    def schema(self) -> list:
+        return [
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                username VARCHAR(255) UNIQUE NOT NULL,
+                master_password_hash VARCHAR(255) NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS passwords (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                user_id INT,
+                website VARCHAR(255) NOT NULL,
+                encrypted_password TEXT NOT NULL,
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+            """,
+        ]
+
+    def upsert(self, table: str, columns: tuple, key_columns: tuple, source: str = None) -> str:
+        updates = ", ".join(f"{c} = VALUES({c})" for c in columns if c not in key_columns)
+        return f"{self._insert(table, columns, source)} ON DUPLICATE KEY UPDATE {updates}"
+
+class SQLiteBackend(StorageBackend):
+    """Local SQLite file in WAL mode, for single-user and edge installs."""
+
+    name = "sqlite"
+    timestamp_triggers = True  # See migration 3
+
+    def __init__(self, path: str):
+        self.path = path
+        # Every connection to ":memory:" is a separate database, so never open more than one
+        if path == ":memory:":
+            self.max_connections = 1
+
+    @property
+    def Error(self):
+        return sqlite3.Error
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def sql(self, query: str) -> str:
+        return query.replace("%s", "?")
+
+    def schema_object_exists(self, conn, kind: str, table: str, name: str) -> bool:
+        if kind == "column":
+            cursor = conn.cursor()
+            cursor.execute(f"PRAGMA table_info({table})")
+            columns = [row[1] for row in cursor.fetchall()]
+            cursor.close()
+            return name in columns
+        return self._exists(conn, "SELECT 1 FROM sqlite_master WHERE type = ? AND tbl_name = ? AND name = ?",
+                            (kind, table, name))
+
+    def schema(self) -> list:
+        return [
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username VARCHAR(255) UNIQUE NOT NULL,
+                master_password_hash VARCHAR(255) NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS passwords (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INT,
+                website VARCHAR(255) NOT NULL,
+                encrypted_password TEXT NOT NULL,
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+            """,
+        ]
+
+    def upsert(self, table: str, columns: tuple, key_columns: tuple, source: str = None) -> str:
+        updates = ", ".join(f"{c} = excluded.{c}" for c in columns if c not in key_columns)
+        return f"{self._insert(table, columns, source)} ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET {updates}"
+
+BACKENDS = {
+    "mysql": lambda: MySQLBackend(DB_CONFIG),
+    "sqlite": lambda: SQLiteBackend(SQLITE_PATH),
+}
+
+def create_backend(name: str = DB_BACKEND) -> StorageBackend:
+    """Creates the storage backend registered under the given name."""
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown DB_BACKEND '{name}'. Choose one of: {', '.join(BACKENDS)}") from None
@@ -0,0 +1,327 @@
+"""Streaming import and encrypted export of a user's vault.
+
+    python main.py import passwords.csv --user alice
+    python main.py export vault.pmx --user alice
+    python main.py import vault.pmx --user alice      # restore an export
+
+Imports read CSV (Chrome, Edge, Firefox, Safari, Bitwarden, LastPass, 1Password and plain
+"website,password" layouts), JSON (an array of entries or a Bitwarden export) and JSON
+Lines. Only the website and password of each entry are kept; a website imported twice
+keeps the last password.
+
+Exports are encrypted with a passphrase-derived key (PBKDF2-HMAC-SHA256 and AES-GCM):
+
+    "PMVX" | version (1 byte) | salt (16 bytes) | iterations (4 bytes)
+    then frames of: length (4 bytes) | nonce (12 bytes) | ciphertext + tag
+
+Each frame holds TRANSFER_CHUNK_SIZE entries as JSON Lines and authenticates the header,
+its position and whether it is the last frame, so a reordered or truncated file is
+rejected. Files are read and written a chunk at a time, never whole.
+"""
+import csv
+import json
+import os
+import struct
+from itertools import islice
+from urllib.parse import urlsplit
+import config
+from database import UnitOfWork, iter_passwords
+from encryption import NONCE_SIZE, encrypt_many, decrypt_many, fingerprint_many
+from keys import SALT_SIZE, derive_key, get_user_key
+
+EXPORT_MAGIC = b"PMVX"
+EXPORT_VERSION = 1
+_EXPORT_HEADER = struct.Struct(">4sB16sI")
+_FRAME_LENGTH = struct.Struct(">I")
+_FRAME_AAD = struct.Struct(">QB")  # frame index, last-frame flag
+
+# Column names that hold the website, best first; URL columns are reduced to their host
+WEBSITE_COLUMNS = ("website", "name", "title", "url", "login_uri", "origin", "hostname")
+URL_COLUMNS = {"url", "login_uri", "origin", "hostname"}
+PASSWORD_COLUMNS = ("password", "login_password")
+
+class TransferError(Exception):
+    """Raised for files that cannot be imported (unknown layout, wrong passphrase, corrupt data)."""
+
+def _host(url: str) -> str:
+    if "//" not in url:
+        return url
+    return urlsplit(url).hostname or url
+
+def _entry(record: dict):
+    """Returns (website, password) from one imported record, or None if either is missing."""
+    record = {str(name).strip().lower(): value for name, value in record.items()}
+    # Bitwarden JSON nests the login: {"name": ..., "login": {"password": ..., "uris": [{"uri": ...}]}}
+    login = record.get("login")
+    if isinstance(login, dict):
+        record.setdefault("password", login.get("password"))
+        uris = login.get("uris") or []
+        if uris and isinstance(uris[0], dict):
+            record.setdefault("url", uris[0].get("uri"))
+
+    password = next((record[c] for c in PASSWORD_COLUMNS if isinstance(record.get(c), str) and record[c]), None)
+    for column in WEBSITE_COLUMNS:
+        value = record.get(column)
+        if isinstance(value, str) and value.strip():
+            website = _host(value.strip()) if column in URL_COLUMNS else value.strip()
+            return (website, password) if password else None
+    return None
+
+def read_csv(f):
+    """Yields (website, password) or None (unusable row) for each row of a CSV export."""
+    reader = csv.reader(f)
+    header = [name.strip().lower() for name in next(reader, [])]
+    # Resolve the columns once from the header rather than per row
+    websites = [(header.index(c), c in URL_COLUMNS) for c in WEBSITE_COLUMNS if c in header]
+    passwords = [header.index(c) for c in PASSWORD_COLUMNS if c in header]
+    if not websites or not passwords:
+        raise TransferError("CSV header needs a password column and a website, name or url column.")
+
+    for row in reader:
+        password = next((row[i] for i in passwords if i < len(row) and row[i]), None)
+        website = None
+        for i, is_url in websites:
+            if i < len(row) and row[i].strip():
+                website = _host(row[i].strip()) if is_url else row[i].strip()
+                break
+        yield (website, password) if website and password else None
+
+class _JsonStream:
+    """Decodes a JSON document one value at a time from a text file, reading 64 KiB at once."""
+
+    def __init__(self, f, read_size: int = 1 << 16):
+        self.f = f
+        self.read_size = read_size
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        more = self.f.read(self.read_size)
+        if not more:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.position:] + more
+        self.position = 0
+        return True
+
+    def peek(self) -> str:
+        """Returns the next non-whitespace character without consuming it ("" at the end)."""
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in " \t\r\n":
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise TransferError(f"Malformed JSON: expected {char!r} near offset {self.position}.")
+        self.position += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                # A value running to the end of the buffer may continue in the next read
+                if end < len(self.buffer) or self.eof:
+                    self.position = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise TransferError(f"Malformed JSON near offset {self.position}.")
+            self._fill()
+
+    def array(self):
+        """Yields the elements of the array starting at the current position."""
+        self.expect("[")
+        if self.peek() == "]":
+            self.position += 1
+            return
+        while True:
+            yield self.value()
+            separator = self.peek()
+            self.position += 1
+            if separator == "]":
+                return
+            if separator != ",":
+                raise TransferError(f"Malformed JSON: expected ',' or ']' near offset {self.position}.")
+
+def read_json(f):
+    """Yields entries from a JSON array of records or from the "items" of a Bitwarden export."""
+    stream = _JsonStream(f)
+    start = stream.peek()
+    if start == "[":
+        records = stream.array()
+    elif start == "{":
+        records = _object_items(stream)
+    else:
+        raise TransferError("JSON import must be an array of entries or an object with an \"items\" array.")
+    for record in records:
+        yield _entry(record) if isinstance(record, dict) else None
+
+def _object_items(stream: _JsonStream):
+    stream.expect("{")
+    while stream.peek() != "}":
+        name = stream.value()
+        stream.expect(":")
+        if name == "items" and stream.peek() == "[":
+            yield from stream.array()
+        else:
+            stream.value()  # Folders, collections and other metadata are skipped
+        if stream.peek() == ",":
+            stream.position += 1
+
+def read_json_lines(f):
+    for line in f:
+        if line.strip():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield None
+                continue
+            yield _entry(record) if isinstance(record, dict) else None
+
+def read_export(f, passphrase: str):
+    """Yields entries from an encrypted export, checking every frame."""
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    header = f.read(_EXPORT_HEADER.size)
+    if len(header) < _EXPORT_HEADER.size:
+        raise TransferError("Export file is truncated.")
+    magic, version, salt, iterations = _EXPORT_HEADER.unpack(header)
+    if magic != EXPORT_MAGIC or version != EXPORT_VERSION:
+        raise TransferError("Not a password manager export, or from a newer version.")
+    aesgcm = AESGCM(derive_key(passphrase, salt, iterations))
+
+    index = 0
+    while True:
+        length = f.read(_FRAME_LENGTH.size)
+        if len(length) < _FRAME_LENGTH.size:
+            raise TransferError("Export file is truncated.")
+        frame_length = _FRAME_LENGTH.unpack(length)[0]
+        frame = f.read(frame_length)
+        if len(frame) < frame_length:
+            raise TransferError("Export file is truncated.")
+        nonce, ciphertext = frame[:NONCE_SIZE], frame[NONCE_SIZE:]
+        plaintext = None
+        for last in (0, 1):
+            try:
+                plaintext = aesgcm.decrypt(nonce, ciphertext, header + _FRAME_AAD.pack(index, last))
+                break
+            except InvalidTag:
+                continue
+        if plaintext is None:
+            raise TransferError("Wrong passphrase, or the export file is corrupt.")
+        for line in plaintext.decode().splitlines():
+            record = json.loads(line)
+            yield record["website"], record["password"]
+        if last:
+            return
+        index += 1
+
+def is_export_file(path: str) -> bool:
+    """True if path starts like a file written by export_vault."""
+    with open(path, "rb") as f:
+        return f.read(len(EXPORT_MAGIC)) == EXPORT_MAGIC
+
+def open_entries(path: str, file_format: str = None, passphrase: str = None):
+    """Opens path and returns a generator of its entries; file_format is csv, json or jsonl
+    (guessed from the extension when omitted). Encrypted exports need passphrase."""
+    if is_export_file(path):
+        if passphrase is None:
+            raise TransferError("This is an encrypted export; a passphrase is needed.")
+        return _read_file(path, "rb", lambda f: read_export(f, passphrase))
+
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    file_format = file_format or {"ndjson": "jsonl"}.get(extension, extension)
+    readers = {"csv": read_csv, "json": read_json, "jsonl": read_json_lines}
+    if file_format not in readers:
+        raise TransferError(f"Unknown import format {file_format!r}; use csv, json or jsonl.")
+    return _read_file(path, "r", readers[file_format])
+
+def _read_file(path: str, mode: str, reader):
+    kwargs = {} if "b" in mode else {"encoding": "utf-8-sig", "newline": ""}
+    with open(path, mode, **kwargs) as f:
+        yield from reader(f)
+
+def import_entries(user_id: int, entries, chunk_size: int = None, progress=None) -> tuple:
+    """Encrypts and stores (website, password) entries a chunk per transaction.
+
+    None entries are counted as skipped. progress, if given, is called with the running
+    total after each chunk. Returns (imported, skipped). Database errors are raised; chunks
+    already committed stay imported.
+    """
+    chunk_size = chunk_size or config.TRANSFER_CHUNK_SIZE
+    key = get_user_key(user_id)
+    entries = iter(entries)
+    imported = skipped = 0
+    while True:
+        chunk = list(islice(entries, chunk_size))
+        if not chunk:
+            return imported, skipped
+        usable = [entry for entry in chunk if entry is not None]
+        skipped += len(chunk) - len(usable)
+
+        ciphertexts = encrypt_many((password for _, password in usable), key=key)
+        fingerprints = fingerprint_many((password for _, password in usable), key)
+        with UnitOfWork() as work:
+            for (website, _), encrypted_password, fingerprint in zip(usable, ciphertexts, fingerprints):
+                if isinstance(encrypted_password, str):  # An error message rather than a record
+                    skipped += 1
+                else:
+                    work.add_password(user_id, website, encrypted_password, fingerprint)
+        imported += len(work.results)
+        if progress:
+            progress(imported)
+
+def export_vault(user_id: int, path: str, passphrase: str, chunk_size: int = None, progress=None) -> tuple:
+    """Writes a user's passwords to an encrypted export file; returns (exported, unreadable).
+
+    The file is written beside path and moved into place once complete, readable by its
+    owner only. Database errors are raised and leave no file behind.
+    """
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    chunk_size = chunk_size or config.TRANSFER_CHUNK_SIZE
+    key = get_user_key(user_id)
+    salt = os.urandom(SALT_SIZE)
+    header = _EXPORT_HEADER.pack(EXPORT_MAGIC, EXPORT_VERSION, salt, config.KDF_ITERATIONS)
+    aesgcm = AESGCM(derive_key(passphrase, salt, config.KDF_ITERATIONS))
+
+    exported = unreadable = index = 0
+    partial_path = path + ".partial"
+    try:
+        with os.fdopen(os.open(partial_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+            f.write(header)
+            stream = iter_passwords(user_id, order_by="website")
+            rows = list(islice(stream, chunk_size))
+            while True:
+                # Read one chunk ahead so the last frame can be flagged as such
+                following = list(islice(stream, chunk_size))
+                lines = []
+                for (_, website, _), password in zip(rows, decrypt_many((row[2] for row in rows), key=key)):
+                    if password.startswith("⚠️"):
+                        unreadable += 1
+                    else:
+                        lines.append(json.dumps({"website": website, "password": password}))
+                exported += len(lines)
+
+                nonce = os.urandom(NONCE_SIZE)
+                frame = nonce + aesgcm.encrypt(nonce, "\n".join(lines).encode(),
+                                               header + _FRAME_AAD.pack(index, not following))
+                f.write(_FRAME_LENGTH.pack(len(frame)) + frame)
+                if progress:
+                    progress(exported)
+                if not following:
+                    break
+                rows, index = following, index + 1
+        os.replace(partial_path, path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return exported, unreadable
@@ -0,0 +1,264 @@
+from collections import OrderedDict
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex
+import database
+from database import get_passwords_page, iter_passwords
+from encryption import decrypt_password, decrypt_many
+from keys import get_user_key
+from replica import active_replica, read_passwords
+from search import search
+from session_cache import secret_cache
+
+def _fetch_page(user_id: int, page_number: int, page_size: int, after) -> list:
+    """Reads one page of (website, encrypted_password) rows; runs on a worker thread."""
+    replica = active_replica(user_id)
+    if replica is not None:
+        return replica.get_page(user_id, page_number * page_size, page_size)
+    if after is None:
+        return get_passwords_page(user_id, page_number * page_size, page_size)
+    try:
+        return [(website, encrypted_password) for _, website, encrypted_password
+                in iter_passwords(user_id, order_by="website", after=after, limit=page_size)]
+    except database.DB_ERRORS as err:
+        print(f"❌ Database connection error: {err}")
+        return []
+
+def _fetch_matches(user_id: int, text: str, limit: int) -> list:
+    """Searches the websites and reads the matches' ciphertexts in one batch; runs on a worker thread."""
+    websites = search(user_id, text, limit)
+    found = read_passwords(user_id, websites)
+    return [(website, found[website]) for website in websites if website in found]
+
+class VaultTableModel(QAbstractTableModel):
+    """Table model that pages vault rows in from the database on demand.
+
+    The caller counts the rows up front, off the GUI thread. Ciphertexts are fetched a page at a time
+    on the task runner when the view asks for them, streamed on from where the previous page
+    ended (an OFFSET scan is only needed when the view jumps); rows show empty until their
+    page arrives. A password is decrypted only when its row is revealed, and decrypted values
+    outside the visible rows are dropped again. With a filter set, rows come from the website
+    search index, searched and read in one batch on the task runner.
+    """
+
+    PAGE_SIZE = 200
+    MAX_PAGES = 10  # Ciphertext pages kept in memory
+    FILTER_LIMIT = 500  # Most rows shown for a filter
+    MASK = "••••••••"
+    HEADERS = ("Website", "Password")
+
+    def __init__(self, user_id: int, row_count: int, tasks, parent=None):
+        super().__init__(parent)
+        self.user_id = user_id
+        self.tasks = tasks           # TaskRunner that page and filter reads run on
+        self.reveal_all = False
+        self._total = row_count      # rows in the vault, shown when no filter is set
+        self._row_count = row_count
+        self._pages = OrderedDict()  # page number -> [(website, encrypted_password), ...]
+        self._page_ends = {}         # page number -> its last website, where the next page starts
+        self._loading = {}           # page number -> worker reading it
+        self._generation = 0         # bumped whenever in-flight reads become stale
+        self._filter_task = None
+        self._revealed = set()       # rows the user asked to see
+        self._decrypted = {}         # row -> plaintext, only for rows currently in view
+        self._visible = (0, -1)
+        self._filter = ""
+        self._matches = []           # (website, encrypted_password) matching the filter, in display order
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._row_count
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.HEADERS[section]
+        return super().headerData(section, orientation, role)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role != Qt.ItemDataRole.DisplayRole:
+            return None
+
+        row = index.row()
+        entry = self._entry(row)
+        if entry is None:
+            return None
+
+        website, encrypted_password = entry
+        if index.column() == 0:
+            return website
+
+        if not (self.reveal_all or row in self._revealed):
+            return self.MASK
+        if row not in self._decrypted:
+            self._decrypted[row] = self._decrypt(website, encrypted_password)
+        return self._decrypted[row]
+
+    def _decrypt(self, website: str, encrypted_password: str) -> str:
+        """Decrypts one password, going through the session cache."""
+        secret = secret_cache.get(self.user_id, website)
+        if secret is None:
+            secret = decrypt_password(encrypted_password, get_user_key(self.user_id))
+            if not secret.startswith("⚠️"):
+                secret_cache.put(self.user_id, website, secret)
+        return secret
+
+    def _entry(self, row: int):
+        """Returns (website, encrypted_password) for a row, or None and requests its page."""
+        if row < 0 or row >= self._row_count:
+            return None
+        if self._filter:
+            return self._matches[row]
+
+        page_number = row // self.PAGE_SIZE
+        page = self._pages.get(page_number)
+        if page is None:
+            self._request_page(page_number)
+            return None
+        self._pages.move_to_end(page_number)
+
+        offset = row - page_number * self.PAGE_SIZE
+        return page[offset] if offset < len(page) else None
+
+    def _request_page(self, page_number: int):
+        worker = self._loading.get(page_number)
+        if worker is not None and not worker.cancelled:  # A cancelled read is asked for again
+            return
+        after = self._page_ends.get(page_number - 1, "" if page_number == 0 else None)
+        generation = self._generation
+        self._loading[page_number] = self.tasks.start(
+            _fetch_page, self.user_id, page_number, self.PAGE_SIZE, after,
+            on_result=lambda page: self._page_loaded(generation, page_number, page),
+            on_error=lambda message: self._page_failed(generation, page_number, message))
+
+    def _page_loaded(self, generation: int, page_number: int, page: list):
+        if generation != self._generation:
+            return
+        self._loading.pop(page_number, None)
+        self._pages[page_number] = page
+        while len(self._pages) > self.MAX_PAGES:
+            self._pages.popitem(last=False)
+        if len(page) == self.PAGE_SIZE:
+            self._page_ends[page_number] = page[-1][0]
+
+        first = page_number * self.PAGE_SIZE
+        last = min(first + self.PAGE_SIZE, self._row_count) - 1
+        if last >= first:
+            if self.reveal_all:
+                self._decrypt_visible()
+            self.dataChanged.emit(self.index(first, 0), self.index(last, 1))
+
+    def _page_failed(self, generation: int, page_number: int, message: str):
+        if generation == self._generation:
+            self._loading.pop(page_number, None)
+        print(f"❌ Could not load vault rows: {message}")
+
+    def set_filter(self, text: str):
+        """Shows only websites matching text (prefix, substring or close misspelling).
+
+        The search runs on the task runner and the rows are swapped in when it finishes.
+        """
+        text = text.strip()
+        self._cancel_reads()
+        if not text:
+            self._show(text, [])
+            return
+
+        generation = self._generation
+        self._filter_task = self.tasks.start(
+            _fetch_matches, self.user_id, text, self.FILTER_LIMIT,
+            on_result=lambda matches: self._matches_loaded(generation, text, matches),
+            on_error=lambda message: print(f"❌ Could not search the vault: {message}"))
+
+    def _cancel_reads(self):
+        """Makes page and filter reads still in flight be discarded when they finish."""
+        self._generation += 1
+        self._loading.clear()
+        if self._filter_task is not None:
+            self._filter_task.cancel()
+            self._filter_task = None
+
+    def _matches_loaded(self, generation: int, text: str, matches: list):
+        if generation == self._generation:
+            self._filter_task = None
+            self._show(text, matches)
+
+    def _show(self, text: str, matches: list):
+        self.beginResetModel()
+        self._filter = text
+        self._matches = matches
+        self._row_count = len(matches) if text else self._total
+        self._revealed.clear()
+        self._decrypted.clear()
+        self.endResetModel()
+
+    def toggle_reveal(self, row: int):
+        """Shows or hides the decrypted password of a single row."""
+        if row in self._revealed:
+            self._revealed.discard(row)
+            self._decrypted.pop(row, None)
+        else:
+            self._revealed.add(row)
+        index = self.index(row, 1)
+        self.dataChanged.emit(index, index)
+
+    def set_reveal_all(self, reveal: bool):
+        """Shows or hides every password currently in view."""
+        self.reveal_all = reveal
+        if reveal:
+            self._decrypt_visible()
+        else:
+            self._revealed.clear()
+            self._decrypted.clear()
+        self._emit_password_column()
+
+    def set_visible_range(self, first: int, last: int):
+        """Called as the view scrolls; evicts plaintext for rows that left the view."""
+        self._visible = (first, last)
+        for row in [r for r in self._decrypted if r < first or r > last]:
+            del self._decrypted[row]
+        self._revealed = {r for r in self._revealed if first <= r <= last}
+        if self.reveal_all:
+            self._decrypt_visible()
+
+    def _decrypt_visible(self):
+        """Decrypts the rows in view in one batch rather than cell by cell."""
+        first, last = self._visible
+        rows = [r for r in range(max(first, 0), min(last, self._row_count - 1) + 1) if r not in self._decrypted]
+        entries = [(row, self._entry(row)) for row in rows]
+        entries = [(row, entry) for row, entry in entries if entry is not None]
+
+        misses = []
+        for row, (website, encrypted_password) in entries:
+            secret = secret_cache.get(self.user_id, website)
+            if secret is None:
+                misses.append((row, website, encrypted_password))
+            else:
+                self._decrypted[row] = secret
+
+        if not misses:
+            return
+        plaintexts = decrypt_many((miss[2] for miss in misses), key=get_user_key(self.user_id))
+        for (row, website, _), secret in zip(misses, plaintexts):
+            self._decrypted[row] = secret
+            if not secret.startswith("⚠️"):
+                secret_cache.put(self.user_id, website, secret)
+
+    def _emit_password_column(self):
+        if self._row_count:
+            self.dataChanged.emit(self.index(0, 1), self.index(self._row_count - 1, 1))
+
+    def refresh(self, row_count: int):
+        """Takes a fresh row count (counted off the GUI thread) and drops all cached pages and plaintext."""
+        self._total = row_count
+        self._pages.clear()
+        self._page_ends.clear()
+        self.set_filter(self._filter)
+
+    def clear(self):
+        """Drops every cached ciphertext and plaintext, e.g. when the window closes."""
+        self._cancel_reads()
+        self._pages.clear()
+        self._page_ends.clear()
+        self._matches = []
+        self._revealed.clear()
+        self._decrypted.clear()
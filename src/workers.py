@@ -0,0 +1,97 @@
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+class WorkerSignals(QObject):
+    """Signals a Worker uses to hand its outcome back to the GUI thread."""
+
+    result = pyqtSignal(object)
+    error = pyqtSignal(str)
+    progress = pyqtSignal(int)
+    done = pyqtSignal()
+
+class Worker(QRunnable):
+    """Runs a blocking call (bcrypt, database, crypto) on a QThreadPool thread.
+
+    If `report_progress` is set, the call receives a `progress` keyword argument that
+    it can call with a percentage. A cancelled worker never emits result or error;
+    if it is still queued it does not run at all.
+    """
+
+    def __init__(self, fn, *args, report_progress=False, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self.cancelled = False
+        if report_progress:
+            self.kwargs["progress"] = self.signals.progress.emit
+        # The TaskRunner keeps the Python reference alive until the worker is done
+        self.setAutoDelete(False)
+
+    def cancel(self):
+        """Discards the outcome of this worker."""
+        self.cancelled = True
+
+    def run(self):
+        try:
+            if self.cancelled:
+                return
+            try:
+                result = self.fn(*self.args, **self.kwargs)
+            except Exception as e:
+                if not self.cancelled:
+                    self.signals.error.emit(str(e))
+                return
+            if not self.cancelled:
+                self.signals.result.emit(result)
+        finally:
+            self.signals.done.emit()
+
+class TaskRunner(QObject):
+    """Starts workers on a thread pool and tracks how many are still running."""
+
+    # Number of tasks in flight, for busy indicators
+    active_changed = pyqtSignal(int)
+
+    def __init__(self, parent=None, max_threads=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        if max_threads:
+            self.pool.setMaxThreadCount(max_threads)
+        self._workers = set()
+
+    @property
+    def active(self) -> int:
+        return len(self._workers)
+
+    def start(self, fn, *args, on_result=None, on_error=None, on_progress=None, **kwargs) -> Worker:
+        """Runs fn(*args, **kwargs) in the background and wires up the callbacks."""
+        worker = Worker(fn, *args, report_progress=on_progress is not None, **kwargs)
+        if on_result:
+            worker.signals.result.connect(on_result)
+        if on_error:
+            worker.signals.error.connect(on_error)
+        if on_progress:
+            worker.signals.progress.connect(on_progress)
+        worker.signals.done.connect(lambda: self._finished(worker))
+
+        self._workers.add(worker)
+        self.active_changed.emit(self.active)
+        self.pool.start(worker)
+        return worker
+
+    def _finished(self, worker):
+        if worker in self._workers:
+            self._workers.discard(worker)
+            self.active_changed.emit(self.active)
+
+    def cancel_all(self):
+        """Cancels every task; queued ones are removed before they start."""
+        for worker in list(self._workers):
+            worker.cancel()
+            if self.pool.tryTake(worker):
+                self._finished(worker)
+
+    def wait(self, msecs=-1) -> bool:
+        """Blocks until all running tasks finish (used on shutdown)."""
+        return self.pool.waitForDone(msecs)
@@ -0,0 +1,48 @@
+import os
+import sys
+
+# config reads the environment on import, so settle it before any app module loads
+os.environ["DB_BACKEND"] = "sqlite"
+os.environ["SQLITE_PATH"] = ":memory:"
+os.environ["AES_KEY"] = "test-key-0123456789abcdefghijklm"
+os.environ["BCRYPT_ROUNDS"] = "4"
+os.environ["KDF_ITERATIONS"] = "1000"
+os.environ["CRYPTO_PARALLEL_THRESHOLD"] = "0"
+os.environ.pop("REPLICA_PATH", None)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from contextlib import contextmanager
+import pytest
+import database
+from keys import key_cache
+from session_cache import secret_cache
+
+def use_database(path: str):
+    """Points the shared pool at another SQLite file; the schema is migrated on next use."""
+    database.get_pool().close_all()
+    database.get_backend().path = path
+    database._schema_ready = False
+
+@pytest.fixture
+def server_db(tmp_path):
+    """A fresh SQLite file standing in for the server database."""
+    path = str(tmp_path / "server.db")
+    use_database(path)
+    yield path
+    database.get_pool().close_all()
+    key_cache.clear()
+    secret_cache.clear()
+
+@pytest.fixture
+def offline(server_db, tmp_path):
+    """Context manager that makes the server unreachable while it is active."""
+    @contextmanager
+    def unreachable():
+        database.get_pool().close_all()
+        database.get_backend().path = str(tmp_path / "missing" / "server.db")
+        try:
+            yield
+        finally:
+            database.get_pool().close_all()
+            database.get_backend().path = server_db
+    return unreachable
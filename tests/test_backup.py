@@ -0,0 +1,83 @@
+import pytest
+import database
+from backup import SnapshotError, restore_chain, take_snapshot, verify_chain
+
+PASSPHRASE = "backup passphrase"
+
+@pytest.fixture
+def vault(server_db):
+    """Two users with a few passwords each; returns their ids."""
+    database.add_user("alice", "$2b$04$hash-a")
+    database.add_user("bob", "$2b$04$hash-b")
+    alice, bob = database.get_user_by_username("alice")[0], database.get_user_by_username("bob")[0]
+    for i in range(4):
+        database.add_password(alice, f"site{i}.example", f"\x01alice-{i}".encode())
+    database.add_password(bob, "site0.example", b"\x01bob-0")
+    return alice, bob
+
+def query(sql: str, params=()) -> list:
+    with database.get_connection() as conn:
+        cursor = database.execute(conn, sql, params)
+        rows = [tuple(bytes(value) if isinstance(value, memoryview) else value for value in row)
+                for row in cursor.fetchall()]
+        cursor.close()
+    return rows
+
+def contents() -> tuple:
+    return (query("SELECT id, username FROM users ORDER BY id"),
+            query("SELECT id, user_id, website, encrypted_password FROM passwords ORDER BY id"))
+
+def snapshot(tmp_path, name: str, **options) -> str:
+    path = str(tmp_path / name)
+    take_snapshot(path, PASSPHRASE, chunk_rows=2, verbose=False, **options)
+    return path
+
+def test_restore_brings_back_a_full_snapshot(tmp_path, vault):
+    alice, bob = vault
+    path = snapshot(tmp_path, "full.pmsb")
+    expected = contents()
+
+    database.delete_password(alice, "site1.example")
+    database.add_password(alice, "site1.example", b"\x01stored again")
+    database.add_password(bob, "new.example", b"\x01new")
+    database.delete_user("bob")
+
+    assert verify_chain([path], PASSPHRASE)
+    restore_chain([path], PASSPHRASE, workers=2, verbose=False)
+    assert contents() == expected
+
+def test_incremental_chain_restores_deletions(tmp_path, vault):
+    alice, _ = vault
+    full = snapshot(tmp_path, "full.pmsb")
+    database.delete_password(alice, "site0.example")
+    database.add_password(alice, "site2.example", b"\x01changed")
+    monday = snapshot(tmp_path, "monday.pmsb", since_path=full)
+    expected = contents()
+
+    database.add_password(alice, "site3.example", b"\x01after monday")
+    restore_chain([full, monday], PASSPHRASE, workers=2, verbose=False)
+    assert contents() == expected
+
+def test_restored_rows_take_over_unique_keys_held_by_other_ids(tmp_path, vault):
+    alice, bob = vault
+    path = snapshot(tmp_path, "full.pmsb")
+    expected = contents()
+
+    # Swap websites and usernames between ids, as in a database that diverged from the snapshot
+    with database.get_connection() as conn:
+        for sql in ("UPDATE passwords SET website = 'swap' WHERE user_id = %s AND website = 'site0.example'",
+                    "UPDATE passwords SET website = 'site0.example' WHERE user_id = %s AND website = 'site3.example'",
+                    "UPDATE passwords SET website = 'site3.example' WHERE user_id = %s AND website = 'swap'"):
+            database.execute(conn, sql, (alice,)).close()
+        database.execute(conn, "UPDATE users SET username = 'swap' WHERE id = %s", (alice,)).close()
+        database.execute(conn, "UPDATE users SET username = 'alice' WHERE id = %s", (bob,)).close()
+        database.execute(conn, "UPDATE users SET username = 'bob' WHERE id = %s", (alice,)).close()
+        conn.commit()
+
+    restore_chain([path], PASSPHRASE, workers=2, verbose=False)
+    assert contents() == expected
+
+def test_wrong_passphrase_is_rejected(tmp_path, vault):
+    path = snapshot(tmp_path, "full.pmsb")
+    with pytest.raises(SnapshotError):
+        restore_chain([path], "not the passphrase", verbose=False)
@@ -0,0 +1,71 @@
+import io
+import json
+import sqlite3
+import pytest
+import database
+from auth import login_user, register_user
+from batch import BatchRunner
+from database import UnitOfWork
+
+@pytest.fixture
+def alice(server_db):
+    register_user("alice", "master")
+    return login_user("alice", "master", background=False)[0]
+
+@pytest.fixture
+def flushes(monkeypatch):
+    """Counts the transactions batch writes go out in."""
+    commits = []
+    commit = UnitOfWork.commit
+    def counting(work):
+        commits.append(len(work))
+        return commit(work)
+    monkeypatch.setattr(UnitOfWork, "commit", counting)
+    return commits
+
+def run(user_id: int, *commands, batch_size: int = 100) -> tuple:
+    out = io.StringIO()
+    lines = [command if isinstance(command, str) else json.dumps(command) for command in commands]
+    ok = BatchRunner(user_id, out, batch_size).run(lines)
+    return ok, [json.loads(line) for line in out.getvalue().splitlines()]
+
+def test_responses_come_back_in_input_order_with_their_ids(alice, flushes):
+    ok, responses = run(alice,
+                        {"op": "put", "website": "a.example", "password": "one", "id": 1},
+                        {"op": "put", "website": "b.example", "password": "two", "id": 2},
+                        {"op": "delete", "website": "a.example", "id": 3},
+                        {"op": "get", "website": "b.example", "id": 4},
+                        {"op": "list", "id": 5},
+                        {"op": "delete", "website": "a.example", "id": 6})
+    assert not ok
+    assert responses == [{"ok": True, "id": 1}, {"ok": True, "id": 2}, {"ok": True, "id": 3},
+                         {"ok": True, "password": "two", "id": 4},
+                         {"ok": True, "websites": ["b.example"], "id": 5},
+                         {"ok": False, "error": "No password found for this website.", "id": 6}]
+    assert flushes == [3, 1]  # The get flushed the first three writes
+    assert database.get_websites(alice) == ["b.example"]
+
+def test_writes_are_flushed_every_batch_size_commands(alice, flushes):
+    commands = [{"op": "put", "website": f"site{i}.example", "password": "x"} for i in range(5)]
+    ok, responses = run(alice, *commands, batch_size=2)
+    assert ok and len(responses) == 5
+    assert flushes == [2, 2, 1]
+
+def test_bad_lines_fail_on_their_own(alice):
+    ok, responses = run(alice, "not json", "", {"op": "put", "website": "a.example"},
+                        {"op": "rename", "id": "x"}, {"op": "put", "website": "a.example", "password": "ok"})
+    assert not ok
+    assert responses == [{"ok": False, "error": "Command must be a JSON object."},
+                         {"ok": False, "error": "Missing or invalid field: website or password"},
+                         {"ok": False, "error": "Unknown op: 'rename'", "id": "x"},
+                         {"ok": True}]
+
+def test_a_failed_transaction_fails_every_write_in_it(alice, monkeypatch):
+    def lost(work):
+        raise sqlite3.OperationalError("connection lost")
+    monkeypatch.setattr(UnitOfWork, "commit", lost)
+    ok, responses = run(alice, {"op": "put", "website": "a.example", "password": "x", "id": 1},
+                        {"op": "delete", "website": "b.example", "id": 2})
+    assert not ok
+    assert [response["ok"] for response in responses] == [False, False]
+    assert database.get_websites(alice) == []
@@ -0,0 +1,74 @@
+import hashlib
+import os
+import pytest
+import breach
+import config
+import database
+from auth import login_user, register_user
+from breach import BloomFilter, BreachChecker, audit_vault, build_bloom
+from encryption import encrypt_password
+from keys import get_user_key
+
+BREACHED = {f"password{i}": i + 1 for i in range(300)}
+
+def sha1(password: str) -> bytes:
+    return hashlib.sha1(password.encode()).digest()
+
+@pytest.fixture
+def corpus(tmp_path):
+    """A sorted "<HASH>:<count>" file with CRLF line endings, like the Pwned Passwords download."""
+    path = str(tmp_path / "pwned.txt")
+    lines = sorted(f"{sha1(password).hex().upper()}:{count}" for password, count in BREACHED.items())
+    with open(path, "w", newline="") as f:
+        f.write("\r\n".join(lines))  # No newline after the last line
+    return path
+
+@pytest.fixture
+def bloom(tmp_path, corpus):
+    path = str(tmp_path / "pwned.bloom")
+    build_bloom(corpus, path, fp_rate=0.01, verbose=False)
+    return path
+
+@pytest.fixture(params=[False, True], ids=["corpus", "bloom"])
+def checker(request, corpus):
+    checker = BreachChecker(corpus, request.getfixturevalue("bloom") if request.param else None)
+    yield checker
+    checker.close()
+
+def test_count_finds_every_line_and_nothing_else(checker):
+    for password, count in BREACHED.items():
+        assert checker.count(password) == count
+    assert checker.count("correct horse battery staple") == 0
+
+def test_count_digests_returns_counts_in_input_order(checker):
+    passwords = ["password7", "not breached", "password299", "password0", "password7"]
+    assert checker.count_digests([sha1(p) for p in passwords]) == [8, 0, 300, 1, 8]
+    assert checker.count_digests([]) == []
+
+def test_bloom_filter_has_no_false_negatives_and_few_false_positives(bloom):
+    f = BloomFilter(bloom)
+    try:
+        assert all(f.might_contain(sha1(password)) for password in BREACHED)
+        false_positives = sum(f.might_contain(os.urandom(20)) for _ in range(5000))
+        assert false_positives < 5000 * 0.03
+    finally:
+        f.close()
+
+def test_a_file_that_is_not_a_bloom_filter_is_rejected(corpus):
+    with pytest.raises(ValueError):
+        BloomFilter(corpus)
+
+def test_audit_reports_breached_passwords_most_common_first(server_db, corpus, monkeypatch):
+    monkeypatch.setattr(config, "BREACH_CORPUS_PATH", corpus)
+    monkeypatch.setattr(breach, "_checker", None)
+    register_user("alice", "master")
+    user_id = login_user("alice", "master", background=False)[0]
+    key = get_user_key(user_id)
+    for website, password in [("a.example", "password3"), ("b.example", "unique and long"),
+                              ("c.example", "password250"), ("d.example", "password3")]:
+        database.add_password(user_id, website, encrypt_password(password, key))
+
+    try:
+        assert audit_vault(user_id, chunk_size=3) == [("c.example", 251), ("a.example", 4), ("d.example", 4)]
+    finally:
+        breach._checker.close()
@@ -0,0 +1,114 @@
+import pytest
+import config
+import database
+from database import UnitOfWork
+
+@pytest.fixture
+def users(server_db):
+    """Two users on the global key, without a vault key yet."""
+    database.add_user("alice", "$2b$04$hash-a")
+    database.add_user("bob", "$2b$04$hash-b")
+    return database.get_user_by_username("alice")[0], database.get_user_by_username("bob")[0]
+
+@pytest.fixture
+def changes(monkeypatch):
+    seen = []
+    monkeypatch.setattr(database, "_change_listeners", [lambda *change: seen.append(change)])
+    return seen
+
+@pytest.fixture
+def flushes(monkeypatch):
+    """Records the query of every executemany a UnitOfWork sends."""
+    queries = []
+    executemany = UnitOfWork._executemany
+
+    def recording(conn, query, rows):
+        queries.append(query)
+        return executemany(conn, query, rows)
+    monkeypatch.setattr(UnitOfWork, "_executemany", staticmethod(recording))
+    return queries
+
+def stored(user_id: int) -> dict:
+    with database.get_connection() as conn:
+        cursor = database.execute(conn, "SELECT website, encrypted_password, key_id FROM passwords "
+                                        "WHERE user_id = %s ORDER BY website", (user_id,))
+        rows = {website: (bytes(encrypted_password), key_id) for website, encrypted_password, key_id in cursor}
+        cursor.close()
+    return rows
+
+def test_runs_of_the_same_write_go_out_as_one_executemany(users, changes, flushes):
+    alice, bob = users
+    with UnitOfWork() as work:
+        for i in range(3):
+            work.add_password(alice, f"site{i}.example", b"\x01secret")
+        work.add_password(bob, "site0.example", b"\x01bobs")
+        work.delete_password(alice, "site1.example")
+        work.delete_password(alice, "never-stored.example")
+        work.add_password(alice, "site1.example", b"\x01again")
+
+    assert work.results == [True, True, True, True, True, False, True]
+    assert len(flushes) == 3  # puts, deletes, put
+    assert stored(alice) == {website: (password, config.AES_KEY_ID) for website, password in [
+        ("site0.example", b"\x01secret"), ("site1.example", b"\x01again"), ("site2.example", b"\x01secret")]}
+    assert (alice, "site1.example", "delete") in changes
+    assert (alice, "never-stored.example", "delete") not in changes
+
+def test_an_exception_in_the_block_discards_the_queued_writes(users, changes):
+    alice, _ = users
+    with pytest.raises(RuntimeError):
+        with UnitOfWork() as work:
+            work.add_password(alice, "site.example", b"\x01secret")
+            raise RuntimeError
+    assert len(work) == 0 and work.results is None
+    assert stored(alice) == {} and changes == []
+
+def test_upserting_for_a_missing_user_fails_instead_of_writing_nothing(users, changes):
+    alice, bob = users
+    assert database.add_password(bob + 1, "site.example", b"\x01secret") is False
+
+    with pytest.raises(database.DB_ERRORS):
+        with UnitOfWork() as work:
+            work.add_password(alice, "site.example", b"\x01secret")
+            work.add_password(bob + 1, "site.example", b"\x01secret")
+    # The flush is rolled back in full, so nothing is stored and nobody is notified
+    assert stored(alice) == {} and changes == []
+
+@pytest.fixture
+def vault(users):
+    """alice's ids by website, stored out of website order."""
+    alice, bob = users
+    for website in ["m.example", "b.example", "z.example", "ba.example", "a.example", "bb.example"]:
+        database.add_password(alice, website, b"\x01secret")
+    database.add_password(bob, "b.example", b"\x01bobs")
+    return alice, {website: row_id for row_id, website, _ in database.iter_passwords(alice)}
+
+def walk(user_id: int, **options) -> list:
+    return [website for _, website, _ in database.iter_passwords(user_id, **options)]
+
+def test_rows_stream_in_order_from_a_keyset_position(vault):
+    alice, ids = vault
+    assert walk(alice) == ["m.example", "b.example", "z.example", "ba.example", "a.example", "bb.example"]
+    assert walk(alice, after=ids["z.example"], chunk_size=1) == ["ba.example", "a.example", "bb.example"]
+    assert walk(alice, order_by="website", after="b.example") == ["ba.example", "bb.example", "m.example",
+                                                                  "z.example"]
+    assert walk(alice, order_by="website", website_prefix="b", limit=2) == ["b.example", "ba.example"]
+    with pytest.raises(ValueError):
+        walk(alice, order_by="encrypted_password")
+
+@pytest.mark.parametrize("limit, pages", [(None, 4), (5, 3), (4, 2)])
+def test_pages_are_separate_queries_that_release_the_connection(vault, monkeypatch, limit, pages):
+    alice, _ = vault
+    queries = []
+    stream = database._stream_passwords
+    def recording(user_id, order_by, after, website_prefix, size, chunk_size):
+        queries.append((after, size))
+        return stream(user_id, order_by, after, website_prefix, size, chunk_size)
+    monkeypatch.setattr(database, "_stream_passwords", recording)
+
+    websites = []
+    for _, website, _ in database.iter_passwords(alice, order_by="website", limit=limit, page_size=2):
+        assert database.get_pool().stats()["in_use"] == 0  # Only held while a page is read
+        websites.append(website)
+    assert websites == ["a.example", "b.example", "ba.example", "bb.example", "m.example", "z.example"][:limit]
+    assert len(queries) == pages  # A full last page takes one more, empty, query to end the walk
+    assert queries[0] == (None, 2) and queries[1][0] == "b.example"
@@ -0,0 +1,79 @@
+import base64
+import os
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+import config
+import database
+from auth import login_user, register_user
+from encryption import FORMAT_VERSION, decrypt_password, encrypt_password, is_legacy_format, record_key_id
+from keys import get_user_key, upgrade_vault_rows
+
+def legacy_record(password: str, key: bytes) -> str:
+    """Builds a record the way versions before AES-GCM stored it: base64(IV + AES-CBC(PKCS#7))."""
+    iv = os.urandom(16)
+    padder = padding.PKCS7(128).padder()
+    padded = padder.update(password.encode()) + padder.finalize()
+    encryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).encryptor()
+    return base64.b64encode(iv + encryptor.update(padded) + encryptor.finalize()).decode()
+
+def stored_rows(user_id: int) -> dict:
+    with database.get_connection() as conn:
+        cursor = database.execute(conn, "SELECT website, encrypted_password, fingerprint FROM passwords "
+                                        "WHERE user_id = %s", (user_id,))
+        rows = {website: (encrypted_password, fingerprint) for website, encrypted_password, fingerprint in cursor}
+        cursor.close()
+    return rows
+
+def insert_raw(user_id: int, website: str, encrypted_password, key_id: int = 0):
+    with database.get_connection() as conn:
+        database.execute(conn, "INSERT INTO passwords (user_id, website, encrypted_password, key_id) "
+                               "VALUES (%s, %s, %s, %s)", (user_id, website, encrypted_password, key_id)).close()
+        conn.commit()
+
+def test_versioned_record_round_trip():
+    key = os.urandom(32)
+    record = encrypt_password("hunter2", key, key_id=7)
+    assert record[0] == FORMAT_VERSION and record_key_id(record) == 7
+    assert not is_legacy_format(record)
+    assert decrypt_password(record, key) == "hunter2"
+
+def test_versioned_record_header_is_authenticated():
+    key = os.urandom(32)
+    record = bytearray(encrypt_password("hunter2", key, key_id=7))
+    record[2] ^= 1  # flip a bit of the key ID
+    assert decrypt_password(bytes(record), key).startswith("⚠️ Decryption Error")
+
+def test_legacy_cbc_record_still_decrypts():
+    key = os.urandom(32)
+    for password in ("", "short", "exactly16bytes!!", "ünïcödé " * 20):
+        record = legacy_record(password, key)
+        assert is_legacy_format(record) and record_key_id(record) is None
+        assert decrypt_password(record, key) == password
+        # Drivers may hand TEXT columns back as bytes
+        assert decrypt_password(record.encode(), key) == password
+
+def test_upgrade_rewrites_legacy_rows_under_the_vault_key(server_db):
+    register_user("alice", "master")
+    user_id, _ = login_user("alice", "master", background=False)
+    key = get_user_key(user_id)
+    insert_raw(user_id, "old.example", legacy_record("old-secret", key))
+    database.add_password(user_id, "new.example", encrypt_password("new-secret", key))
+
+    assert upgrade_vault_rows(user_id) == 2  # one rewritten, one given a fingerprint
+    rows = stored_rows(user_id)
+    old_record, old_fingerprint = rows["old.example"]
+    assert not is_legacy_format(old_record)
+    assert decrypt_password(old_record, key) == "old-secret"
+    assert old_fingerprint is not None and rows["new.example"][1] is not None
+    assert upgrade_vault_rows(user_id) == 0
+
+def test_first_login_moves_legacy_global_key_rows_to_a_vault_key(server_db):
+    register_user("bob", "master")
+    user_id = database.get_user_by_username("bob")[0]
+    insert_raw(user_id, "legacy.example", legacy_record("from-before", config.AES_KEY), config.AES_KEY_ID)
+
+    assert login_user("bob", "master", background=False)[0] == user_id
+    record, _ = stored_rows(user_id)["legacy.example"]
+    assert not is_legacy_format(record)
+    assert decrypt_password(record, get_user_key(user_id)) == "from-before"
+    assert get_user_key(user_id) != config.AES_KEY
@@ -0,0 +1,27 @@
+from keys import KeyCache
+
+def test_key_cache_evicts_the_least_recently_used_key_and_wipes_it():
+    cache = KeyCache(max_entries=2)
+    cache.put(1, b"a" * 32)
+    cache.put(2, b"b" * 32)
+    assert cache.get(1) == b"a" * 32  # 2 is now the least recently used
+    wiped = cache._keys[2]
+    cache.put(3, b"c" * 32)
+    assert 2 not in cache and 1 in cache and 3 in cache
+    assert wiped == bytearray(32)
+
+def test_pinned_keys_are_not_evicted_or_counted():
+    cache = KeyCache(max_entries=1)
+    assert not cache.pin(1)  # Nothing to pin yet
+    cache.put(1, b"a" * 32)
+    assert cache.pin(1) and cache.pin(1)
+    cache.put(2, b"b" * 32)
+    cache.put(3, b"c" * 32)
+    assert 1 in cache and 2 not in cache and 3 in cache
+
+    cache.unpin(1)
+    cache.put(4, b"d" * 32)
+    assert 1 in cache  # Still held by its second pin
+    cache.unpin(1)
+    cache.put(5, b"e" * 32)
+    assert 1 not in cache
@@ -0,0 +1,79 @@
+import sqlite3
+import config
+import database
+from database import SCHEMA_VERSION, migrate
+
+# The schema as create_tables() wrote it before migrations existed
+V1_SCHEMA = """
+    CREATE TABLE users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username VARCHAR(255) UNIQUE NOT NULL,
+        master_password_hash VARCHAR(255) NOT NULL
+    );
+    CREATE TABLE passwords (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INT,
+        website VARCHAR(255) NOT NULL,
+        encrypted_password TEXT NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    );
+"""
+
+def make_v1_database(path: str):
+    conn = sqlite3.connect(path)
+    conn.executescript(V1_SCHEMA)
+    conn.executemany("INSERT INTO users (username, master_password_hash) VALUES (?, ?)",
+                     [("alice", "$2b$04$hash-a"), ("bob", "$2b$04$hash-b")])
+    conn.executemany("INSERT INTO passwords (user_id, website, encrypted_password) VALUES (?, ?, ?)", [
+        (1, "mail.example", "old-mail"),
+        (1, "bank.example", "bank"),
+        (1, "mail.example", "new-mail"),  # v1 allowed duplicates; the newest one is kept
+        (2, "mail.example", "bobs-mail"),
+    ])
+    conn.commit()
+    conn.close()
+
+def query(sql: str, params=()) -> list:
+    with database.get_connection() as conn:
+        cursor = database.execute(conn, sql, params)
+        rows = cursor.fetchall()
+        cursor.close()
+    return rows
+
+def columns(table: str) -> set:
+    return {row[1] for row in query(f"PRAGMA table_info({table})")}
+
+def test_v1_schema_migrates_forward_and_keeps_rows(server_db):
+    make_v1_database(server_db)
+
+    assert migrate(verbose=False) == [version for version, _, _ in database.MIGRATIONS]
+    assert query("SELECT MAX(version) FROM schema_migrations") == [(SCHEMA_VERSION,)]
+    assert query("SELECT id, username, master_password_hash FROM users ORDER BY id") == [
+        (1, "alice", "$2b$04$hash-a"), (2, "bob", "$2b$04$hash-b")]
+    # Rows of users without a vault key yet are tagged with the global key they are under
+    global_key = config.AES_KEY_ID
+    assert query("SELECT user_id, website, encrypted_password, key_id FROM passwords ORDER BY user_id, website") == [
+        (1, "bank.example", "bank", global_key), (1, "mail.example", "new-mail", global_key),
+        (2, "mail.example", "bobs-mail", global_key)]
+    assert {"created_at", "updated_at", "key_id", "fingerprint"} <= columns("passwords")
+    assert {"kdf_salt", "kdf_iterations", "wrapped_key"} <= columns("users")
+    assert query("SELECT COUNT(*) FROM passwords WHERE created_at IS NULL") == [(0,)]
+
+    # The unique index from migration 2 now backs upserts
+    database.add_password(1, "bank.example", b"\x01replaced")
+    assert query("SELECT COUNT(*) FROM passwords WHERE user_id = 1 AND website = 'bank.example'") == [(1,)]
+    assert migrate(verbose=False) == []
+
+def test_partially_applied_migrations_can_run_again(server_db):
+    make_v1_database(server_db)
+    migrate(verbose=False)
+    created_at = query("SELECT created_at FROM passwords ORDER BY id")
+
+    # As if every migration from 3 on had failed after creating its objects
+    with database.get_connection() as conn:
+        database.execute(conn, "DELETE FROM schema_migrations WHERE version >= 3").close()
+        conn.commit()
+
+    assert migrate(verbose=False) == [version for version, _, _ in database.MIGRATIONS if version >= 3]
+    assert query("SELECT created_at FROM passwords ORDER BY id") == created_at
+    assert query("SELECT COUNT(*) FROM passwords") == [(3,)]
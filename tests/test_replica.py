@@ -0,0 +1,211 @@
+import time
+import pytest
+import config
+import database
+import replica
+from auth import login_user, register_user
+from encryption import decrypt_password, encrypt_password
+from keys import get_user_key, lock_vault
+from replica import Replica
+
+@pytest.fixture
+def alice(server_db):
+    register_user("alice", "master")
+    user_id, _ = login_user("alice", "master", background=False)
+    return user_id
+
+@pytest.fixture
+def laptop(tmp_path, alice):
+    """The second database instance: a replica file synced once with the server."""
+    local = Replica(str(tmp_path / "laptop.db"))
+    for i in range(3):
+        database.add_password(alice, f"site{i}.example", encrypt_password(f"secret{i}", get_user_key(alice)))
+    local.sync(alice)
+    yield local
+    local.close()
+
+def server_passwords(user_id: int) -> dict:
+    key = get_user_key(user_id)
+    return {website: decrypt_password(database.get_password(user_id, website), key)
+            for website in database.get_websites(user_id)}
+
+def replica_passwords(local: Replica, user_id: int) -> dict:
+    key = get_user_key(user_id)
+    return {website: decrypt_password(local.get_password(user_id, website), key)
+            for website in local.get_websites(user_id)}
+
+def put(user_id: int, website: str, password: str):
+    database.add_password(user_id, website, encrypt_password(password, get_user_key(user_id)))
+
+def without_copy_time(website: str) -> str:
+    """Drops the queued-at time from an offline copy's name."""
+    name, copy, _ = website.partition(" (offline copy ")
+    return f"{name} (offline copy)" if copy else website
+
+def cursor(local: Replica, user_id: int) -> int:
+    return local._conn.execute("SELECT change_cursor FROM accounts WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+def test_first_sync_pulls_the_whole_vault(laptop, alice):
+    assert laptop.is_ready(alice)
+    assert replica_passwords(laptop, alice) == server_passwords(alice) == {
+        "site0.example": "secret0", "site1.example": "secret1", "site2.example": "secret2"}
+    assert cursor(laptop, alice) == database.latest_change_seq()
+
+def test_pull_fetches_only_change_log_deltas(laptop, alice, monkeypatch):
+    monkeypatch.setattr(replica, "SYNC_OVERLAP", 0)
+    put(alice, "site1.example", "changed")
+    put(alice, "site3.example", "added")
+    database.delete_password(alice, "site0.example")
+
+    assert laptop.sync(alice) == {"pushed": 0, "conflicts": 0, "pulled": 2, "removed": 1}
+    assert replica_passwords(laptop, alice) == server_passwords(alice)
+    assert laptop.sync(alice) == {"pushed": 0, "conflicts": 0, "pulled": 0, "removed": 0}
+
+def test_sync_resumes_from_the_stored_cursor(tmp_path, laptop, alice, monkeypatch):
+    monkeypatch.setattr(replica, "SYNC_OVERLAP", 0)
+    synced_to = cursor(laptop, alice)
+    laptop.close()
+    put(alice, "site2.example", "while closed")
+
+    reopened = Replica(laptop.path)
+    try:
+        assert cursor(reopened, alice) == synced_to
+        assert reopened.sync(alice)["pulled"] == 1
+        assert reopened.get_websites(alice) == ["site0.example", "site1.example", "site2.example"]
+        assert replica_passwords(reopened, alice)["site2.example"] == "while closed"
+        assert cursor(reopened, alice) == database.latest_change_seq() > synced_to
+    finally:
+        reopened.close()
+
+def test_a_reset_change_log_triggers_a_full_pull(laptop, alice):
+    with database.get_connection() as conn:
+        database.execute(conn, "DELETE FROM password_changes").close()
+        database.execute(conn, "DELETE FROM sqlite_sequence WHERE name = 'password_changes'").close()
+        database.execute(conn, "DELETE FROM passwords WHERE website = 'site0.example'").close()
+        conn.commit()
+
+    assert laptop.sync(alice)["removed"] == 1
+    assert replica_passwords(laptop, alice) == server_passwords(alice)
+
+def test_offline_writes_are_queued_and_pushed_on_reconnect(laptop, alice, offline):
+    key = get_user_key(alice)
+    with offline():
+        assert laptop.put(alice, "site0.example", encrypt_password("offline edit", key))
+        assert laptop.put(alice, "new.example", encrypt_password("offline add", key))
+        assert laptop.delete(alice, "site1.example")
+        assert not laptop.delete(alice, "never-stored.example")
+        assert laptop.pending(alice) == 3
+        assert replica_passwords(laptop, alice) == {
+            "new.example": "offline add", "site0.example": "offline edit", "site2.example": "secret2"}
+        with pytest.raises(database.DB_ERRORS):
+            laptop.sync(alice)
+        assert laptop.pending(alice) == 3
+
+    result = laptop.sync(alice)
+    assert (result["pushed"], result["conflicts"]) == (3, 0)
+    assert laptop.pending(alice) == 0
+    assert server_passwords(alice) == replica_passwords(laptop, alice) == {
+        "new.example": "offline add", "site0.example": "offline edit", "site2.example": "secret2"}
+
+def test_offline_login_uses_the_replicated_account(laptop, alice, offline, monkeypatch):
+    monkeypatch.setattr(replica, "_replica", laptop)
+    lock_vault(alice)
+    with offline():
+        assert login_user("alice", "wrong")[0] is None
+        user_id, message = login_user("alice", "master")
+        assert user_id == alice and message.startswith("📴")
+        assert replica_passwords(laptop, alice)["site1.example"] == "secret1"
+
+@pytest.mark.parametrize("policy, expected", [
+    ("copy", {"site0.example": "server edit", "site0.example (offline copy)": "offline edit",
+              "site1.example": "server edit"}),
+    ("server", {"site0.example": "server edit", "site1.example": "server edit"}),
+    ("client", {"site0.example": "offline edit"}),
+])
+def test_conflict_policies(laptop, alice, offline, policy, expected):
+    key = get_user_key(alice)
+    with offline():
+        laptop.put(alice, "site0.example", encrypt_password("offline edit", key))
+        laptop.delete(alice, "site1.example")
+    # Another client changes both websites before this one reconnects
+    put(alice, "site0.example", "server edit")
+    put(alice, "site1.example", "server edit")
+
+    result = laptop.sync(alice, policy)
+    assert (result["pushed"], result["conflicts"]) == (2, 2)
+    passwords = {without_copy_time(website): password for website, password in server_passwords(alice).items()}
+    del passwords["site2.example"]
+    assert passwords == expected
+    assert replica_passwords(laptop, alice) == server_passwords(alice)
+
+def test_rewriting_the_same_password_is_no_conflict(laptop, alice, offline):
+    key = get_user_key(alice)
+    with offline():
+        laptop.put(alice, "site0.example", encrypt_password("same", key))
+    put(alice, "site0.example", "same")  # applied elsewhere, e.g. by a push cut off before the outbox cleared
+
+    assert laptop.sync(alice, "copy")["conflicts"] == 0
+    assert server_passwords(alice)["site0.example"] == "same"
+    assert len(server_passwords(alice)) == 3
+
+def test_unknown_policy_is_rejected(laptop, alice, offline):
+    with offline():
+        laptop.put(alice, "site0.example", encrypt_password("x", get_user_key(alice)))
+    with pytest.raises(ValueError):
+        laptop.sync(alice, "newest")
+    assert laptop.pending(alice) == 1
+
+def test_deleting_the_account_forgets_it_locally(laptop, alice, monkeypatch):
+    monkeypatch.setattr(replica, "_replica", laptop)
+    database.delete_user("alice")
+    assert not laptop.is_ready(alice)
+    assert laptop._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] == 0
+
+def test_a_copy_from_an_earlier_session_is_read_only_while_offline(laptop, alice, offline, monkeypatch):
+    laptop.close()
+    put(alice, "site0.example", "changed while closed")
+    reopened = Replica(laptop.path)
+    monkeypatch.setattr(replica, "_replica", reopened)
+    try:
+        assert reopened.is_ready(alice) and not reopened.is_current(alice)
+        # Until this process syncs it, the server is read instead of the possibly stale copy
+        assert replica.active_replica(alice) is None
+        assert decrypt_password(replica.read_password(alice, "site0.example"), get_user_key(alice)) == \
+            "changed while closed"
+        with offline():
+            assert login_user("alice", "master", background=False)[0] == alice
+            assert replica.active_replica(alice) is reopened
+            assert replica_passwords(reopened, alice)["site0.example"] == "secret0"
+
+        reopened.sync(alice)
+        assert reopened.is_current(alice) and not reopened.offline
+        assert replica.active_replica(alice) is reopened
+        assert replica_passwords(reopened, alice)["site0.example"] == "changed while closed"
+    finally:
+        reopened.close()
+
+def test_periodic_sync_pushes_the_outbox_once_the_server_is_back(laptop, alice, offline, monkeypatch):
+    monkeypatch.setattr(config, "REPLICA_SYNC_INTERVAL", 0.05)
+    with offline():
+        laptop.put(alice, "offline.example", encrypt_password("queued", get_user_key(alice)))
+        laptop.sync_periodically(alice)
+        time.sleep(0.2)  # A few rounds fail while the server is down
+        assert laptop.pending(alice) == 1 and laptop.offline
+
+    assert wait_for(lambda: laptop.pending(alice) == 0)
+    assert server_passwords(alice)["offline.example"] == "queued"
+    assert wait_for(lambda: not laptop.offline)
+
+    put(alice, "site2.example", "changed elsewhere")
+    assert wait_for(lambda: replica_passwords(laptop, alice)["site2.example"] == "changed elsewhere")
+
+    lock_vault(alice)  # Logging out stops the syncs
+    assert wait_for(lambda: alice not in laptop._syncer._users)
@@ -0,0 +1,78 @@
+import os
+import sqlite3
+import pytest
+import config
+import database
+import rotation
+from encryption import decrypt_password, encrypt_password, is_legacy_format
+from rotation import rotate
+from test_encryption import insert_raw, legacy_record
+
+OLD_KEY = os.urandom(32)
+
+@pytest.fixture
+def rows(server_db, monkeypatch):
+    """Rows on a retired key, a legacy row on the current key, and rows rotation must skip."""
+    monkeypatch.setattr(config, "AES_KEYRING", {config.AES_KEY_ID: config.AES_KEY, 9: OLD_KEY})
+    database.add_user("alice", "$2b$04$hash-a")
+    user_id = database.get_user_by_username("alice")[0]
+    for i in range(5):
+        insert_raw(user_id, f"old{i}.example", encrypt_password(f"old-{i}", OLD_KEY, key_id=9), 9)
+    insert_raw(user_id, "legacy.example", legacy_record("legacy", config.AES_KEY), config.AES_KEY_ID)
+    insert_raw(user_id, "vault.example", encrypt_password("vault", os.urandom(32)), 0)
+    insert_raw(user_id, "unknown.example", encrypt_password("lost", os.urandom(32), key_id=5), 5)
+    return user_id
+
+def global_key_rows(user_id: int) -> dict:
+    with database.get_connection() as conn:
+        cursor = database.execute(conn, "SELECT website, key_id, encrypted_password FROM passwords "
+                                        "WHERE user_id = %s AND key_id <> 0", (user_id,))
+        rows = {website: (key_id, encrypted_password) for website, key_id, encrypted_password in cursor}
+        cursor.close()
+    return rows
+
+def test_rotation_moves_retired_and_legacy_rows_to_the_current_key(rows):
+    assert rotate(chunk_size=2, workers=2, verbose=False) == (6, 1)
+    stored = global_key_rows(rows)
+    assert stored.pop("unknown.example")[0] == 5
+    for website, (key_id, record) in stored.items():
+        assert key_id == config.AES_KEY_ID and not is_legacy_format(record)
+    assert decrypt_password(stored["old3.example"][1], config.AES_KEY) == "old-3"
+    assert decrypt_password(stored["legacy.example"][1], config.AES_KEY) == "legacy"
+    assert database.count_passwords_by_key() == {0: 1, config.AES_KEY_ID: 6, 5: 1}
+    assert database.get_rotation_checkpoint(config.AES_KEY_ID) is None
+
+def test_an_interrupted_rotation_resumes_from_its_checkpoint(rows, monkeypatch):
+    store = database.store_rotated_rows
+    def store_then_fail(target, updates, last_id, rotated, failed):
+        if rotated:
+            raise sqlite3.OperationalError("connection lost")
+        return store(target, updates, last_id, rotated, failed)
+    monkeypatch.setattr(rotation, "store_rotated_rows", store_then_fail)
+    with pytest.raises(database.DB_ERRORS):
+        rotate(chunk_size=2, workers=1, verbose=False)
+    last_id, rotated, _ = database.get_rotation_checkpoint(config.AES_KEY_ID)
+    assert rotated == 2
+
+    read_from = []
+    get_rows = database.get_rows_to_rotate
+    monkeypatch.setattr(rotation, "store_rotated_rows", store)
+    monkeypatch.setattr(rotation, "get_rows_to_rotate",
+                        lambda target, after_id, limit: read_from.append(after_id) or get_rows(target, after_id, limit))
+    assert rotate(chunk_size=2, workers=1, verbose=False) == (6, 1)
+    assert read_from[0] == last_id
+
+def test_rows_written_during_a_rotation_are_left_alone(rows, monkeypatch):
+    get_rows = database.get_rows_to_rotate
+    def read_then_write(target, after_id, limit):
+        chunk = get_rows(target, after_id, limit)
+        if not after_id:
+            database.add_password(rows, "old0.example", b"\x01written meanwhile")
+        return chunk
+    monkeypatch.setattr(rotation, "get_rows_to_rotate", read_then_write)
+
+    assert rotate(chunk_size=10, workers=1, verbose=False) == (5, 1)
+    with database.get_connection() as conn:
+        cursor = database.execute(conn, "SELECT encrypted_password FROM passwords WHERE website = 'old0.example'")
+        assert bytes(cursor.fetchone()[0]) == b"\x01written meanwhile"
+        cursor.close()
@@ -0,0 +1,101 @@
+import threading
+import pytest
+import database
+import search
+from search import WebsiteIndex, drop_index, get_index
+
+WEBSITES = ["GitHub.com", "gitlab.com", "mail.google.com", "google.com", "bank.example", "example.org",
+            "docs.python.org", "pypi.org"]
+
+@pytest.fixture
+def index():
+    return WebsiteIndex(WEBSITES)
+
+@pytest.fixture
+def alice(server_db):
+    database.add_user("alice", "$2b$04$hash-a")
+    user_id = database.get_user_by_username("alice")[0]
+    for website in WEBSITES:
+        database.add_password(user_id, website, b"\x01secret")
+    yield user_id
+    drop_index(user_id)
+
+def test_prefix_is_case_insensitive_and_sorted(index):
+    assert index.prefix("git") == ["GitHub.com", "gitlab.com"]
+    assert index.prefix("GOO") == ["google.com"]
+    assert index.prefix("git", limit=1) == ["GitHub.com"]
+
+@pytest.mark.parametrize("dense", [False, True])
+def test_substring_matches_anywhere(index, monkeypatch, dense):
+    if dense:
+        monkeypatch.setattr(search, "DENSE_CANDIDATES", 0)
+    assert index.substring("google") == ["google.com", "mail.google.com"]
+    assert index.substring(".org") == ["docs.python.org", "example.org", "pypi.org"]
+    assert index.substring("py") == ["docs.python.org", "pypi.org"]
+    assert index.substring("x") == ["bank.example", "example.org"]
+    assert index.substring("nowhere") == []
+
+def test_fuzzy_tolerates_one_typo(index):
+    assert index.fuzzy("gihtub") == ["GitHub.com"]  # adjacent swap
+    assert index.fuzzy("gthub") == ["GitHub.com"]   # deletion
+    assert index.fuzzy("gitlub") == ["GitHub.com", "gitlab.com"]
+    assert index.fuzzy("gti") == []  # too short for typo tolerance
+
+def test_search_ranks_prefix_then_substring_then_fuzzy(index):
+    assert index.search("goo") == ["google.com", "mail.google.com"]
+    assert index.search("exampl") == ["example.org", "bank.example"]
+    assert index.search("gthub") == ["GitHub.com"]
+
+def test_add_and_remove_keep_postings_in_step(index):
+    index.add("GitHub.com")
+    index.add("gitea.io")
+    index.remove("gitlab.com")
+    assert len(index) == len(WEBSITES)
+    assert index.substring("git") == ["gitea.io", "GitHub.com"]
+
+def test_index_follows_writes_after_it_is_built(alice):
+    assert search.search(alice, "mail") == ["mail.google.com"]
+    database.add_password(alice, "mailbox.org", b"\x01secret")
+    database.delete_password(alice, "mail.google.com")
+    assert search.search(alice, "mail") == ["mailbox.org"]
+
+def test_writes_during_a_build_are_applied_before_it_is_published(alice, monkeypatch):
+    def read_then_write(user_id):
+        websites = database.get_websites(user_id)
+        database.add_password(user_id, "added-meanwhile.example", b"\x01secret")
+        database.delete_password(user_id, "pypi.org")
+        return websites
+    monkeypatch.setattr(search, "read_websites", read_then_write)
+
+    index = get_index(alice)
+    assert search.get_index(alice) is index
+    assert index.prefix("added") == ["added-meanwhile.example"]
+    assert index.prefix("pypi") == []
+
+def test_search_falls_back_to_sql_while_another_thread_builds(alice, monkeypatch):
+    reading, release = threading.Event(), threading.Event()
+    def slow_read(user_id):
+        reading.set()
+        release.wait()
+        return database.get_websites(user_id)
+    monkeypatch.setattr(search, "read_websites", slow_read)
+
+    builder = threading.Thread(target=get_index, args=(alice,))
+    builder.start()
+    reading.wait()
+    try:
+        assert get_index(alice, wait=False) is None
+        assert search.search(alice, "google") == ["google.com"]  # SQL prefix only, no substring matches
+    finally:
+        release.set()
+        builder.join()
+    assert search.search(alice, "google") == ["google.com", "mail.google.com"]
+
+def test_an_index_dropped_during_its_build_is_not_kept(alice, monkeypatch):
+    def read_then_logout(user_id):
+        drop_index(user_id)
+        return database.get_websites(user_id)
+    monkeypatch.setattr(search, "read_websites", read_then_logout)
+
+    assert len(get_index(alice)) == len(WEBSITES)
+    assert alice not in search._indexes and alice not in search._building
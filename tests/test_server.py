@@ -0,0 +1,59 @@
+import asyncio
+import json
+import pytest
+from keys import key_cache
+from server import SessionStore, VaultServer
+
+@pytest.fixture
+def server(server_db):
+    vault_server = VaultServer()
+    yield vault_server
+    vault_server.close()
+
+def call(server: VaultServer, **request) -> dict:
+    return asyncio.run(server.dispatch(json.dumps(request).encode()))
+
+def login(server: VaultServer, username: str) -> str:
+    call(server, op="register", username=username, password="master")
+    response = call(server, op="login", username=username, password="master")
+    assert response["ok"], response
+    return response["token"]
+
+def test_session_round_trip(server):
+    token = login(server, "alice")
+    assert call(server, op="put", token=token, website="example.com", password="hunter2", id=7) == {"ok": True, "id": 7}
+    assert call(server, op="get", token=token, website="example.com") == {"ok": True, "password": "hunter2"}
+    assert call(server, op="list", token=token) == {"ok": True, "websites": ["example.com"], "total": 1}
+    assert call(server, op="delete", token=token, website="example.com") == {"ok": True}
+    assert not call(server, op="get", token=token, website="example.com")["ok"]
+
+def test_bad_requests_get_an_error_back(server):
+    assert asyncio.run(server.dispatch(b"not json")) == {"ok": False, "error": "Request is not valid JSON."}
+    assert not call(server, op="get", token="made-up", website="example.com")["ok"]
+    assert not call(server, op="login", username="nobody", password="x")["ok"]
+    assert call(server, op="shutdown")["error"] == "Unknown op: 'shutdown'"
+
+def test_sessions_keep_their_key_unlocked_until_the_last_one_ends(server, monkeypatch):
+    monkeypatch.setattr(key_cache, "max_entries", 1)
+    first, second = login(server, "alice"), call(server, op="login", username="alice", password="master")["token"]
+    user_id = server.sessions.user_id(first)
+    for name in ("bob", "carol"):  # Logins that would evict alice's key if it were not pinned
+        login(server, name)
+    assert user_id in key_cache
+
+    assert call(server, op="logout", token=first) == {"ok": True}
+    assert not call(server, op="list", token=first)["ok"]
+    assert call(server, op="list", token=second)["ok"] and user_id in key_cache
+    call(server, op="logout", token=second)
+    assert user_id not in key_cache
+
+def test_idle_sessions_expire_and_release_their_key(server_db):
+    vault_server = VaultServer(SessionStore(idle_ttl=0))
+    try:
+        token = login(vault_server, "alice")
+        user_id = vault_server.sessions._sessions[token][0]
+        vault_server.sessions.expire()
+        assert user_id not in key_cache
+        assert not call(vault_server, op="list", token=token)["ok"]
+    finally:
+        vault_server.close()